@@ -0,0 +1,294 @@
+# bachgen/accidentals.py
+from __future__ import annotations
+from typing import Dict, List, Optional, Set
+import time
+
+from music21 import chord, note, pitch, stream
+
+# Moteur d'altérations "à tables" : reproduit les altérations imprimées par music21
+# (Part.makeAccidentals avec ses paramètres par défaut, appelé par l'export MusicXML)
+# en travaillant sur des enregistrements légers au lieu d'objets Pitch copiés.
+
+_SHARP_ORDER = "FCGDAEB"
+_FLAT_ORDER = "BEADGCF"
+_STEPS = "CDEFGAB"
+
+# sharps -> {step: nom de l'altération} et noms diatoniques de la tonalité
+_KEY_ALTERED: Dict[int, Dict[str, str]] = {}
+_KEY_DIATONIC: Dict[int, Set[str]] = {}
+for _s in range(-7, 8):
+    _altered = {st: "sharp" for st in _SHARP_ORDER[:_s]} if _s > 0 else {st: "flat" for st in _FLAT_ORDER[:-_s]}
+    _KEY_ALTERED[_s] = _altered
+    _KEY_DIATONIC[_s] = {st + ("#" if _altered.get(st) == "sharp" else "-" if _altered.get(st) == "flat" else "")
+                         for st in _STEPS}
+
+_MODIFIER = {None: "", "natural": "", "sharp": "#", "flat": "-", "double-sharp": "##", "double-flat": "--"}
+
+# champs d'un enregistrement de hauteur
+_STEP, _OCT, _ACC, _STATUS, _PITCH = range(5)
+
+
+def _record(p: pitch.Pitch) -> list:
+    acc = p.accidental
+    return [p.step, p.octave, acc.name if acc is not None else None,
+            acc.displayStatus if acc is not None else None, p]
+
+
+def _name(r: list) -> str:
+    return r[_STEP] + _MODIFIER[r[_ACC]]
+
+
+def _name_with_octave(r: list) -> str:
+    return _name(r) + str(r[_OCT])
+
+
+def _set_status(r: list, status: bool) -> None:
+    # équivalent de set_displayStatus : une note sans altération reçoit un bécarre
+    if r[_ACC] is None:
+        r[_ACC] = "natural"
+    r[_STATUS] = status
+
+
+def _update(r: list, past: List[list], past_measure: List[list], altered: Dict[str, str],
+            tied: bool, simultaneous: List[list]) -> None:
+    """
+    Décide l'affichage de l'altération d'une hauteur, comme Pitch.updateAccidentalDisplay
+    avec cautionaryPitchClass=True, cautionaryAll=False, cautionaryNotImmediateRepeat=True
+    et overrideStatus=False.
+    """
+    acc = r[_ACC]
+    if acc is not None and r[_STATUS] is not None:
+        return  # déjà fixé, on ne l'écrase pas
+
+    step = r[_STEP]
+    name_in_key = acc is not None and altered.get(step) == acc
+    step_in_key = step in altered
+
+    if tied:
+        if acc is not None:
+            r[_STATUS] = False
+        return
+
+    if any(o[_STEP] == step and _MODIFIER[o[_ACC]] != _MODIFIER[acc] for o in simultaneous):
+        _set_status(r, True)
+        return
+
+    past_all = past_measure + past
+    if not past_all:
+        if acc is not None:
+            r[_STATUS] = step_in_key if acc == "natural" else not name_in_key
+        elif step_in_key:
+            _set_status(r, True)
+        return
+
+    name = _name(r)
+    for pp in reversed(past):
+        if pp[_STEP] == step and pp[_OCT] == r[_OCT]:
+            if _name(pp) != name:
+                _set_status(r, True)
+                return
+            break
+
+    set_from_past = False
+    display_if_no_previous = False
+    out_len = len(past_measure)
+    name_oct = name + str(r[_OCT])
+
+    for i in range(len(past_all) - 1, -1, -1):
+        if i < out_len:
+            in_measure = False
+            repeats = False
+        else:
+            in_measure = True
+            repeats = all(_name_with_octave(past_all[j]) == name_oct for j in range(i, len(past_all)))
+
+        if not in_measure and acc is not None and not name_in_key:
+            r[_STATUS] = True
+            return
+
+        pp = past_all[i]
+        if pp[_STEP] != step:
+            continue
+        octave_match = pp[_OCT] == r[_OCT]
+        p_acc = pp[_ACC]
+
+        if repeats and p_acc is not None and pp[_STATUS] is True:
+            if acc is not None:
+                r[_STATUS] = False
+            return
+        elif repeats and p_acc is not None and acc is not None and p_acc == acc:
+            if not name_in_key and (not octave_match or pp[_STATUS] is False):
+                display_if_no_previous = True
+                continue
+            r[_STATUS] = False
+            set_from_past = True
+            break
+        elif p_acc == "natural" and (acc is None or acc == "natural"):
+            if repeats:
+                if step_in_key and not octave_match:
+                    _set_status(r, True)
+                elif acc is not None:
+                    r[_STATUS] = False
+            elif step_in_key:
+                _set_status(r, True)
+            elif acc is not None:
+                r[_STATUS] = False
+            set_from_past = True
+            break
+        elif p_acc is not None and _name(pp) != name and p_acc != "natural" and acc is None:
+            _set_status(r, True)
+            set_from_past = True
+            break
+        elif (p_acc is None or p_acc == "natural") and acc is not None and acc != "natural":
+            r[_STATUS] = True
+            set_from_past = True
+            break
+        elif p_acc is not None and acc is not None and p_acc != acc:
+            r[_STATUS] = True
+            set_from_past = True
+            break
+        elif p_acc is None and acc is not None:
+            r[_STATUS] = step_in_key if acc == "natural" else True
+            set_from_past = True
+            break
+        elif not repeats and p_acc is not None and acc is not None and p_acc == acc and octave_match:
+            if pp[_STATUS] is False:
+                display_if_no_previous = True
+            else:
+                r[_STATUS] = not name_in_key
+                return
+
+    if display_if_no_previous:
+        if not name_in_key:
+            _set_status(r, True)
+        elif acc is not None:
+            r[_STATUS] = False
+    elif not set_from_past and acc is not None:
+        r[_STATUS] = step_in_key if acc == "natural" else not name_in_key
+    elif not set_from_past and acc is None and step_in_key:
+        _set_status(r, True)
+
+
+def _tie_names(n: note.NotRest) -> Set[str]:
+    notes = list(n) if isinstance(n, chord.Chord) else [n]
+    return {x.pitch.nameWithOctave for x in notes if x.tie is not None and x.tie.type != "stop"}
+
+
+def apply_key_accidentals(part: stream.Stream) -> stream.Stream:
+    """
+    Fixe en place displayStatus de chaque altération d'une PartStaff construite par
+    tokens_to_PartStaff, mesure par mesure, à partir de l'armure courante et des hauteurs
+    déjà altérées dans la mesure. Marque la partie comme traitée : l'export MusicXML
+    ne relance donc pas makeAccidentals.
+    """
+    key_sharps: Optional[int] = None  # aucune armure rencontrée
+    past_measure: List[list] = []
+    tie_set: Optional[Set[str]] = None
+    prev_records: List[list] = []
+    prev_last_notrest = None
+
+    for i, m in enumerate(part.getElementsByClass(stream.Measure)):
+        ks = m.keySignature
+        if i > 0:
+            if ks is None:
+                past_measure = prev_records
+            elif key_sharps is not None:
+                diatonic = _KEY_DIATONIC[key_sharps]
+                past_measure = [r for r in prev_records if _name(r) not in diatonic]
+            if prev_last_notrest is not None:
+                tie_set = _tie_names(prev_last_notrest)
+                if ks is not None:
+                    # comme music21 : les noms avec octave ne sont jamais dans la gamme (sans octave)
+                    diatonic = _KEY_DIATONIC[ks.sharps]
+                    tie_set = {t for t in tie_set if t in diatonic}
+        if ks is not None:
+            key_sharps = ks.sharps
+
+        altered = _KEY_ALTERED[key_sharps] if key_sharps is not None else {}
+        ties = tie_set if tie_set is not None else set()
+        past: List[list] = []
+        prev_last_notrest = None
+
+        for e in m.recurse().notesAndRests:
+            if isinstance(e, note.Note):
+                r = _record(e.pitch)
+                _update(r, past, past_measure, altered, r[_PITCH].nameWithOctave in ties, [])
+                past.append(r)
+                ties.clear()
+                if e.tie is not None and e.tie.type != "stop":
+                    ties.add(e.pitch.nameWithOctave)
+            elif isinstance(e, chord.Chord):
+                records = [_record(p) for p in e.pitches]
+                seen = set()
+                for n_, r in zip(list(e), records):
+                    others = [o for o in records if o is not r]
+                    _update(r, past, past_measure, altered, r[_PITCH].nameWithOctave in ties, others)
+                    if n_.tie is not None and n_.tie.type != "stop":
+                        seen.add(r[_PITCH].nameWithOctave)
+                ties.clear()
+                ties.update(seen)
+                past += records
+            else:
+                ties.clear()
+            if isinstance(e, note.NotRest): # measure[NotRest][-1] est récursif
+                prev_last_notrest = e
+
+        # écriture des décisions dans les objets music21
+        for r in past:
+            p = r[_PITCH]
+            if r[_ACC] is None:
+                continue
+            if p.accidental is None:
+                p.accidental = pitch.Accidental("natural")
+            p.accidental.displayStatus = r[_STATUS]
+        prev_records = past
+        if tie_set is not None:
+            tie_set = ties
+
+    part.streamStatus.accidentals = True
+    return part
+
+
+# -------------------------
+# Benchmark
+# -------------------------
+
+def benchmark_accidentals(token_string: str, repeat: int = 5) -> Dict[str, float]:
+    """
+    Compare, sur les deux mains, le temps de la passe d'altérations music21 et du moteur
+    à tables (la PartStaff est reconstruite à chaque essai, seul le passage est chronométré).
+    Renvoie {mode: secondes par séquence}.
+    """
+    from bachgen.tokens_to_score import tokens_to_PartStaff, split_hands
+
+    passes = {
+        "music21": lambda p: p.makeAccidentals(inPlace=True),
+        "table": apply_key_accidentals,
+    }
+    hands = [h for h in split_hands(token_string.split()) if h]
+    results: Dict[str, float] = {}
+    for mode, fn in passes.items():
+        total = 0.0
+        for _ in range(repeat):
+            for tokens in hands:
+                p = tokens_to_PartStaff(tokens, start_voice=0, regular=True, accidentals=None)
+                start = time.perf_counter()
+                fn(p)
+                total += time.perf_counter() - start
+        results[mode] = total / repeat
+    print(f"⏱️ music21 : {results['music21'] * 1000:.1f} ms | table : {results['table'] * 1000:.1f} ms "
+          f"(x{results['music21'] / results['table']:.2f})")
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    from pathlib import Path
+
+    if len(sys.argv) > 1:
+        benchmark_accidentals(Path(sys.argv[1]).read_text(encoding="utf-8"))
+    else:
+        measure = ("bar note_Bb4 note_D5 len_1 note_B4 len_1/2 note_C#5 len_1/2 note_Eb5 len_1 "
+                   "tie_start note_Eb5 len_1 tie_stop ")
+        benchmark_accidentals("R bar key_flat_2 time_4/4 clef_treble " + measure * 200
+                              + "L bar key_flat_2 time_4/4 clef_bass " + measure.replace("5", "3") * 200)
@@ -4,9 +4,12 @@ from pathlib import Path
 from typing import List, Dict, Iterable, Set, Tuple, Optional
 
 import json
+from itertools import repeat
 import torch
 from transformers import GPT2LMHeadModel
 
+from bachgen.vocab_utils import Vocab
+
 # ——— Chargement vocab & modèle ————————————————————————————————
 
 def load_vocab(vocab_path: str | Path) -> Tuple[Dict[str, int], Dict[int, str], int, int, int]:
@@ -39,20 +42,16 @@ def tokens_to_ids(tokens: List[str], tok2id: Dict[str, int], unk_token: str = "[
     if unk_id is None:
         # si pas d’UNK, on lève explicitement: mieux vaut savoir
         raise ValueError("Vocabulaire sans [UNK] – ajoute-le aux specials lors de la construction.")
-    return [tok2id.get(t, unk_id) for t in tokens]
+    return list(map(tok2id.get, tokens, repeat(unk_id)))
 
 
 def ids_to_tokens(ids: Iterable[int],
                   id2tok: Dict[int, str],
                   drop: Optional[Set[str]] = None) -> List[str]:
-    drop = drop or set()
-    out = []
-    for i in ids:
-        t = id2tok.get(int(i), "[UNK]")
-        if t in drop:
-            continue
-        out.append(t)
-    return out
+    out = map(id2tok.get, map(int, ids), repeat("[UNK]"))
+    if drop:
+        return [t for t in out if t not in drop]
+    return list(out)
 
 
 # ——— Échantillonnage & génération ——————————————————————————————
@@ -131,11 +130,12 @@ def generate_tokens_from_primer(
     Charge modèle + vocab, encode le primer, génère les ids puis redécode en tokens.
     """
     model = load_model(model_dir)
-    tok2id, id2tok, PAD, BOS, EOS = load_vocab(vocab_path)
+    vocab = Vocab.load(vocab_path)
+    tok2id = vocab.token2id
 
     # encode primer (on préfixe BOS s’il existe dans le vocab)
-    primer_ids = [tok2id.get("<BOS>", tok2id.get("<bos>", 2))]
-    primer_ids += tokens_to_ids(primer_tokens, tok2id)
+    primer_ids = [vocab.bos_id if vocab.bos_id is not None else 2]
+    primer_ids += vocab.encode(primer_tokens).tolist()
 
     # ids d’arrêt
     stop_ids: Set[int] = set()
@@ -160,5 +160,5 @@ def generate_tokens_from_primer(
 
     # nettoyage et décodage
     drop = drop_specials or {"<BOS>", "<EOS>", "[PAD]"}
-    tokens = ids_to_tokens(gen_ids, id2tok, drop=drop)
+    tokens = vocab.decode(gen_ids, drop_specials=drop)
     return tokens
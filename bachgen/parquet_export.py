@@ -0,0 +1,195 @@
+# bachgen/parquet_export.py
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence
+from pathlib import Path
+import math
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pads
+import pyarrow.parquet as pq
+
+from bachgen.vocab_utils import Vocab, as_vocab, file_stem, iter_token_lines
+
+# Export du corpus de tokens en dataset Parquet : une ligne par partition, avec
+#   stem | n_tokens | tokens (list<string>) | ids (list<uint16>) | stats de tokenisation | métadonnées PDMX
+# La clé de jointure est le "stem" : nom du fichier sans extension, commun au .mxl de PDMX,
+# au .musicxml converti, au .txt de tokens et à la colonne `file` du CSV de stats.
+
+
+def load_metadata(
+    stats_csv: Optional[Path | str] = None,
+    pdmx: Optional[Path | str | pd.DataFrame] = None,
+    pdmx_cols: Optional[Sequence[str]] = None,
+    path_col: str = "mxl",
+) -> pd.DataFrame:
+    """
+    Réunit les stats de tokenize_folder_with_stats et les métadonnées PDMX (CSV ou DataFrame
+    déjà filtré par data_filter) en un DataFrame indexé par stem (un stem en double ne garde
+    que sa première ligne, dans les deux sources).
+    """
+    frames: List[pd.DataFrame] = []
+    if stats_csv is not None:
+        stats = pd.read_csv(stats_csv)
+        stats.index = stats.pop("file").map(file_stem)
+        frames.append(stats[~stats.index.duplicated()])  # même stem dans deux dossiers : 1re ligne gardée
+    if pdmx is not None:
+        df = pdmx if isinstance(pdmx, pd.DataFrame) else pd.read_csv(pdmx)
+        if path_col not in df.columns:
+            raise ValueError(f"Colonne '{path_col}' introuvable dans les métadonnées PDMX.")
+        df = df.dropna(subset=[path_col])
+        keep = list(pdmx_cols) if pdmx_cols is not None else [c for c in df.columns if c != path_col]
+        meta = df[keep].copy()
+        meta.index = df[path_col].map(file_stem)
+        frames.append(meta[~meta.index.duplicated()])
+    if not frames:
+        return pd.DataFrame(index=pd.Index([], name="stem"))
+    out = pd.concat(frames, axis=1, join="outer")
+    out.index.name = "stem"
+    return out
+
+
+def _partition_value(v) -> str:
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return "__null__"
+    return str(v).replace("/", "_").replace("=", "_")
+
+
+def export_token_dataset(
+    token_dir: Path | str,
+    out_dir: Path | str,
+    vocab: Optional[Path | str | Dict[str, int] | Vocab] = None,
+    stats_csv: Optional[Path | str] = None,
+    pdmx: Optional[Path | str | pd.DataFrame] = None,
+    pdmx_cols: Optional[Sequence[str]] = None,
+    path_col: str = "mxl",
+    pattern: str = "*.txt",
+    with_tokens: bool = True,
+    partition_col: Optional[str] = None,
+    rows_per_file: int = 2000,
+    add_bos: bool = True,
+    add_eos: bool = True,
+    verbose: bool = True,
+) -> Path:
+    """
+    Écrit le corpus token_dir en fichiers Parquet (out_dir/part-XXXXX.parquet, ou
+    out_dir/<partition_col>=<valeur>/part-XXXXX.parquet si partition_col est donné).
+
+    Args:
+        vocab: vocab.json / dict / Vocab ; ajoute une colonne `ids` (list<uint16>)
+        stats_csv: CSV de tokenize_folder_with_stats (joint sur la colonne `file`)
+        pdmx: PDMX.csv ou DataFrame filtré (joint sur le stem de la colonne `path_col`)
+        pdmx_cols: colonnes PDMX à garder (toutes par défaut)
+        with_tokens: garde la colonne `tokens` (list<string>)
+        partition_col: colonne de métadonnées servant de partition (ex. "genres") ;
+            la colonne reste aussi dans les fichiers, pour load_dataset
+        rows_per_file: nombre de partitions par fichier Parquet
+
+    Returns:
+        out_dir
+    """
+    token_dir, out_dir = Path(token_dir), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if isinstance(vocab, (str, Path)):
+        vocab = Vocab.load(vocab)
+    elif vocab is not None:
+        vocab = as_vocab(vocab)
+
+    meta = load_metadata(stats_csv, pdmx, pdmx_cols, path_col)
+    if partition_col is not None and partition_col not in meta.columns:
+        raise ValueError(f"Colonne de partition '{partition_col}' absente des métadonnées.")
+    # schéma figé une fois pour toutes : les types ne changent pas d'un fichier à l'autre
+    meta_schema = pa.Schema.from_pandas(meta, preserve_index=False)
+
+    files = sorted(token_dir.glob(pattern))
+    n_rows = 0
+    for part, start in enumerate(range(0, len(files), rows_per_file)):
+        chunk = files[start:start + rows_per_file]
+        stems = [file_stem(f) for f in chunk]
+        seqs = [[t for toks in iter_token_lines([f]) for t in toks] for f in chunk]
+
+        columns: Dict[str, pa.Array] = {
+            "stem": pa.array(stems, type=pa.string()),
+            "n_tokens": pa.array([len(s) for s in seqs], type=pa.int32()),
+        }
+        if with_tokens:
+            columns["tokens"] = pa.array(seqs, type=pa.list_(pa.string()))
+        if vocab is not None:
+            flat, offsets = vocab.encode_batch(seqs, add_bos=add_bos, add_eos=add_eos)
+            values = pa.array(flat, type=pa.uint16() if flat.dtype == np.uint16 else pa.uint32())
+            columns["ids"] = pa.ListArray.from_arrays(pa.array(offsets.astype(np.int32)), values)
+        table = pa.table(columns)
+        meta_rows = pa.Table.from_pandas(meta.reindex(stems), schema=meta_schema, preserve_index=False)
+        for name in meta_rows.column_names:
+            table = table.append_column(name, meta_rows[name])
+
+        if partition_col is None:
+            pq.write_table(table, out_dir / f"part-{part:05d}.parquet")
+        else:
+            keys = [_partition_value(v) for v in table[partition_col].to_pylist()]
+            for key in sorted(set(keys)):
+                mask = pa.array([k == key for k in keys])
+                sub_dir = out_dir / f"{partition_col}={key}"
+                sub_dir.mkdir(parents=True, exist_ok=True)
+                pq.write_table(table.filter(mask), sub_dir / f"part-{part:05d}.parquet")
+        n_rows += table.num_rows
+
+    if verbose:
+        print(f"🗃️ {n_rows} partitions exportées en Parquet dans {out_dir}")
+    return out_dir
+
+
+def _parquet_files(out_dir: Path | str) -> List[str]:
+    return sorted(str(p) for p in Path(out_dir).rglob("*.parquet"))
+
+
+def load_token_dataset(
+    out_dir: Path | str,
+    streaming: bool = True,
+    filters=None,
+    columns: Optional[List[str]] = None,
+):
+    """
+    Charge l'export avec datasets.load_dataset("parquet", ...).
+
+    Args:
+        filters: prédicat pyarrow (ex. [("genres", "=", "classical"), ("n_tokens", "<", 4000)])
+            poussé jusqu'aux fichiers Parquet (statistiques des row groups)
+        columns: colonnes à lire (ex. ["ids"] pour l'entraînement)
+    """
+    from datasets import load_dataset  # import local : seul ce lecteur en dépend
+
+    kwargs = {}
+    if filters is not None:
+        kwargs["filters"] = filters
+    if columns is not None:
+        kwargs["columns"] = columns
+    return load_dataset("parquet", data_files=_parquet_files(out_dir), split="train", streaming=streaming, **kwargs)
+
+
+def query_token_dataset(
+    out_dir: Path | str,
+    filter: Optional[pads.Expression] = None,
+    columns: Optional[List[str]] = None,
+) -> pa.Table:
+    """
+    Requête directe avec pyarrow.dataset, ex. :
+        query_token_dataset(d, pads.field("composer") == "Bach", columns=["stem", "ids"])
+    """
+    return pads.dataset(_parquet_files(out_dir), format="parquet").to_table(filter=filter, columns=columns)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Exporte un dossier de tokens en dataset Parquet.")
+    parser.add_argument("token_dir")
+    parser.add_argument("out_dir")
+    parser.add_argument("--vocab", default=None)
+    parser.add_argument("--stats", default=None, help="CSV de tokenize_folder_with_stats")
+    parser.add_argument("--pdmx", default=None, help="PDMX.csv")
+    parser.add_argument("--partition", default=None, help="colonne de partition (ex. genres)")
+    args = parser.parse_args()
+    export_token_dataset(args.token_dir, args.out_dir, vocab=args.vocab, stats_csv=args.stats,
+                         pdmx=args.pdmx, partition_col=args.partition)
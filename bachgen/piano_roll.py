@@ -0,0 +1,347 @@
+# bachgen/piano_roll.py
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+from bachgen.token_grammar import SPECIAL_TOKENS, note_to_midi
+from bachgen.vocab_utils import file_stem
+
+# Rendu "piano-roll" sans music21 ni MuseScore : tokens (ou ids) -> événements
+# (main, début, durée, hauteur midi) -> image RGB NumPy -> PNG.
+# Pensé pour contrôler visuellement des milliers d'échantillons sur un serveur headless.
+
+HAND_COLORS = {"R": (235, 95, 60), "L": (60, 145, 235)}
+BAR_COLOR = (85, 85, 85)
+C_COLOR = (38, 38, 38)
+BACKGROUND = (18, 18, 18)
+
+# -------------------------
+# Tokens -> événements
+# -------------------------
+
+def _length(token: str) -> float:
+    # len_<durée>[_stem[_beams]] : seule la durée nous intéresse
+    value = token.split("_")[1]
+    if "/" in value:
+        num, den = value.split("/")
+        return int(num) / int(den)
+    return float(value)
+
+
+def _bar_length(token: str) -> float:
+    # même convention que tokens_to_score.single_token_to_obj
+    value = token.split("_")[1]
+    if "/" in value:
+        num, den = value.split("/")
+        return int(num) * 4 / int(den)
+    return int(value) * (1.0 if int(value) < 6 else 0.5)
+
+
+def _hand_measures(tokens: Sequence[str]) -> List[Tuple[float, List[Tuple[float, float, int]]]]:
+    """
+    Découpe une main en mesures : [(longueur, [(début dans la mesure, durée, midi)])].
+    Toutes les voix démarrent au même point ; ce qui suit les voix reprend après la plus longue.
+    """
+    measures: List[Tuple[float, List[Tuple[float, float, int]]]] = []
+    bar_length = 4.0
+    notes: List[Tuple[float, float, int]] = []
+    cursor = 0.0
+    voice_start: Optional[float] = None
+    voices_end = 0.0
+    in_voice = False
+    pitches: List[int] = []
+    duration = 0.0
+    in_group = False
+
+    def flush_group():
+        nonlocal cursor, duration, in_group, pitches
+        if in_group:
+            for p in pitches:
+                notes.append((cursor, duration, p))
+            cursor += duration
+        pitches, duration, in_group = [], 0.0, False
+
+    def open_group():
+        nonlocal cursor, in_group
+        flush_group()
+        if not in_voice and voice_start is not None:
+            cursor = max(cursor, voices_end)
+        in_group = True
+
+    def close_measure():
+        nonlocal notes, cursor, voice_start, voices_end
+        flush_group()
+        # comme music21 : une mesure dure ce que dure son contenu (anacrouse comprise) ;
+        # une mesure vide garde la longueur de la métrique pour rester visible
+        measures.append((max(cursor, voices_end) or bar_length, notes))
+        notes, cursor, voice_start, voices_end = [], 0.0, None, 0.0
+
+    started = False
+    for t in tokens:
+        head = t.split("_", 1)[0]
+        if t == "bar":
+            if started:
+                close_measure()
+            started = True
+        elif head == "note":
+            if not in_group or duration:
+                open_group()
+            pitches.append(note_to_midi(t[5:]))
+        elif t == "rest":
+            open_group()  # un silence avance le curseur sans produire de note
+        elif head in ("len", "attr"):
+            duration += _length(t)  # plusieurs len = notes liées
+        elif head in ("stem", "beam", "tie"):
+            continue
+        elif t == "<voice>":
+            flush_group()
+            if voice_start is None:
+                voice_start = cursor
+            cursor = voice_start
+            in_voice = True
+        elif t == "</voice>":
+            flush_group()
+            voices_end = max(voices_end, cursor)
+            cursor = voice_start
+            in_voice = False
+        else:
+            flush_group()
+            if head == "time":
+                bar_length = _bar_length(t)
+    if started:
+        close_measure()
+    return measures
+
+
+def _as_tokens(seq, id2token: Optional[Dict[int, str]] = None) -> List[str]:
+    """Chaîne, liste de tokens, ou ids (liste / NumPy / tenseur, avec id2token) -> liste de tokens."""
+    if isinstance(seq, str):
+        seq = seq.split()
+    elif hasattr(seq, "tolist"):
+        seq = seq.tolist()
+        if len(seq) == 1 and isinstance(seq[0], list):  # lot de taille 1
+            seq = seq[0]
+    seq = list(seq)
+    if seq and not isinstance(seq[0], str):
+        if id2token is None:
+            raise ValueError("id2token est obligatoire pour rendre une séquence d'ids.")
+        seq = [id2token.get(int(i), "[UNK]") for i in seq]
+    return [t for t in seq if t not in SPECIAL_TOKENS and t != "[UNK]"]
+
+
+def tokens_to_events(seq, id2token: Optional[Dict[int, str]] = None) -> Dict[str, np.ndarray | float]:
+    """
+    Convertit une séquence en événements alignés mesure par mesure sur les deux mains.
+
+    Returns:
+        {"notes": float32 (N, 4) [main (0=R, 1=L), début, durée, midi] (en noires),
+         "bars": float32 (M,) débuts des mesures, "length": durée totale}
+    """
+    tokens = _as_tokens(seq, id2token)
+    if "R" in tokens and "L" in tokens and tokens.index("R") < tokens.index("L"):
+        hands = [tokens[tokens.index("R") + 1:tokens.index("L")], tokens[tokens.index("L") + 1:]]
+    else:
+        hands = [tokens[tokens.index("R") + 1:] if "R" in tokens else tokens, []]
+    per_hand = [_hand_measures(h) for h in hands]
+
+    # une mesure dure autant que la plus longue des deux mains
+    n_measures = max(len(m) for m in per_hand)
+    lengths = np.zeros(n_measures, dtype=np.float32)
+    for measures in per_hand:
+        for i, (length, _) in enumerate(measures):
+            lengths[i] = max(lengths[i], length)
+    starts = np.concatenate([[0.0], np.cumsum(lengths)[:-1]]).astype(np.float32)
+
+    rows = [(hand, starts[i] + onset, dur, midi)
+            for hand, measures in enumerate(per_hand)
+            for i, (_, notes) in enumerate(measures)
+            for onset, dur, midi in notes]
+    notes = np.array(rows, dtype=np.float32).reshape(-1, 4)
+    return {"notes": notes, "bars": starts, "length": float(lengths.sum())}
+
+
+# -------------------------
+# Événements -> image
+# -------------------------
+
+def render_piano_roll(
+    seq,
+    id2token: Optional[Dict[int, str]] = None,
+    px_per_quarter: int = 8,
+    px_per_semitone: int = 3,
+    pitch_range: Tuple[int, int] = (21, 108),
+    max_quarters: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Rend une séquence (tokens ou ids) en image RGB uint8 (hauteur, largeur, 3) :
+    aigus en haut, main droite / gauche en couleurs distinctes, barres de mesure verticales.
+
+    Args:
+        px_per_quarter: largeur d'une noire en pixels
+        px_per_semitone: hauteur d'un demi-ton en pixels
+        pitch_range: (midi bas, midi haut) inclus ; les notes hors plage sont ramenées au bord
+        max_quarters: ne rend que le début de la pièce (None = tout)
+    """
+    events = tokens_to_events(seq, id2token)
+    length = events["length"] if max_quarters is None else min(events["length"], max_quarters)
+    low, high = pitch_range
+    height = (high - low + 1) * px_per_semitone
+    width = max(1, int(np.ceil(length * px_per_quarter)))
+
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = BACKGROUND
+    for midi in range(low + (-low) % 12, high + 1, 12):  # repères des do
+        y = (high - midi) * px_per_semitone + px_per_semitone - 1
+        img[y, :] = C_COLOR
+    for start in events["bars"]:
+        x = int(round(start * px_per_quarter))
+        if x < width:
+            img[:, x] = BAR_COLOR
+
+    colors = np.array([HAND_COLORS["R"], HAND_COLORS["L"]], dtype=np.uint8)
+    for hand, onset, dur, midi in events["notes"]:
+        x0 = int(round(onset * px_per_quarter))
+        if x0 >= width:
+            continue
+        x1 = min(width, max(x0 + 1, int(round((onset + dur) * px_per_quarter)) - 1))  # 1 px d'écart entre notes répétées
+        y0 = (high - int(np.clip(midi, low, high))) * px_per_semitone
+        img[y0:y0 + px_per_semitone, x0:x1] = colors[int(hand)]
+    return img
+
+
+def save_png(img: np.ndarray, path: Path | str) -> Path:
+    from PIL import Image  # import local : le raster NumPy ne dépend pas de Pillow
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.fromarray(img).save(path)
+    return path
+
+
+# -------------------------
+# Traitement par lot
+# -------------------------
+
+def _read_sequence(path: Path, id2token: Optional[Dict[int, str]]) -> List[str] | List[int]:
+    parts = Path(path).read_text(encoding="utf-8").split()
+    if parts and all(p.isdigit() for p in parts):  # fichier .ids.txt
+        if id2token is None:
+            raise ValueError(f"{path.name} contient des ids : vocab_path est obligatoire.")
+        return [int(p) for p in parts]
+    return parts
+
+
+def _render_one(args) -> Tuple[str, Optional[str], Optional[str]]:
+    path, out_path, id2token, kwargs = args
+    try:
+        img = render_piano_roll(_read_sequence(path, id2token), id2token, **kwargs)
+        save_png(img, out_path)
+        return str(path), str(out_path), None
+    except Exception as e:
+        return str(path), None, str(e)
+
+
+def render_dir(
+    src_dir: Path | str,
+    out_dir: Path | str,
+    vocab_path: Optional[Path | str] = None,
+    pattern: str = "*.txt",
+    workers: Optional[int] = None,
+    sheet: bool = True,
+    verbose: bool = True,
+    **kwargs,
+) -> List[Path]:
+    """
+    Rend tous les fichiers 'pattern' de src_dir (tokens ou ids) en PNG dans out_dir, en parallèle.
+
+    Args:
+        vocab_path: vocab.json, nécessaire pour les fichiers d'ids
+        workers: nombre de processus (None = os.cpu_count(), 1 = séquentiel)
+        sheet: écrit aussi une planche contact out_dir/contact_sheet.png
+        kwargs: passés à render_piano_roll (px_per_quarter, max_quarters, ...)
+
+    Returns:
+        La liste des PNG écrits (dans l'ordre des fichiers sources).
+    """
+    src_dir, out_dir = Path(src_dir), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    id2token = None
+    if vocab_path is not None:
+        from bachgen.vocab_utils import load_vocab
+        _, id2token = load_vocab(Path(vocab_path))
+
+    files = sorted(src_dir.glob(pattern))
+    jobs = [(f, out_dir / (file_stem(f) + ".png"), id2token, kwargs) for f in files]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [_render_one(j) for j in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(_render_one, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+    written = [Path(out) for _, out, err in results if err is None]
+    failed = [(src, err) for src, _, err in results if err is not None]
+    if verbose:
+        print(f"🎹 {len(written)} piano-rolls écrits dans {out_dir}, ❌ {len(failed)} échecs")
+        for src, err in failed[:10]:
+            print(f"  - {Path(src).name} : {err}")
+
+    if sheet and written:
+        path = out_dir / "contact_sheet.png"
+        contact_sheet(written).save(path)
+        if verbose:
+            print(f"🖼️ Planche contact : {path}")
+    return written
+
+
+def contact_sheet(
+    images: Iterable[Path | str | np.ndarray],
+    cols: int = 6,
+    thumb_size: Tuple[int, int] = (320, 120),
+    labels: Optional[Sequence[str]] = None,
+    margin: int = 4,
+):
+    """
+    Assemble des piano-rolls (chemins PNG ou tableaux NumPy) en une grille PIL.Image.
+    Chaque vignette est redimensionnée à thumb_size ; le nom du fichier sert de légende par défaut.
+    """
+    from PIL import Image, ImageDraw
+
+    images = list(images)
+    if labels is None:
+        labels = [Path(i).stem if not isinstance(i, np.ndarray) else str(k) for k, i in enumerate(images)]
+    cols = max(1, min(cols, len(images)))
+    rows = (len(images) + cols - 1) // cols
+    w, h = thumb_size
+    sheet = Image.new("RGB", (cols * (w + margin) + margin, rows * (h + margin) + margin), (0, 0, 0))
+    draw = ImageDraw.Draw(sheet)
+    for k, (img, label) in enumerate(zip(images, labels)):
+        if isinstance(img, np.ndarray):
+            im = Image.fromarray(img)
+        else:
+            with Image.open(img) as f:
+                im = f.convert("RGB")
+        x = margin + (k % cols) * (w + margin)
+        y = margin + (k // cols) * (h + margin)
+        sheet.paste(im.resize((w, h), Image.BILINEAR), (x, y))
+        draw.text((x + 3, y + 2), label, fill=(230, 230, 230))
+    return sheet
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rendu piano-roll (PNG) d'un dossier de séquences de tokens / ids.")
+    parser.add_argument("src_dir")
+    parser.add_argument("out_dir")
+    parser.add_argument("--vocab", default=None, help="vocab.json (pour les fichiers d'ids)")
+    parser.add_argument("--pattern", default="*.txt")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-quarters", type=float, default=None)
+    args = parser.parse_args()
+    render_dir(args.src_dir, args.out_dir, vocab_path=args.vocab, pattern=args.pattern,
+               workers=args.workers, max_quarters=args.max_quarters)
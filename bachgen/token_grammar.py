@@ -0,0 +1,389 @@
+# bachgen/token_grammar.py
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Tuple
+from pathlib import Path
+import re
+
+# Automate fini sur la grammaire des tokens consommée par
+# tokens_to_score.aggr_note_token / tokens_to_PartStaff :
+#
+#   séquence := R main L main
+#   main     := (bar mesure)+
+#   mesure   := (attribut | groupe | <voice> (attribut | groupe)* </voice>)*
+#   groupe   := (note_X+ | rest) len_X+ (stem_X | beam_X | tie_X)*
+#   attribut := clef_X | key_X | time_X
+#
+# Permet d'écarter (ou de réparer) une séquence générée sans passer par music21.
+
+SPECIAL_TOKENS = ("[PAD]", "<BOS>", "<EOS>")
+
+_PITCH_RE = re.compile(r"^(?:[A-G](?:#{1,2}|b{1,2})?-?\d+|\d+)$")
+_LEN_RE = re.compile(r"^\d+(?:/\d+|\.\d+)?$")
+_TIME_RE = re.compile(r"^(\d+)(?:/(\d+))?$")
+_TIME_DENOMINATORS = {"1", "2", "4", "8", "16", "32", "64"}
+
+STEPS = "CDEFGAB"
+STEP_SEMITONES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+
+
+# -------------------------
+# Hauteurs des tokens note_<X> (partagé par piano_roll et training.augment)
+# -------------------------
+
+def parse_pitch(name: str) -> Optional[Tuple[int, int, int]]:
+    """'Bb4' -> (indice du pas, altération, octave) ; None si ce n'est pas un nom de note."""
+    if not name or name[0] not in STEP_SEMITONES:
+        return None
+    i, alter = 1, 0
+    while i < len(name) and name[i] in "#b":
+        alter += 1 if name[i] == "#" else -1
+        i += 1
+    if not name[i:].lstrip("-").isdigit():
+        return None
+    return STEPS.index(name[0]), alter, int(name[i:])
+
+
+def pitch_name(step: int, alter: int, octave: int) -> str:
+    return f"{STEPS[step]}{'#' * alter if alter > 0 else 'b' * -alter}{octave}"
+
+
+def pitch_midi(step: int, alter: int, octave: int) -> int:
+    return 12 * (octave + 1) + STEP_SEMITONES[STEPS[step]] + alter
+
+
+def note_to_midi(name: str) -> int:
+    """'Bb4' / 'D#5' / 'C##3' / '61' -> numéro midi."""
+    if name.isdigit():
+        return int(name)
+    p = parse_pitch(name)
+    if p is None:
+        raise ValueError(f"Nom de note invalide : {name!r}")
+    return pitch_midi(*p)
+
+
+# cache token -> nature (None si le token est invalide)
+_KIND_CACHE: Dict[str, Optional[str]] = {}
+
+
+def token_kind(token: str) -> Optional[str]:
+    """
+    Renvoie la nature d'un token ('note', 'rest', 'len', 'stem', 'beam', 'tie',
+    'attr', 'bar', 'voice_open', 'voice_close', 'R', 'L', 'special')
+    ou None si le token n'est pas reconnu par le détokeniseur.
+    """
+    kind = _KIND_CACHE.get(token, False)
+    if kind is False:
+        kind = _classify(token)
+        _KIND_CACHE[token] = kind
+    return kind
+
+
+def _classify(token: str) -> Optional[str]:
+    if token in ("R", "L", "bar"):
+        return token
+    if token == "<voice>":
+        return "voice_open"
+    if token == "</voice>":
+        return "voice_close"
+    if token == "rest":
+        return "rest"
+    if token in SPECIAL_TOKENS:
+        return "special"
+
+    parts = token.split("_")
+    head = parts[0]
+    if len(parts) < 2 or not parts[1]:
+        return None
+
+    if head == "note":
+        return "note" if len(parts) == 2 and _PITCH_RE.match(parts[1]) else None
+    if head in ("len", "attr"):
+        # forme concaténée len_<durée>[_<stem>[_<beams>...]] (cf. concatenated_to_regular)
+        return "len" if _LEN_RE.match(parts[1]) else None
+    if head in ("stem", "beam"):
+        return head
+    if head == "tie":
+        return "tie" if parts[1] in ("start", "stop", "continue") else None
+    if head == "clef":
+        return "attr" if len(parts) == 2 and parts[1] in ("treble", "bass") else None
+    if head == "key":
+        if len(parts) != 3 or not parts[2].isdigit():
+            return None
+        if parts[1] == "natural":
+            return "attr"
+        if parts[1] in ("sharp", "flat") and 1 <= int(parts[2]) <= 7:
+            return "attr"
+        return None
+    if head == "time":
+        m = _TIME_RE.match(parts[1]) if len(parts) == 2 else None
+        if m is None or int(m.group(1)) == 0:
+            return None
+        if m.group(2) is not None and m.group(2) not in _TIME_DENOMINATORS:
+            return None
+        return "attr"
+    return None
+
+
+# -------------------------
+# Automate
+# -------------------------
+
+# état du groupe de notes en cours
+_NONE, _PITCHES, _REST, _LEN = 0, 1, 2, 3
+
+
+def _scan(tokens: List[str], repair: bool) -> Tuple[List[Tuple[int, str]], List[str]]:
+    """
+    Parcourt la séquence une seule fois.
+    - repair=False : s'arrête à la première erreur.
+    - repair=True  : corrige au fil de l'eau (suppression / insertion minimale).
+    Renvoie (erreurs [(position, message)], séquence réparée).
+    """
+    errors: List[Tuple[int, str]] = []
+    out: List[str] = []
+
+    hand = None          # None (avant R), 'R' ou 'L'
+    has_bar = False      # la main courante a-t-elle déjà une mesure ?
+    group = _NONE
+    group_start = 0      # index (dans out) du début du groupe en cours
+    voice_open = False
+
+    def fail(pos: int, msg: str) -> bool:
+        errors.append((pos, msg))
+        return not repair
+
+    def close_measure(pos: int, what: str) -> bool:
+        # un groupe sans len ou une voix ouverte ne peut pas être refermé par `what`
+        nonlocal group, voice_open
+        if group in (_PITCHES, _REST):
+            if fail(pos, f"note/rest sans len avant {what}"):
+                return True
+            del out[group_start:]
+        group = _NONE
+        if voice_open:
+            if fail(pos, f"<voice> non fermée avant {what}"):
+                return True
+            out.append("</voice>")
+            voice_open = False
+        return False
+
+    for pos, t in enumerate(tokens):
+        kind = token_kind(t)
+
+        if kind == "special":
+            continue
+        if kind is None:
+            if fail(pos, f"token inconnu : {t!r}"):
+                break
+            continue
+
+        if hand is None:
+            if kind != "R":
+                if fail(pos, "la séquence doit commencer par R"):
+                    break
+                out.append("R")
+                hand = "R"
+            else:
+                out.append(t)
+                hand = "R"
+                continue
+
+        if kind == "R":
+            if fail(pos, "R dupliqué"):
+                break
+            continue
+
+        if kind == "L":
+            if hand == "L":
+                if fail(pos, "L dupliqué"):
+                    break
+                continue
+            if close_measure(pos, "L"):
+                break
+            if not has_bar:
+                if fail(pos, "main droite sans mesure (bar manquant)"):
+                    break
+                out.append("bar")
+            out.append(t)
+            hand, has_bar = "L", False
+            continue
+
+        if kind == "bar":
+            if close_measure(pos, "bar"):
+                break
+            out.append(t)
+            has_bar = True
+            continue
+
+        if not has_bar:
+            if fail(pos, f"{t!r} avant le premier bar"):
+                break
+            out.append("bar")
+            has_bar = True
+
+        if kind == "note":
+            if group == _REST:
+                if fail(pos, "note après un rest sans len"):
+                    break
+                continue
+            if group != _PITCHES:
+                group, group_start = _PITCHES, len(out)
+            out.append(t)
+        elif kind == "rest":
+            if group in (_PITCHES, _REST):
+                if fail(pos, "rest à l'intérieur d'un accord"):
+                    break
+                continue
+            group, group_start = _REST, len(out)
+            out.append(t)
+        elif kind == "len":
+            if group == _NONE:
+                if fail(pos, f"{t!r} sans note précédente"):
+                    break
+                continue
+            group = _LEN
+            out.append(t)
+        elif kind in ("stem", "beam", "tie"):
+            if group == _NONE:
+                if fail(pos, f"{t!r} sans note précédente"):
+                    break
+                continue
+            out.append(t)
+        elif kind == "attr":
+            if group in (_PITCHES, _REST):
+                if fail(pos, f"{t!r} à l'intérieur d'un accord"):
+                    break
+                continue
+            group = _NONE
+            out.append(t)
+        elif kind == "voice_open":
+            if group in (_PITCHES, _REST):
+                if fail(pos, "note/rest sans len avant <voice>"):
+                    break
+                del out[group_start:]
+            group = _NONE
+            if voice_open:
+                if fail(pos, "<voice> imbriquée"):
+                    break
+                out.append("</voice>")
+            out.append(t)
+            voice_open = True
+        elif kind == "voice_close":
+            if group in (_PITCHES, _REST):
+                if fail(pos, "note/rest sans len avant </voice>"):
+                    break
+                del out[group_start:]
+            group = _NONE
+            if not voice_open:
+                if fail(pos, "</voice> sans <voice>"):
+                    break
+                continue
+            out.append(t)
+            voice_open = False
+    else:
+        # fin de séquence
+        end = len(tokens)
+        if hand is None:
+            if fail(end, "séquence vide (R manquant)"):
+                return errors, out
+            out.append("R")
+            hand = "R"
+        if close_measure(end, "la fin"):
+            return errors, out
+        if hand == "R":
+            if not has_bar:
+                if fail(end, "main droite sans mesure (bar manquant)"):
+                    return errors, out
+                out.append("bar")
+            if fail(end, "R sans L"):
+                return errors, out
+            out.append("L")
+            has_bar = False
+        if not has_bar:
+            if fail(end, "main gauche sans mesure (bar manquant)"):
+                return errors, out
+            out.append("bar")
+
+    return errors, out
+
+
+def _as_list(tokens: str | Iterable[str]) -> List[str]:
+    return tokens.split() if isinstance(tokens, str) else list(tokens)
+
+
+# -------------------------
+# API
+# -------------------------
+
+def find_first_error(tokens: str | Iterable[str]) -> Optional[Tuple[int, str]]:
+    """
+    Renvoie (position, message) de la première erreur de grammaire, ou None si la séquence
+    peut être passée telle quelle à tokens_to_score.
+    """
+    errors, _ = _scan(_as_list(tokens), repair=False)
+    return errors[0] if errors else None
+
+
+def is_valid_tokens(tokens: str | Iterable[str]) -> bool:
+    return find_first_error(tokens) is None
+
+
+def repair_tokens(tokens: str | Iterable[str]) -> Tuple[List[str], List[Tuple[int, str]]]:
+    """
+    Corrige une séquence de façon minimale :
+    - tokens inconnus, len/stem/beam/tie orphelins, attributs dans un accord -> supprimés
+    - note/rest sans len avant bar, voix ou fin -> groupe supprimé
+    - <voice> non fermée -> </voice> inséré ; </voice> orphelin -> supprimé
+    - R / bar / L manquants -> insérés
+    Renvoie (séquence réparée, liste des erreurs rencontrées).
+    """
+    errors, out = _scan(_as_list(tokens), repair=True)
+    return out, errors
+
+
+def filter_token_files(
+    files: Iterable[Path],
+    repair: bool = False,
+    out_dir: Optional[Path] = None,
+    verbose: bool = True,
+) -> Tuple[List[Path], List[Tuple[Path, int, str]]]:
+    """
+    Valide une liste de fichiers de tokens (1 séquence par fichier).
+
+    Args:
+        files: fichiers .txt de tokens séparés par des espaces
+        repair: si True, les séquences invalides sont réparées et écrites dans out_dir
+        out_dir: dossier de sortie des fichiers réparés (obligatoire si repair=True)
+        verbose: affiche un récapitulatif
+
+    Returns:
+        (fichiers valides, [(fichier invalide, position, message)])
+    """
+    if repair:
+        if out_dir is None:
+            raise ValueError("out_dir est obligatoire avec repair=True.")
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+    valid: List[Path] = []
+    invalid: List[Tuple[Path, int, str]] = []
+    for f in files:
+        f = Path(f)
+        tokens = f.read_text(encoding="utf-8").split()
+        if repair:
+            fixed, errors = repair_tokens(tokens)
+            (out_dir / f.name).write_text(" ".join(fixed), encoding="utf-8")
+        else:
+            err = find_first_error(tokens)
+            errors = [err] if err else []
+        if errors:
+            invalid.append((f, errors[0][0], errors[0][1]))
+        else:
+            valid.append(f)
+
+    if verbose:
+        print(f"✅ {len(valid)} séquences valides, ❌ {len(invalid)} invalides")
+        for f, pos, msg in invalid[:10]:
+            print(f"  - {f.name} @ {pos} : {msg}")
+
+    return valid, invalid
@@ -0,0 +1,269 @@
+# bachgen/token_merges.py
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from collections import Counter, defaultdict
+from pathlib import Path
+import heapq
+import json
+
+import numpy as np
+
+from bachgen.vocab_utils import Vocab
+
+# Fusions "à la BPE" sur les ids : les paires adjacentes les plus fréquentes du corpus
+# (ex. note_C4 + len_1/2, puis (note_C4 len_1/2) + (note_D4 len_1/2)) deviennent des ids composés.
+# Une fusion ne traverse jamais bar, R / L, <voice> / </voice> ni les tokens spéciaux :
+# le corpus est d'abord découpé en segments entre ces frontières, et l'apprentissage se fait
+# sur les segments uniques pondérés par leur fréquence.
+#
+# L'expansion est exacte : chaque id composé se déplie en sa suite d'ids de base, à passer
+# ensuite au décodage habituel (tokens_to_score, Vocab.decode...).
+
+BOUNDARY_TOKENS = ("bar", "R", "L", "<voice>", "</voice>")
+MERGE_SEP = "+"
+
+
+class TokenMerges:
+    def __init__(self, base_vocab: Vocab, merges: Sequence[Tuple[int, int]] = (),
+                 boundary_tokens: Sequence[str] = BOUNDARY_TOKENS) -> None:
+        self.base_vocab = base_vocab
+        self.base_size = len(base_vocab)
+        self.boundary_tokens = tuple(boundary_tokens)
+        self.merges: List[Tuple[int, int]] = []
+        self.ranks: Dict[Tuple[int, int], int] = {}
+        self._expansions: List[Tuple[int, ...]] = [(i,) for i in range(self.base_size)]
+        self._segment_cache: Dict[Tuple[int, ...], Tuple[int, ...]] = {}
+        self._flat = None
+
+        # ids jamais fusionnés : frontières + spéciaux
+        self.boundary_mask = base_vocab.special_mask.copy()
+        for t in self.boundary_tokens:
+            if t in base_vocab.token2id:
+                self.boundary_mask[base_vocab.token2id[t]] = True
+
+        for a, b in merges:
+            self._add_merge(a, b)
+
+    # --- tables ---
+
+    def _add_merge(self, a: int, b: int) -> int:
+        new_id = self.base_size + len(self.merges)
+        self.ranks[(a, b)] = len(self.merges)
+        self.merges.append((a, b))
+        self._expansions.append(self._expansions[a] + self._expansions[b])
+        self._segment_cache.clear()
+        self._flat = None
+        return new_id
+
+    @property
+    def vocab_size(self) -> int:
+        return self.base_size + len(self.merges)
+
+    def token(self, i: int) -> str:
+        """Nom d'un id (de base ou composé), ex. 'note_C4+len_1/2'."""
+        return MERGE_SEP.join(self.base_vocab.id2token[list(self._expansions[i])].tolist())
+
+    def extended_token2id(self) -> Dict[str, int]:
+        """Vocab du modèle : vocab de base + un token par fusion, ids stables (append-only)."""
+        token2id = dict(self.base_vocab.token2id)
+        for i in range(self.base_size, self.vocab_size):
+            token2id[self.token(i)] = i
+        return token2id
+
+    # --- apprentissage ---
+
+    @classmethod
+    def train(
+        cls,
+        sequences: Iterable[Sequence[int]],
+        base_vocab: Vocab,
+        n_merges: int = 500,
+        min_freq: int = 2,
+        boundary_tokens: Sequence[str] = BOUNDARY_TOKENS,
+        verbose: bool = True,
+    ) -> "TokenMerges":
+        """
+        Apprend jusqu'à n_merges fusions sur des séquences d'ids de base (listes, tableaux,
+        PackedCorpus...). S'arrête plus tôt si la meilleure paire apparaît moins de min_freq fois.
+        """
+        self = cls(base_vocab, boundary_tokens=boundary_tokens)
+        segments = Counter()
+        for seq in sequences:
+            for seg in self._segments(np.asarray(seq, dtype=np.int64)):
+                if len(seg) > 1:
+                    segments[seg] += 1
+
+        words: List[List[int]] = [list(w) for w in segments]
+        freqs: List[int] = list(segments.values())
+        pair_counts: Counter = Counter()
+        where: Dict[Tuple[int, int], Set[int]] = defaultdict(set)
+        for idx, (w, f) in enumerate(zip(words, freqs)):
+            for p in zip(w, w[1:]):
+                pair_counts[p] += f
+                where[p].add(idx)
+
+        # tas (-compte, paire) avec invalidation paresseuse
+        heap = [(-c, p) for p, c in pair_counts.items()]
+        heapq.heapify(heap)
+
+        while len(self.merges) < n_merges and heap:
+            neg, pair = heapq.heappop(heap)
+            if pair_counts.get(pair, 0) != -neg:
+                continue  # entrée périmée
+            if -neg < min_freq:
+                break
+            new_id = self._add_merge(*pair)
+            touched = set()
+            for idx in where.pop(pair, ()):
+                w, f = words[idx], freqs[idx]
+                merged = _merge_word(w, pair, new_id)
+                if len(merged) == len(w):
+                    continue
+                for p in zip(w, w[1:]):
+                    pair_counts[p] -= f
+                    touched.add(p)
+                for p in zip(merged, merged[1:]):
+                    pair_counts[p] += f
+                    where[p].add(idx)
+                    touched.add(p)
+                words[idx] = merged
+            pair_counts.pop(pair, None)
+            for p in touched:
+                c = pair_counts.get(p, 0)
+                if c > 0:
+                    heapq.heappush(heap, (-c, p))
+                else:
+                    pair_counts.pop(p, None)
+
+        if verbose:
+            print(f"🔗 {len(self.merges)} fusions apprises sur {len(words)} segments uniques "
+                  f"(vocab {self.base_size} -> {self.vocab_size})")
+        return self
+
+    def _segments(self, ids: np.ndarray) -> List[Tuple[int, ...]]:
+        # segments entre frontières ; les frontières elles-mêmes sont des segments d'un id
+        cuts = np.flatnonzero(self.boundary_mask[ids])
+        out: List[Tuple[int, ...]] = []
+        start = 0
+        for c in cuts.tolist():
+            if c > start:
+                out.append(tuple(ids[start:c].tolist()))
+            out.append((int(ids[c]),))
+            start = c + 1
+        if start < len(ids):
+            out.append(tuple(ids[start:].tolist()))
+        return out
+
+    # --- encodage / expansion ---
+
+    def _encode_segment(self, seg: Tuple[int, ...]) -> Tuple[int, ...]:
+        cached = self._segment_cache.get(seg)
+        if cached is not None:
+            return cached
+        w = list(seg)
+        while len(w) > 1:
+            best = min(zip(w, w[1:]), key=lambda p: self.ranks.get(p, len(self.ranks)))
+            rank = self.ranks.get(best)
+            if rank is None:
+                break
+            w = _merge_word(w, best, self.base_size + rank)
+        out = self._segment_cache[seg] = tuple(w)
+        return out
+
+    def encode(self, ids: Sequence[int]) -> np.ndarray:
+        """Ids de base -> ids composés (les segments répétés sont encodés une seule fois)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        out: List[int] = []
+        for seg in self._segments(ids):
+            out.extend(self._encode_segment(seg) if len(seg) > 1 else seg)
+        return np.array(out, dtype=np.int64)
+
+    def expand(self, ids: Sequence[int]) -> np.ndarray:
+        """Inverse exact de encode : ids composés -> ids de base (vectorisé)."""
+        if self._flat is None:
+            lengths = np.array([len(e) for e in self._expansions], dtype=np.int64)
+            self._flat = (np.concatenate([np.array(e, dtype=np.int64) for e in self._expansions]),
+                          np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        flat, starts, lengths = self._flat
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        n = lengths[ids]
+        # index de chaque id de base produit : début de son expansion + rang dans l'expansion
+        offsets = np.repeat(starts[ids] - np.concatenate([[0], np.cumsum(n)[:-1]]), n)
+        return flat[offsets + np.arange(n.sum())]
+
+    def decode(self, ids: Sequence[int], drop_specials: bool = True) -> List[str]:
+        """Ids composés -> tokens de base, prêts pour tokens_to_score."""
+        return self.base_vocab.decode(self.expand(ids), drop_specials=drop_specials)
+
+    def to_score(self, ids: Sequence[int], **kwargs):
+        """Ids composés (ex. sortie du modèle) -> music21 Score via tokens_to_score."""
+        from bachgen.tokens_to_score import tokens_to_score  # import local : music21 n'est utile qu'ici
+
+        return tokens_to_score(self.decode(ids), **kwargs)
+
+    def expand_tokens(self, tokens: Iterable[str]) -> List[str]:
+        """Même chose au niveau des chaînes : 'note_C4+len_1/2' -> ['note_C4', 'len_1/2']."""
+        return [t for tok in tokens for t in tok.split(MERGE_SEP)]
+
+    def compression_ratio(self, sequences: Iterable[Sequence[int]]) -> Dict[str, float]:
+        """Nombre de tokens avant / après fusion sur un corpus."""
+        before = after = 0
+        for seq in sequences:
+            before += len(seq)
+            after += len(self.encode(seq))
+        return {"base_tokens": before, "merged_tokens": after, "ratio": before / after if after else 1.0}
+
+    # --- (dé)sérialisation ---
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "base_fingerprint": self.base_vocab.fingerprint,
+            "base_size": self.base_size,
+            "boundary_tokens": list(self.boundary_tokens),
+            "merges": [[a, b] for a, b in self.merges],
+            "tokens": [self.token(i) for i in range(self.base_size, self.vocab_size)],
+        }
+        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: Path, base_vocab: Vocab) -> "TokenMerges":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        if not base_vocab.extends(data["base_fingerprint"], data["base_size"]) or len(base_vocab) != data["base_size"]:
+            raise ValueError("Ces fusions ont été apprises sur un autre vocab de base.")
+        return cls(base_vocab, [tuple(m) for m in data["merges"]], data["boundary_tokens"])
+
+
+def _merge_word(w: List[int], pair: Tuple[int, int], new_id: int) -> List[int]:
+    a, b = pair
+    out: List[int] = []
+    i, n = 0, len(w)
+    while i < n:
+        if i + 1 < n and w[i] == a and w[i + 1] == b:
+            out.append(new_id)
+            i += 2
+        else:
+            out.append(w[i])
+            i += 1
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+    from bachgen.training.splits import load_all_ids
+
+    parser = argparse.ArgumentParser(description="Apprend des fusions de tokens et affiche le taux de compression.")
+    parser.add_argument("ids_dir", help="dossier de .ids.txt ou corpus packé")
+    parser.add_argument("vocab", help="vocab.json de base")
+    parser.add_argument("out", help="fichier JSON des fusions")
+    parser.add_argument("--merges", type=int, default=500)
+    parser.add_argument("--min-freq", type=int, default=2)
+    args = parser.parse_args()
+
+    vocab = Vocab.load(args.vocab)
+    seqs = load_all_ids(Path(args.ids_dir))
+    merges = TokenMerges.train(seqs, vocab, n_merges=args.merges, min_freq=args.min_freq)
+    merges.save(Path(args.out))
+    stats = merges.compression_ratio(seqs)
+    print(f"📉 {stats['base_tokens']} -> {stats['merged_tokens']} tokens (x{stats['ratio']:.2f})")
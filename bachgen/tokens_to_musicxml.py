@@ -1,16 +1,30 @@
 from bachgen.tokens_to_score import tokens_to_score
 
-def convert_tokens_to_musicxml(tokens, output_path):
+def convert_tokens_to_musicxml(tokens, output_path, vocab=None):
     """
     Convertit une séquence de tokens en un fichier MusicXML (.musicxml).
     Args:
-        tokens (List[str] or str): liste ou chaîne de tokens (doit contenir 'R' et 'L')
+        tokens (List[str] or str or ids): liste ou chaîne de tokens (doit contenir 'R' et 'L'),
+            ou séquence d'ids (liste, array NumPy, tenseur torch) si vocab est fourni
         output_path (str): chemin du fichier .musicxml de sortie
+        vocab: chemin du token2id.json ou dict du vocab, pour décoder directement des ids
+    Returns:
+        music21.stream.Score: la partition écrite
     """
-    if isinstance(tokens, list):
-        token_string = " ".join(tokens)
-    else:
-        token_string = tokens
-
-    score = tokens_to_score(token_string)
+    score = tokens_to_score(tokens, vocab=vocab)
     score.write('musicxml', fp=output_path)
+    return score
+
+def convert_tokens_to_midi(tokens, output_path, vocab=None):
+    """
+    Convertit une séquence de tokens (ou d'ids si vocab est fourni) en un fichier MIDI (.mid).
+    Args:
+        tokens (List[str] or str or ids): voir convert_tokens_to_musicxml
+        output_path (str): chemin du fichier .mid de sortie
+        vocab: chemin du token2id.json ou dict du vocab
+    Returns:
+        music21.stream.Score: la partition écrite
+    """
+    score = tokens_to_score(tokens, vocab=vocab)
+    score.write('midi', fp=output_path)
+    return score
@@ -1,283 +1,491 @@
-from music21 import key, meter, note, stream, bar, clef, layout, chord, tie, pitch
-
-# dictionary to change note names
-sharp_to_flat = {'C#': 'D-', 'D#': 'E-', 'F#': 'G-', 'G#': 'A-', 'A#': 'B-'}
-flat_to_sharp = {v:k for k, v in sharp_to_flat.items()}
- 
-# translate note numbers into note names considering key signature
-def pitch_to_name(pitch_, key=key.KeySignature(0)):
-    if pitch_.isdecimal():
-        name = str(pitch.Pitch(int(pitch_)))
-        if key.sharps < 0:
-            for k, v in sharp_to_flat.items():
-                name = name.replace(k, v)
-        elif key.sharps > 0:
-            for k, v in flat_to_sharp.items():
-                name = name.replace(k, v)
-        return name
-    else:
-        return pitch_.replace('b', '-')
-
-# aggregate note(rest)-related tokens
-def aggr_note_token(tokens):
-    notes, others, out = [], [], []
-    note_flag, len_flag = False, False
-
-    for t in tokens:
-        parts = t.split('_')
-        if parts[0] in ('note', 'rest'):
-            if note_flag and len_flag and len(notes):
-                out.append(' '.join(notes))
-                notes = []
-            note_flag = True
-            len_flag = False
-            notes.append(t)
-        elif parts[0] == 'len':
-            len_flag = True
-            notes.append(t)
-        elif parts[0] in ('stem', 'beam', 'tie'):
-            notes.append(t)
-        else: # other than note-related
-            if len(notes):
-                out.append(' '.join(notes))
-                notes = []
-            out.append(t)
-
-    # buffer flush
-    if len(notes):
-        out.append(' '.join(notes))
-
-    return out
-
-# translate clef or signature token into music21 object
-def single_token_to_obj(token):
-    parts = token.split('_')
-    if parts[0] == 'clef':
-        if parts[1] == 'treble':
-            return clef.TrebleClef()
-        elif parts[1] == 'bass':
-            return clef.BassClef()
-    elif parts[0] == 'key':
-        if parts[1] == 'sharp':
-            return key.KeySignature(int(parts[2]))
-        elif parts[1] == 'flat':
-            return key.KeySignature(-1 * int(parts[2]))
-        elif parts[1] == 'natural':
-            return key.KeySignature(0)
-    elif parts[0] == 'time':
-        if '/' in parts[1]:
-            return meter.TimeSignature(parts[1])
-        else:
-            return meter.TimeSignature(parts[1]+'/4' if int(parts[1]) < 6 else parts[1]+'/8')
-
-# translate note(rest)-related tokens into music21 object
-def note_token_to_obj(tokens, key):
-    if tokens[0] == 'rest': # for rests
-        length = str_to_float(tokens[1])
-        return note.Rest(quarterLength=length)
-
-    # for notes
-    note_names = [pitch_to_name(t.split('_')[1], key) for t in tokens if t.split('_')[0] == 'note']
-    lengths = [str_to_float(t) for t in tokens if t.split('_')[0] == 'len']
-    direction = [t.split('_')[1] for t in tokens if t.split('_')[0] in ('stem', 'dir')] + [t.split('_')[2] for t in tokens if t.split('_')[0] == 'len' and len(t.split('_')) >= 3]
-    beams = [t.split('_')[1:] for t in tokens if t.split('_')[0] == 'beam'] + [t.split('_')[3:] for t in tokens if t.split('_')[0] == 'len' and len(t.split('_')) >= 4]
-    tie_ = [t.split('_')[1] for t in tokens if t.split('_')[0] == 'tie']
-
-    if len(note_names) > 1: # chord
-        if len(lengths) > 1:
-            chords = []
-            for i, l in enumerate(lengths):
-                chord_ = chord.Chord(note_names, quarterLength=l)
-                if len(direction):
-                    chord_.stemDirection = direction[0]
-
-                if len(beams):
-                    append_beams(chord_, beams)
-
-                if len(tie_):
-                    chord_.tie = tie.Tie('continue')
-                elif i == 0:
-                    chord_.tie = tie.Tie('start')
-                elif i == len(lengths) - 1:
-                    chord_.tie = tie.Tie('stop')
-                else:
-                    chord_.tie = tie.Tie('continue')
-
-                chords.append(chord_)
-
-            return chords
-        else:
-            chord_ = chord.Chord(note_names, quarterLength=lengths[0])
-            if len(direction):
-                chord_.stemDirection = direction[0]
-            if len(beams):
-                append_beams(chord_, beams)
-            if len(tie_):
-                chord_.tie = tie.Tie(tie_[0])
-            return chord_
-    else: # note
-        if len(lengths) > 1:
-            notes = []
-            for i, l in enumerate(lengths):
-                note_ = note.Note(note_names[0], quarterLength=l)
-                if len(direction):
-                    note_.stemDirection = direction[0]
-
-                if len(beams):
-                    append_beams(note_, beams)
-
-                if len(tie_):
-                    note_.tie = tie.Tie('continue')
-                elif i == 0:
-                    note_.tie = tie.Tie('start')
-                elif i == len(lengths) - 1:
-                    note_.tie = tie.Tie('stop')
-                else:
-                    note_.tie = tie.Tie('continue')
-
-                notes.append(note_)
-
-            return notes
-        else:
-            note_ = note.Note(note_names[0], quarterLength=lengths[0])
-            if len(direction):
-                note_.stemDirection = direction[0]
-            if len(beams):
-                append_beams(note_, beams)
-            if len(tie_):
-                note_.tie = tie.Tie(tie_[0])
-            return note_
-
-# [aux func] translate note length into float number
-def str_to_float(t):
-    length = t.split('_')[1] if 'len' in t else t
-    if '/' in length:
-        numerator, denominator = length.split('/')
-        return int(numerator) / int(denominator)
-    else:
-        return float(length)
-
-# [aux func] append beams property to music21 Note or Chord object
-def append_beams(obj, beams):
-    for b in beams[0]:
-        if '-' in b:
-            former, latter = b.split('-')
-            obj.beams.append(former, latter)
-        else:
-            obj.beams.append(b)
-
-def tokens_to_PartStaff(tokens, key_=0, start_voice=1):
-    tokens = concatenated_to_regular(tokens)
-
-    p = stream.PartStaff()
-    k = key.KeySignature(key_)
-
-    voice_id = start_voice
-    voice_flag = False
-    after_voice = False
-    voice_start = None
-
-    ottava_flag = False
-    ottava_elements = []
-
-    tokens = aggr_note_token(tokens)
-
-    for i, t in enumerate(tokens):
-        if t == 'bar':
-            if i != 0:
-                p.append(m)
-            m = stream.Measure()
-            voice_id = start_voice
-            voice_start = None
-            voice_flag = False
-            after_voice = False
-        elif t == '<voice>':
-            v = stream.Voice(id=voice_id)
-            voice_flag = True
-            if voice_start is None:
-                voice_start = m.duration.quarterLength # record the start point of voice
-        elif t == '</voice>':
-            if voice_flag:
-                v.makeAccidentals(useKeySignature=k)
-                for element in v:
-                    element.offset += voice_start
-                m.append(v)
-                voice_id += 1
-                voice_flag = False
-                after_voice = True
-        elif t.split('_')[0] in ('clef', 'key', 'time'):
-            if t[:11] == 'key_natural' and i+1 < len(tokens) and tokens[i+1].split('_')[0] == 'key':
-                continue # workaround for MuseScore (which ignores consecutive key signtures): if key signatures appear in succession, skip the one with natural
-            o = single_token_to_obj(t)
-            if voice_flag:
-                v.append(o)
-            else:
-                m.append(o)
-            if t.split('_')[0] == 'key': # generate another key signature object to use makeAccidentals and to translate note number to name
-                k = o
-        elif t[:4] in ('note', 'rest'):
-            n = note_token_to_obj(t.split(), k)
-            if ottava_flag:
-                ottava_elements.append(n)
-
-            if voice_flag:
-                v.append(n)
-            else:
-                m.append(n)
-
-            if after_voice:
-                n.offset -= v.quarterLength * (voice_id - 1)
-    # last measure
-    p.append(m)
-    p.makeAccidentals()
-
-    return p
-
-def concatenated_to_regular(tokens):
-    regular_tokens = []
-    for t in tokens:
-        if t.startswith('len') or t.startswith('attr'):
-            attrs = t.split('_')
-            if len(attrs) == 2:
-                regular_tokens.append(f'len_{attrs[1]}')
-            elif len(attrs) == 3:
-                regular_tokens += [f'len_{attrs[1]}', f'stem_{attrs[2]}']
-            else:
-                regular_tokens += [f'len_{attrs[1]}', f'stem_{attrs[2]}', f'beam_{"_".join(attrs[3:])}']
-        else:
-            regular_tokens.append(t)
-    return regular_tokens
-
-# build music21 Score object from a token sequnece (string)
-def tokens_to_score(string, voice_numbering=False):
-    R_str, L_str = split_R_L(string)
-    R_tokens = R_str.split()
-    L_tokens = L_str.split()
-    if voice_numbering:
-        r = tokens_to_PartStaff(R_tokens)
-        r_voices = max([len(m.voices) if m.hasVoices() else 1 for m in r])
-        l = tokens_to_PartStaff(L_tokens, start_voice=r_voices+1)
-    else:
-        r = tokens_to_PartStaff(R_tokens, start_voice=0)
-        l = tokens_to_PartStaff(L_tokens, start_voice=0)
-
-    # add last barline
-    r.elements[-1].rightBarline = bar.Barline('regular')
-    l.elements[-1].rightBarline = bar.Barline('regular')
-
-    s = stream.Score()
-    g = layout.StaffGroup([r, l], symbol='brace', barTogether=True)
-    s.append([g, r, l])
-    return s
-
-def split_R_L(string):
-    tokens = string.split()
-    tokens = concatenated_to_regular(tokens)
-    
-    if 'L' in tokens:
-        R = ' '.join(tokens[tokens.index('R')+1:tokens.index('L')])
-        L = ' '.join(tokens[tokens.index('L')+1:])
-    else:
-        R = ' '.join(tokens[tokens.index('R')+1:])
-        L = ''
-    return R, L
+from collections import OrderedDict
+from pathlib import Path
+from music21 import key, meter, note, stream, bar, clef, layout, chord, tie, pitch
+
+from bachgen.token_grammar import token_kind
+from bachgen.accidentals import apply_key_accidentals
+
+# dictionary to change note names
+sharp_to_flat = {'C#': 'D-', 'D#': 'E-', 'F#': 'G-', 'G#': 'A-', 'A#': 'B-'}
+flat_to_sharp = {v:k for k, v in sharp_to_flat.items()}
+ 
+# translate note numbers into note names considering key signature
+def pitch_to_name(pitch_, key=key.KeySignature(0)):
+    if pitch_.isdecimal():
+        name = str(pitch.Pitch(int(pitch_)))
+        if key.sharps < 0:
+            for k, v in sharp_to_flat.items():
+                name = name.replace(k, v)
+        elif key.sharps > 0:
+            for k, v in flat_to_sharp.items():
+                name = name.replace(k, v)
+        return name
+    else:
+        return pitch_.replace('b', '-')
+
+# aggregate note(rest)-related tokens
+def aggr_note_token(tokens):
+    notes, others, out = [], [], []
+    note_flag, len_flag = False, False
+
+    for t in tokens:
+        parts = t.split('_')
+        if parts[0] in ('note', 'rest'):
+            if note_flag and len_flag and len(notes):
+                out.append(' '.join(notes))
+                notes = []
+            note_flag = True
+            len_flag = False
+            notes.append(t)
+        elif parts[0] == 'len':
+            len_flag = True
+            notes.append(t)
+        elif parts[0] in ('stem', 'beam', 'tie'):
+            notes.append(t)
+        else: # other than note-related
+            if len(notes):
+                out.append(' '.join(notes))
+                notes = []
+            out.append(t)
+
+    # buffer flush
+    if len(notes):
+        out.append(' '.join(notes))
+
+    return out
+
+# translate clef or signature token into music21 object
+def single_token_to_obj(token):
+    parts = token.split('_')
+    if parts[0] == 'clef':
+        if parts[1] == 'treble':
+            return clef.TrebleClef()
+        elif parts[1] == 'bass':
+            return clef.BassClef()
+    elif parts[0] == 'key':
+        if parts[1] == 'sharp':
+            return key.KeySignature(int(parts[2]))
+        elif parts[1] == 'flat':
+            return key.KeySignature(-1 * int(parts[2]))
+        elif parts[1] == 'natural':
+            return key.KeySignature(0)
+    elif parts[0] == 'time':
+        if '/' in parts[1]:
+            return meter.TimeSignature(parts[1])
+        else:
+            return meter.TimeSignature(parts[1]+'/4' if int(parts[1]) < 6 else parts[1]+'/8')
+
+# translate note(rest)-related tokens into music21 object
+def note_token_to_obj(tokens, key):
+    if tokens[0] == 'rest': # for rests
+        length = str_to_float(tokens[1])
+        return note.Rest(quarterLength=length)
+
+    # for notes
+    note_names = [pitch_to_name(t.split('_')[1], key) for t in tokens if t.split('_')[0] == 'note']
+    lengths = [str_to_float(t) for t in tokens if t.split('_')[0] == 'len']
+    direction = [t.split('_')[1] for t in tokens if t.split('_')[0] in ('stem', 'dir')] + [t.split('_')[2] for t in tokens if t.split('_')[0] == 'len' and len(t.split('_')) >= 3]
+    beams = [t.split('_')[1:] for t in tokens if t.split('_')[0] == 'beam'] + [t.split('_')[3:] for t in tokens if t.split('_')[0] == 'len' and len(t.split('_')) >= 4]
+    tie_ = [t.split('_')[1] for t in tokens if t.split('_')[0] == 'tie']
+
+    if len(note_names) > 1: # chord
+        if len(lengths) > 1:
+            chords = []
+            for i, l in enumerate(lengths):
+                chord_ = chord.Chord(note_names, quarterLength=l)
+                if len(direction):
+                    chord_.stemDirection = direction[0]
+
+                if len(beams):
+                    append_beams(chord_, beams)
+
+                if len(tie_):
+                    chord_.tie = tie.Tie('continue')
+                elif i == 0:
+                    chord_.tie = tie.Tie('start')
+                elif i == len(lengths) - 1:
+                    chord_.tie = tie.Tie('stop')
+                else:
+                    chord_.tie = tie.Tie('continue')
+
+                chords.append(chord_)
+
+            return chords
+        else:
+            chord_ = chord.Chord(note_names, quarterLength=lengths[0])
+            if len(direction):
+                chord_.stemDirection = direction[0]
+            if len(beams):
+                append_beams(chord_, beams)
+            if len(tie_):
+                chord_.tie = tie.Tie(tie_[0])
+            return chord_
+    else: # note
+        if len(lengths) > 1:
+            notes = []
+            for i, l in enumerate(lengths):
+                note_ = note.Note(note_names[0], quarterLength=l)
+                if len(direction):
+                    note_.stemDirection = direction[0]
+
+                if len(beams):
+                    append_beams(note_, beams)
+
+                if len(tie_):
+                    note_.tie = tie.Tie('continue')
+                elif i == 0:
+                    note_.tie = tie.Tie('start')
+                elif i == len(lengths) - 1:
+                    note_.tie = tie.Tie('stop')
+                else:
+                    note_.tie = tie.Tie('continue')
+
+                notes.append(note_)
+
+            return notes
+        else:
+            note_ = note.Note(note_names[0], quarterLength=lengths[0])
+            if len(direction):
+                note_.stemDirection = direction[0]
+            if len(beams):
+                append_beams(note_, beams)
+            if len(tie_):
+                note_.tie = tie.Tie(tie_[0])
+            return note_
+
+# [aux func] translate note length into float number
+def str_to_float(t):
+    length = t.split('_')[1] if 'len' in t else t
+    if '/' in length:
+        numerator, denominator = length.split('/')
+        return int(numerator) / int(denominator)
+    else:
+        return float(length)
+
+# [aux func] append beams property to music21 Note or Chord object
+def append_beams(obj, beams):
+    for b in beams[0]:
+        if '-' in b:
+            former, latter = b.split('-')
+            obj.beams.append(former, latter)
+        else:
+            obj.beams.append(b)
+
+# split aggregated tokens into measure runs (the 'bar' token itself is dropped)
+def split_measures(tokens):
+    runs = []
+    for t in tokens:
+        if t == 'bar' or not runs:
+            runs.append([])
+            if t == 'bar':
+                continue
+        runs[-1].append(t)
+    return runs
+
+# build one music21 Measure from a measure run; returns (measure, key signature after the measure)
+def tokens_to_Measure(tokens, k, start_voice=1):
+    m = stream.Measure()
+    voice_id = start_voice
+    voice_flag = False
+    after_voice = False
+    voice_start = None
+
+    for i, t in enumerate(tokens):
+        if t == '<voice>':
+            v = stream.Voice(id=voice_id)
+            voice_flag = True
+            if voice_start is None:
+                voice_start = m.duration.quarterLength # record the start point of voice
+        elif t == '</voice>':
+            if voice_flag:
+                for element in v:
+                    element.offset += voice_start
+                m.append(v)
+                voice_id += 1
+                voice_flag = False
+                after_voice = True
+        elif t.split('_')[0] in ('clef', 'key', 'time'):
+            if t[:11] == 'key_natural' and i+1 < len(tokens) and tokens[i+1].split('_')[0] == 'key':
+                continue # workaround for MuseScore (which ignores consecutive key signtures): if key signatures appear in succession, skip the one with natural
+            o = single_token_to_obj(t)
+            if voice_flag:
+                v.append(o)
+            else:
+                m.append(o)
+            if t.split('_')[0] == 'key': # generate another key signature object to use makeAccidentals and to translate note number to name
+                k = o
+        elif t[:4] in ('note', 'rest'):
+            n = note_token_to_obj(t.split(), k)
+
+            if voice_flag:
+                v.append(n)
+            else:
+                m.append(n)
+
+            if after_voice:
+                n.offset -= v.quarterLength * (voice_id - 1)
+
+    return m, k
+
+# [aux func] describe a built element so that it can be re-created without parsing tokens again
+def element_spec(e):
+    if isinstance(e, note.Rest):
+        return ('rest', e.quarterLength)
+    if isinstance(e, (note.Note, chord.Chord)):
+        names = tuple((p.step, p.octave, p.accidental.name if p.accidental is not None else None) for p in e.pitches)
+        beams = tuple((b.type, b.direction) for b in e.beams.beamsList)
+        return ('chord' if isinstance(e, chord.Chord) else 'note', names, e.quarterLength,
+                e.stemDirection, beams, e.tie.type if e.tie is not None else None)
+    if isinstance(e, key.KeySignature):
+        return ('key', e.sharps)
+    if isinstance(e, meter.TimeSignature):
+        return ('time', e.ratioString)
+    return ('obj', type(e)) # clefs
+
+def spec_to_element(spec):
+    kind = spec[0]
+    if kind == 'rest':
+        return note.Rest(quarterLength=spec[1])
+    if kind in ('note', 'chord'):
+        _, names, length, direction, beams, tie_type = spec
+        pitches = [pitch.Pitch(step=step, octave=octave, accidental=acc) if acc is not None else pitch.Pitch(step=step, octave=octave)
+                   for step, octave, acc in names]
+        e = chord.Chord(pitches, quarterLength=length) if kind == 'chord' else note.Note(pitch=pitches[0], quarterLength=length)
+        if direction != 'unspecified':
+            e.stemDirection = direction
+        for type_, direction_ in beams:
+            e.beams.append(type_, direction_)
+        if tie_type is not None:
+            e.tie = tie.Tie(tie_type)
+        return e
+    if kind == 'key':
+        return key.KeySignature(spec[1])
+    if kind == 'time':
+        return meter.TimeSignature(spec[1])
+    return spec[1]()
+
+# compile a built measure into a recipe: [(offset, spec)] with voices as (offset, ('voice', id, [(offset, spec)]))
+def measure_to_recipe(m):
+    recipe = []
+    for e in m:
+        if isinstance(e, stream.Voice):
+            recipe.append((m.elementOffset(e), ('voice', e.id, [(e.elementOffset(x), element_spec(x)) for x in e])))
+        else:
+            recipe.append((m.elementOffset(e), element_spec(e)))
+    return recipe
+
+def recipe_to_measure(recipe):
+    m = stream.Measure()
+    for offset, spec in recipe:
+        if spec[0] == 'voice':
+            v = stream.Voice(id=spec[1])
+            for voice_offset, voice_spec in spec[2]:
+                v.coreInsert(voice_offset, spec_to_element(voice_spec))
+            v.coreElementsChanged()
+            v.isSorted = True # recipes are recorded in sorted order
+            m.coreInsert(offset, v)
+        else:
+            m.coreInsert(offset, spec_to_element(spec))
+    m.coreElementsChanged()
+    m.isSorted = True
+    return m
+
+# bounded LRU of compiled measures, keyed on (measure run, carried key/clef/time, start voice)
+class MeasureCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, cache_key):
+        entry = self._data.get(cache_key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(cache_key)
+        self.hits += 1
+        return entry
+
+    def put(self, cache_key, entry):
+        self._data[cache_key] = entry
+        self._data.move_to_end(cache_key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'hit_rate': round(self.hit_rate, 4)}
+
+    def clear(self):
+        self._data.clear()
+        self.hits = self.misses = 0
+
+def tokens_to_PartStaff(tokens, key_=0, start_voice=1, regular=False, accidentals='table', measure_cache=None):
+    if not regular: # tokens from build_id_table are already expanded
+        tokens = concatenated_to_regular(tokens)
+
+    p = stream.PartStaff()
+    k = key.KeySignature(key_)
+    clef_, time_ = None, None # carried clef/time state (only used in cache keys)
+
+    tokens = aggr_note_token(tokens)
+
+    for run in split_measures(tokens):
+        if measure_cache is None:
+            m, k = tokens_to_Measure(run, k, start_voice)
+        else:
+            cache_key = (tuple(run), k.sharps, clef_, time_, start_voice)
+            entry = measure_cache.get(cache_key)
+            if entry is None:
+                m, k = tokens_to_Measure(run, k, start_voice)
+                measure_cache.put(cache_key, (measure_to_recipe(m), k.sharps))
+            else:
+                recipe, sharps = entry
+                m = recipe_to_measure(recipe) # no token parsing, no append bookkeeping
+                if sharps != k.sharps:
+                    k = key.KeySignature(sharps)
+            for t in run:
+                if t[:5] == 'clef_':
+                    clef_ = t
+                elif t[:5] == 'time_':
+                    time_ = t
+        p.append(m)
+
+    # display accidentals: table-driven engine or music21 pass (both in place, once); None leaves it to the writer
+    if accidentals == 'table':
+        apply_key_accidentals(p)
+    elif accidentals == 'music21':
+        p.makeAccidentals(inPlace=True)
+        p.streamStatus.accidentals = True
+
+    return p
+
+def concatenated_to_regular(tokens):
+    regular_tokens = []
+    for t in tokens:
+        if t.startswith('len') or t.startswith('attr'):
+            attrs = t.split('_')
+            if len(attrs) == 2:
+                regular_tokens.append(f'len_{attrs[1]}')
+            elif len(attrs) == 3:
+                regular_tokens += [f'len_{attrs[1]}', f'stem_{attrs[2]}']
+            else:
+                regular_tokens += [f'len_{attrs[1]}', f'stem_{attrs[2]}', f'beam_{"_".join(attrs[3:])}']
+        else:
+            regular_tokens.append(t)
+    return regular_tokens
+
+# build music21 Score object from a token sequnece (string, list of tokens, or ids with vocab)
+def tokens_to_score(string, voice_numbering=False, vocab=None, accidentals='table', measure_cache=None):
+    if vocab is not None:
+        R_tokens, L_tokens = ids_to_hands(string, vocab)
+    elif isinstance(string, str):
+        R_tokens, L_tokens = split_hands(string.split())
+    else:
+        R_tokens, L_tokens = split_hands(list(string))
+
+    if voice_numbering:
+        r = tokens_to_PartStaff(R_tokens, regular=True, accidentals=accidentals, measure_cache=measure_cache)
+        r_voices = max([len(m.voices) if m.hasVoices() else 1 for m in r])
+        l = tokens_to_PartStaff(L_tokens, start_voice=r_voices+1, regular=True, accidentals=accidentals, measure_cache=measure_cache)
+    else:
+        r = tokens_to_PartStaff(R_tokens, start_voice=0, regular=True, accidentals=accidentals, measure_cache=measure_cache)
+        l = tokens_to_PartStaff(L_tokens, start_voice=0, regular=True, accidentals=accidentals, measure_cache=measure_cache)
+
+    # add last barline
+    r.elements[-1].rightBarline = bar.Barline('regular')
+    l.elements[-1].rightBarline = bar.Barline('regular')
+
+    s = stream.Score()
+    g = layout.StaffGroup([r, l], symbol='brace', barTogether=True)
+    s.append([g, r, l])
+    return s
+
+def split_R_L(string):
+    R, L = split_hands(string.split())
+    return ' '.join(R), ' '.join(L)
+
+# split a token list into (right hand, left hand) regular token lists
+def split_hands(tokens):
+    tokens = concatenated_to_regular(tokens)
+
+    if 'L' in tokens:
+        R = tokens[tokens.index('R')+1:tokens.index('L')]
+        L = tokens[tokens.index('L')+1:]
+    else:
+        R = tokens[tokens.index('R')+1:]
+        L = []
+    return R, L
+
+# per-vocab lookup tables: id -> (kind, regular tokens), keyed by vocab content
+_ID_TABLES = {}
+
+def build_id_table(vocab):
+    """
+    Build (once per vocab) the table id -> (kind, regular tokens), where kind comes from
+    token_grammar.token_kind and regular tokens are the already expanded concatenated tokens.
+    vocab: path to token2id.json, {token: id} or {id: token}.
+    A path is cached on (resolved path, mtime, size) so an extended token2id.json is reloaded;
+    a dict is cached on its fingerprint, so in-place updates are picked up too.
+    """
+    from bachgen.vocab_utils import load_vocab, vocab_fingerprint
+
+    if isinstance(vocab, (str, Path)):
+        path = Path(vocab).resolve()
+        st = path.stat()
+        cache_key = ('path', str(path), st.st_mtime_ns, st.st_size)
+        cached = _ID_TABLES.get(cache_key)
+        if cached is not None:
+            return cached
+        _, id2token = load_vocab(path)
+    else:
+        if vocab and isinstance(next(iter(vocab)), str):
+            id2token = {int(i): t for t, i in vocab.items()}
+        else:
+            id2token = {int(i): t for i, t in vocab.items()}
+        cache_key = ('dict', vocab_fingerprint({t: i for i, t in id2token.items()}))
+        cached = _ID_TABLES.get(cache_key)
+        if cached is not None:
+            return cached
+
+    table = [('special', ())] * (max(id2token) + 1 if id2token else 0)
+    for i, t in id2token.items():
+        kind = token_kind(t)
+        if kind == 'special':
+            table[i] = ('special', ()) # [PAD], <BOS>, <EOS> are dropped
+        elif kind is None:
+            table[i] = ('other', tuple(concatenated_to_regular([t]))) # kept, like the string path does
+        else:
+            table[i] = (kind, tuple(concatenated_to_regular([t])))
+
+    _ID_TABLES[cache_key] = table
+    return table
+
+# resolve an id sequence (list, NumPy array or torch tensor) into (right hand, left hand) regular token lists
+def ids_to_hands(ids, vocab):
+    table = build_id_table(vocab)
+    if hasattr(ids, 'tolist'):
+        ids = ids.tolist()
+    if len(ids) == 1 and isinstance(ids[0], list): # batch of size 1
+        ids = ids[0]
+
+    hands = {'R': [], 'L': []}
+    current = None
+    n = len(table)
+    for i in ids:
+        kind, toks = table[i] if 0 <= i < n else ('special', ())
+        if kind == 'R' or kind == 'L':
+            if current == 'L' or (kind == 'R' and current is not None):
+                continue # like split_hands, only the first R and L delimit the hands
+            current = kind
+        elif current is not None and toks:
+            hands[current].extend(toks)
+
+    if current is None:
+        raise ValueError("id sequence contains no R token")
+    return hands['R'], hands['L']
@@ -0,0 +1,189 @@
+# bachgen/training/augment.py
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from bachgen.token_grammar import STEPS, parse_pitch, pitch_midi, pitch_name
+from bachgen.training.datasets import IGNORE_INDEX
+from bachgen.vocab_utils import Vocab, as_vocab
+
+# Augmentation par transposition, directement sur les ids :
+# pour chaque décalage (en demi-tons), une table id -> id sur tout le vocab est précalculée une fois.
+# Transposer un bloc = un seul gather NumPy (table[ids]) ; rien n'est réécrit sur disque.
+#
+# L'orthographe suit le cycle des quintes : +1 demi-ton = seconde mineure (do majeur -> ré bémol
+# majeur, Bb -> Cb, key_natural_0 -> key_flat_5), +2 = seconde majeure, etc. Les armures key_*
+# sont décalées du même nombre de quintes. Si l'orthographe obtenue n'est pas dans le vocab,
+# on prend une note enharmonique du vocab ; sinon (ou hors tessiture) le token est invalide
+# pour ce décalage et les blocs qui le contiennent ne seront pas transposés de cette façon.
+
+def fifths_for_shift(semitones: int) -> int:
+    """Nombre de quintes équivalent à un décalage, dans [-5, 6] (ex. +1 -> -5, +2 -> +2)."""
+    d = (7 * semitones) % 12
+    return d - 12 if d > 6 else d
+
+
+def transpose_pitch(step: int, alter: int, octave: int, semitones: int) -> Tuple[int, int, int]:
+    """Transpose en gardant une orthographe cohérente avec fifths_for_shift."""
+    target = pitch_midi(step, alter, octave) + semitones
+    k = (4 * fifths_for_shift(semitones)) % 7  # une quinte = 4 degrés
+    # nombre de degrés le plus proche du décalage réel (±7 : octaves)
+    k = min((k + 7 * m for m in (-2, -1, 0, 1)), key=lambda x: abs(x - semitones * 7 / 12))
+    pos = octave * 7 + step + k
+    new_step, new_octave = pos % 7, pos // 7
+    return new_step, target - pitch_midi(new_step, 0, new_octave), new_octave
+
+
+def _key_fifths(token: str) -> Optional[int]:
+    parts = token.split("_")
+    if len(parts) != 3 or parts[0] != "key" or not parts[2].isdigit():
+        return None
+    n = int(parts[2])
+    return {"sharp": n, "flat": -n, "natural": 0}.get(parts[1])
+
+
+def _key_token(fifths: int) -> str:
+    if fifths < 0:
+        return f"key_flat_{-fifths}"
+    if fifths > 0:
+        return f"key_sharp_{fifths}"
+    return "key_natural_0"
+
+
+class TranspositionTables:
+    """
+    tables[k] : tableau (vocab_size,) id -> id pour le décalage shifts[k]
+    valid[k]  : masque bool (vocab_size,) des ids transposables par shifts[k]
+    Les tokens non musicaux (bar, len_*, clef_*, spéciaux...) sont inchangés.
+    """
+    def __init__(
+        self,
+        vocab: Vocab | Dict[str, int],
+        shifts: Sequence[int] = range(-5, 7),
+        pitch_range: Tuple[int, int] = (21, 108),
+    ) -> None:
+        self.vocab = as_vocab(vocab)
+        self.shifts = list(shifts)
+        self.pitch_range = pitch_range
+        V = len(self.vocab)
+
+        # notes du vocab, par numéro midi (pour les repli enharmoniques)
+        by_midi: Dict[int, List[Tuple[int, str]]] = {}
+        for tok, i in self.vocab.token2id.items():
+            p = parse_pitch(tok[5:]) if tok.startswith("note_") else None
+            if p is not None and abs(p[1]) <= 2:
+                by_midi.setdefault(pitch_midi(*p), []).append((abs(p[1]), tok))
+        for cands in by_midi.values():
+            cands.sort()
+
+        self.tables = np.tile(np.arange(V, dtype=np.int64), (len(self.shifts), 1))
+        self.valid = np.ones((len(self.shifts), V), dtype=bool)
+        for k, s in enumerate(self.shifts):
+            if s == 0:
+                continue
+            for tok, i in self.vocab.token2id.items():
+                new = self._transpose_token(tok, s, by_midi)
+                if new is False:
+                    continue  # token non musical : identité
+                if new is None:
+                    self.tables[k, i] = self.vocab.unk_id if self.vocab.unk_id is not None else i
+                    self.valid[k, i] = False
+                else:
+                    self.tables[k, i] = self.vocab.token2id[new]
+
+    def _transpose_token(self, tok: str, s: int, by_midi) -> Optional[str] | bool:
+        lo, hi = self.pitch_range
+        if tok.startswith("note_"):
+            name = tok[5:]
+            if name.isdigit():
+                midi = int(name) + s
+                new = f"note_{midi}"
+                return new if lo <= midi <= hi and new in self.vocab.token2id else None
+            p = parse_pitch(name)
+            if p is None:
+                return False
+            target = pitch_midi(*p) + s
+            if not lo <= target <= hi:
+                return None
+            step, alter, octave = transpose_pitch(*p, s)
+            new = f"note_{pitch_name(step, alter, octave)}" if abs(alter) <= 2 else None
+            if new in self.vocab.token2id:
+                return new
+            cands = by_midi.get(target)
+            return cands[0][1] if cands else None
+        fifths = _key_fifths(tok)
+        if fifths is None:
+            return False
+        f = fifths + fifths_for_shift(s)
+        if f > 7:
+            f -= 12
+        elif f < -7:
+            f += 12
+        new = _key_token(f)
+        return new if new in self.vocab.token2id else None
+
+    def shift_index(self, shift: int) -> int:
+        return self.shifts.index(shift)
+
+    def transpose(self, ids, shift: int) -> np.ndarray:
+        return self.tables[self.shift_index(shift)][np.asarray(ids, dtype=np.int64)]
+
+    def allowed_shifts(self, ids) -> List[int]:
+        """Décalages pour lesquels tous les ids du bloc restent valides."""
+        ok = self.valid[:, np.asarray(ids, dtype=np.int64)].all(axis=1)
+        return [s for s, keep in zip(self.shifts, ok) if keep]
+
+    def transpose_tokens(self, tokens: Sequence[str], shift: int) -> List[str]:
+        return self.vocab.decode(self.transpose(self.vocab.encode(tokens), shift))
+
+
+class TransposeAugmentDataset(Dataset):
+    """
+    Enveloppe un dataset de blocs ({"input_ids", "labels", ...}) et transpose chaque bloc
+    d'un décalage tiré au hasard parmi ceux valides pour ce bloc (probabilité p, sinon 0).
+    Le tirage dépend de (seed, époque, idx), comme RandomWindowDataset.
+    """
+    def __init__(self, ds: Dataset, tables: TranspositionTables, p: float = 1.0, seed: int = 0) -> None:
+        self.ds = ds
+        self.tables = tables
+        self.p = p
+        self.seed = seed
+        self._epoch = torch.zeros(1, dtype=torch.long).share_memory_()
+
+    def set_epoch(self, epoch: int) -> None:
+        self._epoch[0] = epoch
+        if hasattr(self.ds, "set_epoch"):
+            self.ds.set_epoch(epoch)
+
+    @property
+    def collator(self):
+        """Collator du dataset enveloppé (None : SimpleDataCollator)."""
+        return getattr(self.ds, "collator", None)
+
+    def __len__(self) -> int:
+        return len(self.ds)
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+        item = dict(self.ds[idx])
+        rng = np.random.default_rng((self.seed, int(self._epoch[0]), idx))
+        if rng.random() >= self.p:
+            return item
+        ids = item["input_ids"].numpy()
+        shifts = [s for s in self.tables.allowed_shifts(ids) if s != 0]
+        if not shifts:
+            return item
+        table = self.tables.tables[self.tables.shift_index(int(rng.choice(shifts)))]
+        shared = item["labels"] is item["input_ids"]
+        item["input_ids"] = torch.from_numpy(table[ids])
+        if shared:
+            item["labels"] = item["input_ids"]
+        else:
+            labels = item["labels"].numpy()
+            keep = labels != IGNORE_INDEX
+            out = labels.copy()
+            out[keep] = table[labels[keep]]
+            item["labels"] = torch.from_numpy(out)
+        return item
@@ -0,0 +1,229 @@
+# bachgen/training/bar_index.py
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple
+from pathlib import Path
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from bachgen.training.datasets import IGNORE_INDEX, PackedDataCollator
+from bachgen.training.evaluation import TOKEN_CLASSES, token_class_ids
+from bachgen.vocab_utils import PACKED_META, PackedCorpus, Vocab, as_vocab
+
+# Index des mesures d'un corpus encodé, construit une fois (vectorisé, sans décoder les tokens) :
+# - position de chaque token `bar` dans le flux, document et main (R / L) auxquels il appartient
+# - fin de la mesure (bar suivant, changement de main ou fin du document)
+# - état actif juste avant la mesure : main, clef_*, key_*, time_* (pris dans la même main du même document)
+# Il sert à couper des fenêtres d'entraînement au début d'une mesure, précédées d'un en-tête
+# synthétique (main + clé + armure + mesure), et à lire "la mesure N du morceau P" en O(1).
+
+HEADER_CLASSES = ("hand", "clef", "key", "time")
+BAR_INDEX = "bar_index.npz"
+
+
+def _flat_corpus(source) -> Tuple[np.ndarray, np.ndarray]:
+    """PackedCorpus / dossier packé / liste de séquences -> (ids concaténés, offsets (n_docs + 1,))."""
+    if isinstance(source, (str, Path)):
+        source = PackedCorpus(Path(source))
+    if isinstance(source, PackedCorpus):
+        return source.tokens, source.offsets
+    arrays = [np.asarray(s, dtype=np.int64) for s in source]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([a.size for a in arrays], out=offsets[1:])
+    return (np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)), offsets
+
+
+def _last_before(positions: np.ndarray, targets: np.ndarray, lower: np.ndarray) -> np.ndarray:
+    """Pour chaque cible, dernière position < cible et >= lower (sinon -1)."""
+    k = np.searchsorted(positions, targets) - 1
+    found = positions[np.maximum(k, 0)] if positions.size else np.full(targets.shape, -1)
+    return np.where((k >= 0) & (found >= lower), found, -1)
+
+
+class BarIndex:
+    """
+    Attributs (un élément par token `bar`, dans l'ordre du flux) :
+        bar_pos : position dans le flux concaténé ; bar_end : fin (exclue) de la mesure
+        bar_doc : n° de document ; header : (n_bars, 4) ids main / clef / key / time actifs (-1 : aucun)
+    Par document et par main : first_bar[main][doc] (1re mesure, -1 si absente), n_bars[main][doc].
+    Les mesures d'une main sont contiguës dans le flux (format R ... L ...), d'où l'accès direct.
+    key : description du corpus indexé (cf. for_corpus), gardée avec l'index pour savoir s'il est à jour.
+    """
+    def __init__(self, arrays: Dict[str, np.ndarray], hands: Dict[str, int], key: Optional[Dict] = None) -> None:
+        self.key = key or {}
+        self.bar_pos = arrays["bar_pos"]
+        self.bar_end = arrays["bar_end"]
+        self.bar_doc = arrays["bar_doc"]
+        self.header = arrays["header"]
+        self.offsets = arrays["offsets"]
+        self.hands = hands
+        self.first_bar = {h: arrays[f"first_bar_{h}"] for h in hands}
+        self.n_bars = {h: arrays[f"n_bars_{h}"] for h in hands}
+        self.first_bar[None] = np.searchsorted(self.bar_doc, np.arange(len(self.offsets) - 1))
+        self.n_bars[None] = np.bincount(self.bar_doc, minlength=len(self.offsets) - 1)
+
+    @classmethod
+    def build(cls, source, vocab: Vocab | Dict[str, int]) -> "BarIndex":
+        vocab = as_vocab(vocab)
+        tokens, offsets = _flat_corpus(source)
+        classes = token_class_ids(vocab)[np.asarray(tokens, dtype=np.int64)]
+        hands = {h: vocab.token2id[h] for h in ("R", "L") if h in vocab.token2id}
+
+        bar_pos = np.flatnonzero(classes == TOKEN_CLASSES.index("bar"))
+        bar_doc = np.searchsorted(offsets, bar_pos, side="right") - 1
+        doc_start = offsets[bar_doc]
+        hand_marks = np.flatnonzero(classes == TOKEN_CLASSES.index("hand"))
+
+        header = np.full((len(bar_pos), len(HEADER_CLASSES)), -1, dtype=np.int32)
+        hand_pos = _last_before(hand_marks, bar_pos, doc_start)
+        header[:, 0] = np.where(hand_pos >= 0, tokens[np.maximum(hand_pos, 0)], -1)
+        lower = np.maximum(hand_pos, doc_start)  # état remis à zéro à chaque main et à chaque document
+        for j, name in enumerate(HEADER_CLASSES[1:], start=1):
+            pos = _last_before(np.flatnonzero(classes == TOKEN_CLASSES.index(name)), bar_pos, lower)
+            header[:, j] = np.where(pos >= 0, tokens[np.maximum(pos, 0)], -1)
+
+        bounds = np.unique(np.concatenate([bar_pos, hand_marks, offsets[1:]]))
+        bar_end = bounds[np.minimum(np.searchsorted(bounds, bar_pos, side="right"), len(bounds) - 1)]
+
+        n_docs = len(offsets) - 1
+        arrays = {"bar_pos": bar_pos, "bar_end": bar_end, "bar_doc": bar_doc.astype(np.int32),
+                  "header": header, "offsets": np.asarray(offsets, dtype=np.int64)}
+        for h, h_id in hands.items():
+            sel = np.flatnonzero(header[:, 0] == h_id)
+            first = np.full(n_docs, -1, dtype=np.int64)
+            first[bar_doc[sel][::-1]] = sel[::-1]  # affectations répétées : la dernière (la 1re mesure) gagne
+            arrays[f"first_bar_{h}"] = first
+            arrays[f"n_bars_{h}"] = np.bincount(bar_doc[sel], minlength=n_docs)
+        return cls(arrays, hands)
+
+    def save(self, path: Path | str) -> Path:
+        """Écriture atomique (fichier temporaire + os.replace) : plusieurs rangs peuvent construire l'index en même temps."""
+        path = Path(path)
+        if path.suffix != ".npz":
+            path = path / BAR_INDEX
+        arrays = {"bar_pos": self.bar_pos, "bar_end": self.bar_end, "bar_doc": self.bar_doc,
+                  "header": self.header, "offsets": self.offsets,
+                  "hands": np.array(json.dumps(self.hands)), "key": np.array(json.dumps(self.key))}
+        for h in self.hands:
+            arrays[f"first_bar_{h}"] = self.first_bar[h]
+            arrays[f"n_bars_{h}"] = self.n_bars[h]
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: Path | str) -> "BarIndex":
+        path = Path(path)
+        if path.suffix != ".npz":
+            path = path / BAR_INDEX
+        with np.load(path) as data:
+            arrays = {k: data[k] for k in data.files}
+        key = json.loads(str(arrays.pop("key"))) if "key" in arrays else {}
+        return cls(arrays, json.loads(str(arrays.pop("hands"))), key)
+
+    @classmethod
+    def for_corpus(cls, corpus_dir: Path | str, vocab: Vocab | Dict[str, int], verbose: bool = True) -> "BarIndex":
+        """
+        Index d'un corpus packé, gardé dans son dossier ; reconstruit si le corpus a changé
+        (n_tokens, n_docs, vocab_fingerprint de meta.json : même taille mais réencodé avec un
+        autre vocab) ou si le vocab donné n'est plus celui de l'index.
+        """
+        corpus_dir = Path(corpus_dir)
+        vocab = as_vocab(vocab)
+        meta = json.loads((corpus_dir / PACKED_META).read_text(encoding="utf-8"))
+        key = {"n_tokens": meta["n_tokens"], "n_docs": meta["n_docs"],
+               "vocab_fingerprint": meta.get("vocab_fingerprint"), "index_vocab": vocab.fingerprint}
+        if (corpus_dir / BAR_INDEX).exists():
+            index = cls.load(corpus_dir)
+            if index.key == key:
+                return index
+        index = cls.build(corpus_dir, vocab)
+        index.key = key
+        index.save(corpus_dir)
+        if verbose:
+            print(f"🎼 index des mesures : {len(index)} mesures, {len(index.offsets) - 1} morceaux -> {corpus_dir / BAR_INDEX}")
+        return index
+
+    def __len__(self) -> int:
+        return len(self.bar_pos)
+
+    def bar(self, doc: int, n: int, hand: Optional[str] = None) -> int:
+        """Indice (dans l'index) de la mesure n (à partir de 0) du document doc, pour une main ou toutes."""
+        if not 0 <= n < int(self.n_bars[hand][doc]):
+            raise IndexError(f"mesure {n} absente du document {doc} (main {hand}, {int(self.n_bars[hand][doc])} mesures)")
+        return int(self.first_bar[hand][doc]) + n
+
+    def measure(self, doc: int, n: int, hand: Optional[str] = None) -> Tuple[int, int]:
+        """Span [début, fin) dans le flux concaténé de la mesure n du document doc."""
+        i = self.bar(doc, n, hand)
+        return int(self.bar_pos[i]), int(self.bar_end[i])
+
+    def header_ids(self, i: int) -> np.ndarray:
+        """En-tête synthétique de la mesure i (ids main, clef, key, time présents)."""
+        h = self.header[i]
+        return h[h >= 0].astype(np.int64)
+
+
+class BarAlignedDataset(Dataset):
+    """
+    Blocs de block_size tokens qui commencent tous sur un `bar`, précédés de l'en-tête
+    (main + clef + key + time actifs) : le modèle n'a plus à deviner ce contexte en début de bloc.
+    Les blocs couvrent le flux concaténé ; le bloc suivant reprend à la dernière mesure commencée
+    (la mesure coupée est revue en entier). labels : IGNORE_INDEX sur l'en-tête (tokens synthétiques).
+    collator : PackedDataCollator(block_diagonal=False) (position_ids, pas de masque entre documents).
+    """
+    def __init__(
+        self,
+        source: Sequence[Sequence[int]] | PackedCorpus | Path | str,
+        vocab: Vocab | Dict[str, int],
+        block_size: int = 1024,
+        index: Optional[BarIndex] = None,
+        header: bool = True,
+        verbose: bool = True,
+    ) -> None:
+        if isinstance(source, (str, Path)):
+            source = PackedCorpus(Path(source))
+            if index is None:
+                index = BarIndex.for_corpus(source.path, vocab, verbose=verbose)
+        self.tokens, _ = _flat_corpus(source)
+        self.index = index if index is not None else BarIndex.build(source, vocab)
+        self.block_size = block_size
+        self.header = header
+
+        n_tokens = len(self.tokens)
+        self.starts: List[int] = []  # indices de mesures
+        i = 0
+        while i < len(self.index):
+            body = block_size - (len(self.index.header_ids(i)) if header else 0)
+            end = int(self.index.bar_pos[i]) + body
+            if end > n_tokens:
+                break
+            self.starts.append(i)
+            nxt = int(np.searchsorted(self.index.bar_pos, end, side="right")) - 1
+            i = nxt if nxt > i else i + 1
+
+        if verbose:
+            print(f"  -> {len(self.starts)} blocs alignés sur les mesures (taille {block_size}, "
+                  f"{len(self.index)} mesures)")
+
+    @property
+    def collator(self) -> PackedDataCollator:
+        return PackedDataCollator(block_diagonal=False)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+        i = self.starts[idx]
+        head = self.index.header_ids(i) if self.header else np.empty(0, dtype=np.int64)
+        start = int(self.index.bar_pos[i])
+        body = np.asarray(self.tokens[start:start + self.block_size - len(head)], dtype=np.int64)
+        input_ids = torch.from_numpy(np.concatenate([head, body]))
+        labels = input_ids.clone()
+        labels[:len(head)] = IGNORE_INDEX
+        return {"input_ids": input_ids, "labels": labels, "position_ids": torch.arange(self.block_size)}
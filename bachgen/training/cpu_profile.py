@@ -0,0 +1,227 @@
+# bachgen/training/cpu_profile.py
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import itertools
+import os
+
+import torch
+
+from bachgen.training.profiling import StepProfiler
+
+# Profil d'entraînement pour machines sans GPU :
+# - bf16 : autocast CPU si le processeur le gère (AVX512-BF16 / AMX), sinon fp32
+# - torch.compile du modèle (inductor, nécessite un compilateur C++)
+# - attention SDPA (torch.nn.functional.scaled_dot_product_attention)
+# - threads intra-op / inter-op, et répartition des cœurs : les workers du DataLoader sur
+#   les derniers cœurs, les threads de calcul (OpenMP liés aux cœurs) sur les autres.
+
+
+def cpu_supports_bf16() -> bool:
+    try:
+        return bool(torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def numa_cpu_split(num_workers: int) -> Tuple[List[int], List[int]]:
+    """Cœurs disponibles -> (cœurs de calcul, cœurs des workers de chargement)."""
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    if num_workers <= 0 or len(cpus) <= num_workers:
+        return cpus, cpus
+    return cpus[:-num_workers], cpus[-num_workers:]
+
+
+def cpu_profile(
+    bf16: Optional[bool] = None,
+    torch_compile: bool = False,
+    attn_implementation: str = "sdpa",
+    intra_op_threads: Optional[int] = None,
+    inter_op_threads: int = 1,
+    num_workers: Optional[int] = None,
+) -> Dict:
+    """
+    Réglages CPU à passer à default_training_args(cpu_profile=...) et train_gpt2(cpu_profile=...),
+    qui applique aussi l'attention du profil au modèle.
+    Par défaut : bf16 si supporté, SDPA, 1 à 2 workers de chargement et un thread de calcul par cœur restant.
+    """
+    n_cpus = len(numa_cpu_split(0)[0])
+    if num_workers is None:
+        num_workers = min(2, n_cpus - 1)
+    compute, loader = numa_cpu_split(num_workers)
+    return {
+        "bf16": cpu_supports_bf16() if bf16 is None else bf16,
+        "torch_compile": torch_compile,
+        "attn_implementation": attn_implementation,
+        "intra_op_threads": intra_op_threads or len(compute),
+        "inter_op_threads": inter_op_threads,
+        "num_workers": num_workers,
+        "compute_cpus": compute,
+        "loader_cpus": loader,
+    }
+
+
+def configure_cpu_threads(intra_op_threads: int, inter_op_threads: Optional[int] = None, bind: bool = True) -> None:
+    """
+    Fixe les threads de calcul (torch.set_num_threads). bind=True lie les threads OpenMP aux cœurs
+    (proches les uns des autres, donc du même nœud NUMA).
+    Les variables OMP_* ne sont lues par le runtime OpenMP qu'au chargement de torch : elles sont
+    posées seulement si absentes (setdefault, une valeur choisie par l'utilisateur est gardée) et
+    ne servent qu'aux processus lancés ensuite. Pour le processus courant, les exporter avant
+    `import torch` ; après, seul torch.set_num_threads a un effet.
+    """
+    if bind:
+        os.environ.setdefault("OMP_PROC_BIND", "close")
+        os.environ.setdefault("OMP_PLACES", "cores")
+    os.environ.setdefault("OMP_NUM_THREADS", str(intra_op_threads))
+    torch.set_num_threads(intra_op_threads)
+    if inter_op_threads is not None:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            pass  # déjà fixé (un calcul parallèle a déjà eu lieu) : on garde la valeur courante
+
+
+def apply_cpu_profile(profile: Dict) -> None:
+    """
+    Effet sur tout le processus : threads de calcul du profil, et processus principal limité aux
+    cœurs de calcul (les workers de chargement sont placés par LoaderWorkerPinning / pin_loader_workers).
+    """
+    configure_cpu_threads(profile["intra_op_threads"], profile["inter_op_threads"])
+    if profile["compute_cpus"] and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, set(profile["compute_cpus"]))
+
+
+class LoaderWorkerPinning:
+    """
+    worker_init_fn : place chaque worker du DataLoader sur les cœurs de chargement, 1 thread torch,
+    puis appelle le worker_init_fn d'origine (init_fn, ex. seed_worker du Trainer) s'il y en a un.
+    """
+    def __init__(self, cpus: Sequence[int], init_fn: Optional[Callable[[int], None]] = None) -> None:
+        self.cpus = list(cpus)
+        self.init_fn = init_fn
+
+    def __call__(self, worker_id: int) -> None:
+        torch.set_num_threads(1)
+        if self.cpus and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, {self.cpus[worker_id % len(self.cpus)]})
+        if self.init_fn is not None:
+            self.init_fn(worker_id)
+
+
+def pin_loader_workers(loader, cpus: Sequence[int]):
+    """Ajoute LoaderWorkerPinning au DataLoader (avant le lancement de ses workers) ; idempotent."""
+    if not isinstance(loader.worker_init_fn, LoaderWorkerPinning):
+        loader.worker_init_fn = LoaderWorkerPinning(cpus, init_fn=loader.worker_init_fn)
+    return loader
+
+
+# -------------------------
+# Benchmark des combinaisons
+# -------------------------
+
+def _bench_one(
+    config_kwargs: Dict,
+    bf16: bool,
+    compile_model: bool,
+    attn_implementation: str,
+    threads: int,
+    steps: int,
+    warmup: int,
+    batch_size: int,
+    block_size: int,
+    seed: int,
+) -> Dict:
+    from transformers import GPT2LMHeadModel
+    from bachgen.training.train_gpt2 import build_gpt2_config
+
+    configure_cpu_threads(threads, bind=False)
+    torch.manual_seed(seed)
+    config = build_gpt2_config(n_positions=block_size, attn_implementation=attn_implementation, **config_kwargs)
+    model = GPT2LMHeadModel(config)
+    model.train()
+    opt = torch.optim.AdamW(model.parameters(), lr=3e-4)
+    step_model = torch.compile(model) if compile_model else model
+
+    g = torch.Generator().manual_seed(seed)
+    prof = StepProfiler()
+    for i in range(warmup + steps):
+        ids = torch.randint(4, config.vocab_size, (batch_size, block_size), generator=g)
+        prof.start_step()
+        with prof.phase("forward_s"), torch.autocast("cpu", dtype=torch.bfloat16, enabled=bf16):
+            loss = step_model(input_ids=ids, labels=ids).loss
+        with prof.phase("backward_s"):
+            loss.backward()
+        with prof.phase("optimizer_s"):
+            opt.step()
+            opt.zero_grad(set_to_none=True)
+        prof.end_step(tokens=ids.numel())
+    s = prof.summary(skip=warmup)
+    return {
+        "bf16": bf16, "torch_compile": compile_model, "attn": attn_implementation, "threads": threads,
+        "tokens_per_s": s["tokens_per_s"], "step_ms": 1000 * s["step_s_mean"], "peak_rss_mb": s["peak_rss_mb"],
+    }
+
+
+def benchmark_cpu_profiles(
+    steps: int = 300,
+    warmup: int = 5,
+    batch_size: int = 2,
+    block_size: int = 256,
+    vocab_size: int = 364,
+    n_embd: int = 1024,
+    n_layer: int = 4,
+    n_head: int = 4,
+    bf16_options: Optional[Sequence[bool]] = None,
+    compile_options: Sequence[bool] = (False, True),
+    attn_options: Sequence[str] = ("eager", "sdpa"),
+    thread_options: Optional[Sequence[int]] = None,
+    out_csv: Optional[str] = None,
+    seed: int = 0,
+    verbose: bool = True,
+) -> List[Dict]:
+    """
+    Entraîne `steps` steps sur des ids synthétiques pour chaque combinaison d'options
+    (config GPT-2 par défaut du projet : 4 couches, 4 têtes, 1024 dim.) et renvoie les tokens/s.
+    """
+    if bf16_options is None:
+        bf16_options = (False, True) if cpu_supports_bf16() else (False,)
+    if thread_options is None:
+        thread_options = (len(numa_cpu_split(0)[0]),)
+    config_kwargs = dict(vocab_size=vocab_size, pad_id=0, bos_id=2, eos_id=3, n_embd=n_embd, n_layer=n_layer, n_head=n_head)
+
+    results: List[Dict] = []
+    for bf16, compile_model, attn, threads in itertools.product(bf16_options, compile_options, attn_options, thread_options):
+        try:
+            res = _bench_one(config_kwargs, bf16, compile_model, attn, threads, steps, warmup, batch_size, block_size, seed)
+        except Exception as e:  # ex. torch.compile sans compilateur C++
+            res = {"bf16": bf16, "torch_compile": compile_model, "attn": attn, "threads": threads,
+                   "tokens_per_s": 0.0, "step_ms": float("nan"), "peak_rss_mb": float("nan"), "error": str(e)[:200]}
+        results.append(res)
+        if verbose:
+            status = f"{res['tokens_per_s']:.0f} tokens/s, {res['step_ms']:.0f} ms/step" if "error" not in res else f"❌ {res['error']}"
+            print(f"⚙️ bf16={bf16!s:5} compile={compile_model!s:5} attn={attn:5} threads={threads}: {status}")
+
+    if out_csv is not None:
+        import pandas as pd
+        pd.DataFrame(results).to_csv(out_csv, index=False)
+    if verbose and results:
+        best = max(results, key=lambda r: r["tokens_per_s"])
+        print(f"🏁 meilleur : bf16={best['bf16']} compile={best['torch_compile']} attn={best['attn']} "
+              f"threads={best['threads']} ({best['tokens_per_s']:.0f} tokens/s)")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark des options d'entraînement CPU (ids synthétiques).")
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--block-size", type=int, default=256)
+    parser.add_argument("--threads", type=int, nargs="+", default=None)
+    parser.add_argument("--no-compile", action="store_true")
+    parser.add_argument("--csv", default=None)
+    args = parser.parse_args()
+    benchmark_cpu_profiles(steps=args.steps, batch_size=args.batch_size, block_size=args.block_size,
+                           thread_options=args.threads, compile_options=(False,) if args.no_compile else (False, True),
+                           out_csv=args.csv)
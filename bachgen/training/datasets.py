@@ -1,9 +1,17 @@
 # bachgen/training/datasets.py
 from __future__ import annotations
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence, Tuple
+from pathlib import Path
+import bisect
+import json
+import numpy as np
 import torch
 from torch.utils.data import Dataset
 
+from bachgen.vocab_utils import PACKED_META, PACKED_TOKENS, PackedCorpus
+
+IGNORE_INDEX = -100  # labels ignorés par la loss (convention Hugging Face)
+
 class PostTokenizedDataset(Dataset):
     """
     Concatène toutes les séquences d'IDs et les découpe en blocs fixes (LM causal).
@@ -31,8 +39,335 @@ class PostTokenizedDataset(Dataset):
         return {"input_ids": x, "labels": x}
 
 
+def _memmap_tokens(path: Path, dtype: np.dtype, n_tokens: int) -> np.memmap:
+    return np.memmap(Path(path) / PACKED_TOKENS, dtype=dtype, mode="r", shape=(n_tokens,))
+
+
+class MemmapTokenDataset(Dataset):
+    """
+    Même découpage que PostTokenizedDataset (flux concaténé, blocs fixes) mais lu
+    directement depuis un corpus packé (tokens.bin uint16, cf. vocab_utils.PackedCorpusWriter).
+
+    Rien n'est chargé en RAM : le fichier est mappé en mémoire à la première lecture, dans
+    chaque worker du DataLoader (le memmap n'est pas picklé), et les pages sont partagées
+    entre workers via le cache disque. Seul le bloc demandé est converti en int64.
+    """
+    def __init__(self, path: Path, block_size: int = 1024, verbose: bool = True) -> None:
+        self.path = Path(path)
+        self.block_size = block_size
+        meta = json.loads((self.path / PACKED_META).read_text(encoding="utf-8"))
+        self.dtype = np.dtype(meta["dtype"])
+        self.n_tokens = int(meta["n_tokens"])
+        self.n_blocks = self.n_tokens // block_size
+        self._tokens: Optional[np.memmap] = None
+
+        if verbose:
+            print(f"  -> {self.n_blocks} chunks de taille {block_size} (memmap {self.path.name}, {self.n_tokens} tokens)")
+
+    @property
+    def tokens(self) -> np.memmap:
+        if self._tokens is None:
+            self._tokens = _memmap_tokens(self.path, self.dtype, self.n_blocks * self.block_size)
+        return self._tokens
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_tokens"] = None  # chaque worker ré-ouvre son propre mapping
+        return state
+
+    def __len__(self) -> int:
+        return self.n_blocks
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+        if idx < 0:
+            idx += self.n_blocks
+        if not 0 <= idx < self.n_blocks:
+            raise IndexError(idx)
+        start = idx * self.block_size
+        x = torch.from_numpy(self.tokens[start:start + self.block_size].astype(np.int64))
+        return {"input_ids": x, "labels": x}
+
+
+class RandomWindowDataset(Dataset):
+    """
+    Fenêtres de block_size tokens tirées à des positions aléatoires du flux concaténé,
+    au lieu des blocs fixes de PostTokenizedDataset : à chaque époque le modèle voit
+    d'autres découpes, sans matérialiser de blocs qui se recouvrent.
+
+    - source : liste de séquences (stockée en un seul tableau NumPy compact) ou dossier
+      de corpus packé (memmap ouvert à la demande dans chaque worker)
+    - samples_per_epoch : longueur d'une époque (par défaut : autant que de blocs fixes)
+    - stratified : la fenêtre i est tirée dans la i-ème tranche du flux (couverture uniforme)
+    - la position dépend uniquement de (seed, époque, idx) : résultat identique quel que soit
+      le nombre de workers ; set_epoch est partagé avec les workers persistants (mémoire partagée)
+    """
+    def __init__(
+        self,
+        source: Sequence[Sequence[int]] | Path | str,
+        block_size: int = 1024,
+        samples_per_epoch: Optional[int] = None,
+        seed: int = 0,
+        stratified: bool = False,
+        verbose: bool = True,
+    ) -> None:
+        self.block_size = block_size
+        self.seed = seed
+        self.stratified = stratified
+        self._tokens: Optional[np.ndarray] = None
+        if isinstance(source, (str, Path)):
+            self.path: Optional[Path] = Path(source)
+            meta = json.loads((self.path / PACKED_META).read_text(encoding="utf-8"))
+            self.dtype = np.dtype(meta["dtype"])
+            self.n_tokens = int(meta["n_tokens"])
+        else:
+            self.path = None
+            arrays = [np.asarray(s, dtype=np.int64) for s in source]
+            flat = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+            self.dtype = np.dtype(np.uint16) if not flat.size or flat.max() <= np.iinfo(np.uint16).max else np.dtype(np.int64)
+            self._tokens = flat.astype(self.dtype)
+            self.n_tokens = int(flat.size)
+        if self.n_tokens < block_size:
+            raise ValueError(f"Corpus trop court ({self.n_tokens} tokens) pour des fenêtres de {block_size}.")
+        self.max_start = self.n_tokens - block_size
+        self.samples_per_epoch = samples_per_epoch or self.n_tokens // block_size
+        self._epoch = torch.zeros(1, dtype=torch.long).share_memory_()
+
+        if verbose:
+            print(f"  -> {self.samples_per_epoch} fenêtres aléatoires de taille {block_size} par époque "
+                  f"(parmi {self.max_start + 1} positions)")
+
+    @property
+    def tokens(self) -> np.ndarray:
+        if self._tokens is None:
+            self._tokens = _memmap_tokens(self.path, self.dtype, self.n_tokens)
+        return self._tokens
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.path is not None:
+            state["_tokens"] = None
+        return state
+
+    @property
+    def epoch(self) -> int:
+        return int(self._epoch[0])
+
+    def set_epoch(self, epoch: int) -> None:
+        self._epoch[0] = epoch
+
+    def offset(self, idx: int) -> int:
+        rng = np.random.default_rng((self.seed, self.epoch, idx))
+        if not self.stratified:
+            return int(rng.integers(0, self.max_start + 1))
+        stride = (self.max_start + 1) / self.samples_per_epoch
+        lo = int(idx * stride)
+        hi = max(lo + 1, int((idx + 1) * stride))
+        return int(rng.integers(lo, min(hi, self.max_start + 1)))
+
+    def __len__(self) -> int:
+        return self.samples_per_epoch
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+        if not 0 <= idx < self.samples_per_epoch:
+            raise IndexError(idx)
+        start = self.offset(idx)
+        x = torch.from_numpy(self.tokens[start:start + self.block_size].astype(np.int64))
+        return {"input_ids": x, "labels": x}
+
+
+def segment_document(length: int, block_size: int, bar_positions: Optional[np.ndarray] = None) -> List[Tuple[int, int]]:
+    """
+    Découpe un document trop long en segments [start, end) de taille <= block_size.
+    Si bar_positions est donné (indices des tokens `bar`), chaque coupe se fait juste avant
+    le dernier `bar` qui tient dans le bloc ; sinon (ou si aucun `bar` ne convient) coupe nette.
+    """
+    segments: List[Tuple[int, int]] = []
+    start = 0
+    while length - start > block_size:
+        end = start + block_size
+        if bar_positions is not None and len(bar_positions):
+            k = bisect.bisect_right(bar_positions, end) - 1
+            if k >= 0 and bar_positions[k] > start:
+                end = int(bar_positions[k])
+        segments.append((start, end))
+        start = end
+    if length > start:
+        segments.append((start, length))
+    return segments
+
+
+class PackedDocumentDataset(Dataset):
+    """
+    Range des morceaux entiers (ou des segments alignés sur les mesures pour les morceaux
+    plus longs que block_size) dans des blocs de block_size tokens, par "best fit decreasing".
+
+    Chaque exemple contient :
+    - input_ids : documents collés puis [PAD] jusqu'à block_size
+    - position_ids : remis à 0 au début de chaque document
+    - labels : input_ids, sauf IGNORE_INDEX sur le padding et sur le 1er token de chaque
+      document (il serait prédit à partir du document précédent)
+    Avec PackedDataCollator (self.collator), l'attention est en plus restreinte au document courant.
+
+    self.stats donne le taux de padding et la comparaison avec le découpage fixe
+    (tokens perdus en fin de flux par PostTokenizedDataset).
+    """
+    def __init__(
+        self,
+        sequences: Sequence[Sequence[int]] | PackedCorpus | Path | str,
+        block_size: int = 1024,
+        pad_id: int = 0,
+        bar_id: Optional[int] = None,
+        verbose: bool = True,
+    ) -> None:
+        if isinstance(sequences, (str, Path)):
+            sequences = PackedCorpus(Path(sequences))
+        self.sequences = sequences
+        self.block_size = block_size
+        self.pad_id = pad_id
+
+        # 1) documents -> segments (doc, start, end)
+        segments: List[Tuple[int, int, int]] = []
+        n_tokens = 0
+        for d, seq in enumerate(sequences):
+            n = len(seq)
+            n_tokens += n
+            if n == 0:
+                continue
+            bars = None
+            if bar_id is not None and n > block_size:
+                bars = np.flatnonzero(np.asarray(seq) == bar_id)
+            segments.extend((d, a, b) for a, b in segment_document(n, block_size, bars))
+
+        # 2) best fit decreasing : chaque segment va dans le bloc le plus plein qui peut le recevoir
+        segments.sort(key=lambda s: s[2] - s[1], reverse=True)
+        self.blocks: List[List[Tuple[int, int, int]]] = []
+        free: List[Tuple[int, int]] = []  # (place restante, n° de bloc), trié
+        for seg in segments:
+            size = seg[2] - seg[1]
+            k = bisect.bisect_left(free, (size, -1))
+            if k < len(free):
+                room, b = free.pop(k)
+            else:
+                room, b = block_size, len(self.blocks)
+                self.blocks.append([])
+            self.blocks[b].append(seg)
+            if room - size > 0:
+                bisect.insort(free, (room - size, b))
+
+        capacity = len(self.blocks) * block_size
+        self.stats: Dict[str, float] = {
+            "n_docs": len(sequences),
+            "n_segments": len(segments),
+            "n_blocks": len(self.blocks),
+            "n_tokens": n_tokens,
+            "pad_tokens": capacity - n_tokens,
+            "pad_pct": 100.0 * (capacity - n_tokens) / capacity if capacity else 0.0,
+            "fixed_chunks_dropped_pct": 100.0 * (n_tokens % block_size) / n_tokens if n_tokens else 0.0,
+        }
+        if verbose:
+            print(f"  -> {len(self.blocks)} blocs de taille {block_size} ({len(segments)} segments de "
+                  f"{len(sequences)} morceaux, padding {self.stats['pad_pct']:.1f} %)")
+
+    @property
+    def collator(self) -> "PackedDataCollator":
+        return PackedDataCollator()
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+        input_ids = np.full(self.block_size, self.pad_id, dtype=np.int64)
+        labels = np.full(self.block_size, IGNORE_INDEX, dtype=np.int64)
+        position_ids = np.zeros(self.block_size, dtype=np.int64)
+        pos = 0
+        for d, a, b in self.blocks[idx]:
+            n = b - a
+            input_ids[pos:pos + n] = self.sequences[d][a:b]
+            labels[pos + 1:pos + n] = input_ids[pos + 1:pos + n]
+            position_ids[pos:pos + n] = np.arange(n)
+            pos += n
+        # le padding forme son propre "document" : positions 0.. et aucune loss
+        position_ids[pos:] = np.arange(self.block_size - pos)
+        return {
+            "input_ids": torch.from_numpy(input_ids),
+            "labels": torch.from_numpy(labels),
+            "position_ids": torch.from_numpy(position_ids),
+        }
+
+
+# Au-delà, même construit sur le device, le masque dense (batch, 1, L, L) coûte trop de mémoire
+# et un masque arbitraire empêche SDPA d'utiliser ses noyaux économes : pour les contextes
+# longs (cf. long_context), utiliser des blocs non packés ou block_diagonal=False.
+MAX_BLOCK_DIAGONAL_LEN = 2048
+
+
+def document_ids(position_ids: torch.Tensor) -> torch.Tensor:
+    """N° de document de chaque position (les documents commencent aux remises à 0 de position_ids)."""
+    return (position_ids == 0).cumsum(-1)
+
+
+def block_diagonal_mask(doc_ids: torch.Tensor, dtype: torch.dtype = torch.float32) -> torch.Tensor:
+    """
+    Masque d'attention 4D additif (batch, 1, L, L) : causal et limité au document courant.
+    doc_ids : (batch, L), cf. document_ids.
+    """
+    same_doc = doc_ids[:, :, None] == doc_ids[:, None, :]
+    L = doc_ids.shape[-1]
+    causal = torch.ones(L, L, dtype=torch.bool, device=doc_ids.device).tril()
+    allowed = same_doc & causal
+    mask = torch.zeros(allowed.shape, dtype=dtype, device=doc_ids.device)
+    mask.masked_fill_(~allowed, torch.finfo(dtype).min)
+    return mask[:, None]
+
+
+def install_block_diagonal_mask(model):
+    """
+    Hook sur le modèle : remplace la clé document_ids du batch (entiers, batch x L) par le masque
+    bloc-diagonal, construit sur le device du modèle dans son dtype (celui de l'autocast s'il est actif).
+    Le collator n'envoie ainsi que O(L) entiers par exemple. Renvoie le handle du hook.
+    """
+    def _hook(module, args, kwargs):
+        doc_ids = kwargs.pop("document_ids", None)
+        if doc_ids is None:
+            return None
+        device_type = doc_ids.device.type
+        if torch.is_autocast_enabled(device_type):
+            dtype = torch.get_autocast_dtype(device_type)
+        else:
+            dtype = next(module.parameters()).dtype
+        kwargs["attention_mask"] = block_diagonal_mask(doc_ids, dtype)
+        return args, kwargs
+
+    return model.register_forward_pre_hook(_hook, with_kwargs=True)
+
+
+class PackedDataCollator:
+    """
+    Collator de PackedDocumentDataset : empile input_ids / labels / position_ids et,
+    si block_diagonal, ajoute document_ids, dont le modèle (install_block_diagonal_mask)
+    tire le masque qui empêche l'attention entre documents. Refusé au-delà de
+    MAX_BLOCK_DIAGONAL_LEN tokens.
+    """
+    def __init__(self, block_diagonal: bool = True, max_len: int = MAX_BLOCK_DIAGONAL_LEN) -> None:
+        self.block_diagonal = block_diagonal
+        self.max_len = max_len
+
+    def __call__(self, batch):
+        out = {k: torch.stack([b[k] for b in batch]) for k in ("input_ids", "labels", "position_ids")}
+        if self.block_diagonal:
+            L = out["position_ids"].shape[-1]
+            if L > self.max_len:
+                raise ValueError(f"Masque bloc-diagonal refusé pour des blocs de {L} tokens (max {self.max_len}) : "
+                                 "utiliser block_diagonal=False ou des blocs non packés.")
+            out["document_ids"] = document_ids(out["position_ids"])
+        return out
+
+
 class SimpleDataCollator:
+    """
+    LM causal : labels == input_ids (le décalage est fait dans le modèle), donc le batch
+    est empilé une seule fois et le même tenseur sert aux deux clés.
+    """
     def __call__(self, batch):
         input_ids = torch.stack([b["input_ids"] for b in batch])
-        labels    = torch.stack([b["labels"] for b in batch])
-        return {"input_ids": input_ids, "labels": labels}
+        return {"input_ids": input_ids, "labels": input_ids}
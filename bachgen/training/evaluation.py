@@ -0,0 +1,262 @@
+# bachgen/training/evaluation.py
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple
+from pathlib import Path
+import hashlib
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import TrainerCallback
+
+from bachgen.vocab_utils import PACKED_TOKENS, PackedCorpus, Vocab, as_vocab
+
+# Perplexité par fenêtres glissantes : chaque token est évalué une seule fois, mais avec
+# jusqu'à block_size - stride tokens de contexte (au lieu de 0 en début de bloc fixe).
+# Les fenêtres sont construites une fois et gardées en tenseurs (int32 + masque des cibles),
+# éventuellement sur disque (cache_path), puis évaluées par gros batches sous inference_mode.
+
+
+# Classes de tokens (préfixes de note_to_tokens / attribute_to_token) pour le détail de la loss
+TOKEN_CLASSES = ("pitch", "rest", "duration", "bar", "hand", "voice", "clef", "key", "time",
+                 "stem", "beam", "tie", "special", "other")
+_PREFIX_CLASSES = {"note": "pitch", "len": "duration", "clef": "clef", "key": "key", "time": "time",
+                   "stem": "stem", "beam": "beam", "tie": "tie"}
+_EXACT_CLASSES = {"rest": "rest", "bar": "bar", "R": "hand", "L": "hand", "<voice>": "voice", "</voice>": "voice"}
+
+
+def token_class(token: str) -> str:
+    if token in _EXACT_CLASSES:
+        return _EXACT_CLASSES[token]
+    return _PREFIX_CLASSES.get(token.split("_")[0], "other")
+
+
+def token_class_ids(vocab: Vocab | Dict[str, int]) -> np.ndarray:
+    """Tableau (vocab_size,) id -> indice dans TOKEN_CLASSES, calculé une fois par vocab."""
+    vocab = as_vocab(vocab)
+    classes = np.array([TOKEN_CLASSES.index(token_class(t)) for t in vocab.id2token.tolist()], dtype=np.int64)
+    classes[vocab.special_mask] = TOKEN_CLASSES.index("special")
+    return classes
+
+
+def window_spans(length: int, block_size: int, stride: int) -> List[Tuple[int, int, int]]:
+    """
+    Fenêtres (début, fin, 1re cible) d'un document de `length` tokens : chaque token (sauf le
+    premier, sans contexte) est cible d'une seule fenêtre, celle qui lui donne le plus de contexte.
+    Avec stride == block_size (blocs disjoints), le 1er token de chaque bloc n'est pas évalué.
+    """
+    spans: List[Tuple[int, int, int]] = []
+    prev_end = 0
+    for begin in range(0, max(length, 1), stride):
+        end = min(begin + block_size, length)
+        spans.append((begin, end, max(prev_end, begin + 1)))
+        prev_end = end
+        if end == length:
+            break
+    return spans
+
+
+FINGERPRINT_CHUNK = 1 << 20  # octets de tokens.bin hachés au début, au milieu et à la fin
+
+
+def data_fingerprint(sequences: Sequence[Sequence[int]] | PackedCorpus) -> str:
+    """
+    Empreinte des données évaluées (clé du cache de fenêtres). Corpus packé : n_tokens / n_docs /
+    vocab_fingerprint de meta.json, hash des offsets, taille et date de tokens.bin et hash de
+    3 tranches de FINGERPRINT_CHUNK octets (tout le fichier s'il est plus petit), sans tout relire.
+    Liste de séquences : hash des longueurs et des ids.
+    """
+    h = hashlib.sha1()
+    if isinstance(sequences, PackedCorpus):
+        meta = sequences.meta
+        h.update(np.ascontiguousarray(sequences.offsets, dtype=np.int64).tobytes())
+        tokens_path = sequences.path / PACKED_TOKENS
+        if tokens_path.exists():
+            st = tokens_path.stat()
+            h.update(f"{st.st_size}|{st.st_mtime_ns}".encode("utf-8"))
+            with open(tokens_path, "rb") as f:
+                for start in sorted({0, max(0, st.st_size // 2 - FINGERPRINT_CHUNK // 2),
+                                     max(0, st.st_size - FINGERPRINT_CHUNK)}):
+                    f.seek(start)
+                    h.update(f.read(FINGERPRINT_CHUNK))
+        return f"packed|{meta['n_tokens']}|{meta['n_docs']}|{meta.get('vocab_fingerprint')}|{h.hexdigest()}"
+    for seq in sequences:
+        arr = np.asarray(seq, dtype=np.int64)
+        h.update(np.int64(arr.size).tobytes())
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+class SlidingWindowEvaluator:
+    """
+    Args:
+        sequences: liste de séquences d'ids, ou dossier de corpus packé
+        block_size: taille des fenêtres (<= n_positions du modèle)
+        stride: décalage entre fenêtres, 1 <= stride <= block_size (block_size -> blocs disjoints ;
+            block_size // 2 par défaut)
+        per_document: fenêtres par morceau (pas de contexte venu d'un autre morceau) ; sinon flux concaténé
+        cache_path: fichier .pt où garder les fenêtres entre deux exécutions (reconstruites si les
+            paramètres ou les données ont changé, cf. data_fingerprint)
+        vocab: si donné, evaluate détaille aussi loss et précision par classe de token (TOKEN_CLASSES)
+    """
+    def __init__(
+        self,
+        sequences: Sequence[Sequence[int]] | Path | str,
+        block_size: int = 1024,
+        stride: Optional[int] = None,
+        batch_size: int = 16,
+        pad_id: int = 0,
+        per_document: bool = True,
+        cache_path: Optional[Path | str] = None,
+        vocab: Optional[Vocab | Dict[str, int]] = None,
+        verbose: bool = True,
+    ) -> None:
+        self.class_ids = torch.from_numpy(token_class_ids(vocab)) if vocab is not None else None
+        self.block_size = block_size
+        self.stride = stride or max(1, block_size // 2)
+        if not 1 <= self.stride <= block_size:
+            raise ValueError(f"stride doit être entre 1 et block_size ({block_size}), reçu {self.stride}")
+        self.batch_size = batch_size
+        self.pad_id = pad_id
+        if isinstance(sequences, (str, Path)):
+            sequences = PackedCorpus(Path(sequences))
+        cache_path = Path(cache_path) if cache_path is not None else None
+        key = {"block_size": block_size, "stride": self.stride, "pad_id": pad_id, "per_document": per_document}
+        if cache_path is not None:
+            key["data"] = data_fingerprint(sequences)
+
+        if cache_path is not None and cache_path.exists():
+            cached = torch.load(cache_path)
+            if cached["key"] == key:
+                self.windows, self.target_mask = cached["windows"], cached["target_mask"]
+                if verbose:
+                    print(f"  -> {len(self.windows)} fenêtres d'évaluation rechargées depuis {cache_path}")
+                return
+
+        if not per_document:
+            arrays = [np.asarray(s, dtype=np.int64) for s in sequences]
+            sequences = [np.concatenate(arrays)] if arrays else []
+        self.windows, self.target_mask = self._build(sequences)
+        if cache_path is not None:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            torch.save({"key": key, "windows": self.windows, "target_mask": self.target_mask}, cache_path)
+        if verbose:
+            print(f"  -> {len(self.windows)} fenêtres de {block_size} (pas {self.stride}), "
+                  f"{int(self.target_mask.sum())} tokens évalués")
+
+    def _build(self, sequences) -> Tuple[torch.Tensor, torch.Tensor]:
+        spans = [(d, b, e, f) for d, seq in enumerate(sequences) if len(seq) > 1
+                 for b, e, f in window_spans(len(seq), self.block_size, self.stride)]
+        windows = np.full((len(spans), self.block_size), self.pad_id, dtype=np.int32)
+        mask = np.zeros((len(spans), self.block_size), dtype=bool)
+        for i, (d, b, e, f) in enumerate(spans):
+            windows[i, :e - b] = np.asarray(sequences[d][b:e])
+            mask[i, f - b:e - b] = True
+        return torch.from_numpy(windows), torch.from_numpy(mask)
+
+    def __len__(self) -> int:
+        return len(self.windows)
+
+    def subset(self, max_windows: int, seed: int = 0) -> torch.Tensor:
+        """Indices d'un sous-ensemble fixe de fenêtres (mode rapide, même tirage à chaque époque)."""
+        if max_windows >= len(self):
+            return torch.arange(len(self))
+        g = torch.Generator().manual_seed(seed)
+        return torch.randperm(len(self), generator=g)[:max_windows].sort().values
+
+    def batches(self, indices: Optional[torch.Tensor] = None):
+        idx = torch.arange(len(self)) if indices is None else indices
+        for start in range(0, len(idx), self.batch_size):
+            sel = idx[start:start + self.batch_size]
+            yield self.windows[sel].long(), self.target_mask[sel]
+
+    @torch.inference_mode()
+    def evaluate(self, model, max_windows: Optional[int] = None, seed: int = 0, device=None) -> Dict[str, float]:
+        """
+        Perte moyenne par token cible et perplexité. max_windows : sous-ensemble rapide
+        (contrôle à chaque époque) ; None : toutes les fenêtres (chiffres finaux).
+        """
+        was_training = model.training
+        model.eval()
+        device = device or next(model.parameters()).device
+        indices = self.subset(max_windows, seed) if max_windows is not None else None
+        n_classes = len(TOKEN_CLASSES)
+        class_ids = self.class_ids.to(device) if self.class_ids is not None else None
+        # sommes par classe : [loss, bonnes prédictions, tokens] ; la classe 0 sert de total sans vocab
+        sums = torch.zeros(3, n_classes, dtype=torch.float64, device=device)
+        for ids, mask in self.batches(indices):
+            ids, mask = ids.to(device), mask.to(device)
+            logits = model(input_ids=ids).logits[:, :-1].float()
+            targets = mask[:, 1:]
+            y = ids[:, 1:][targets]
+            scored = logits[targets]
+            losses = F.cross_entropy(scored, y, reduction="none")
+            correct = (scored.argmax(-1) == y).double()
+            cls = class_ids[y] if class_ids is not None else torch.zeros_like(y)
+            for row, values in enumerate((losses.double(), correct, torch.ones_like(correct))):
+                sums[row] += torch.bincount(cls, weights=values, minlength=n_classes)
+        if was_training:
+            model.train()
+
+        nll, n_correct, n_tokens = (float(v) for v in sums.sum(dim=1))
+        loss = nll / n_tokens if n_tokens else float("nan")
+        res = {
+            "loss": loss,
+            "ppl": math.exp(loss) if loss < 20 else float("inf"),
+            "accuracy": n_correct / n_tokens if n_tokens else float("nan"),
+            "tokens": int(n_tokens),
+            "windows": len(self) if indices is None else len(indices),
+        }
+        if class_ids is not None:
+            res["by_class"] = {
+                name: {"loss": float(sums[0, c] / sums[2, c]), "accuracy": float(sums[1, c] / sums[2, c]),
+                       "tokens": int(sums[2, c]), "loss_share": float(sums[0, c] / nll) if nll else 0.0}
+                for c, name in enumerate(TOKEN_CLASSES) if sums[2, c] > 0
+            }
+        return res
+
+
+class SlidingWindowEvalCallback(TrainerCallback):
+    """
+    Évaluation glissante à la fin de chaque époque sur un sous-ensemble fixe (quick_windows).
+    Les métriques (sw_eval_loss / sw_eval_ppl / ...) sont gardées puis ajoutées au log suivant
+    du Trainer (on_log : log de l'évaluation ou de la loss, demandé dès la fin de l'époque) ;
+    elles suivent donc le même chemin que les autres (historique, report_to) si le callback
+    passe avant les intégrations de report_to (cf. train_gpt2(sliding_eval=...)).
+    """
+    def __init__(self, evaluator: SlidingWindowEvaluator, quick_windows: Optional[int] = 64, verbose: bool = True) -> None:
+        self.evaluator = evaluator
+        self.quick_windows = quick_windows
+        self.verbose = verbose
+        self.pending: Dict[str, float] = {}
+
+    def on_epoch_end(self, args, state, control, model=None, **kwargs):
+        if model is None:
+            return
+        res = self.evaluator.evaluate(model, max_windows=self.quick_windows)
+        self.pending = {"sw_eval_loss": res["loss"], "sw_eval_ppl": res["ppl"], "sw_eval_accuracy": res["accuracy"]}
+        for name, c in res.get("by_class", {}).items():
+            self.pending[f"sw_eval_loss_{name}"] = c["loss"]
+            self.pending[f"sw_eval_accuracy_{name}"] = c["accuracy"]
+        control.should_log = True
+        if self.verbose:
+            print(f"🔎 éval glissante ({res['windows']} fenêtres) : loss {res['loss']:.4f}, ppl {res['ppl']:.3f}")
+            if "by_class" in res:
+                print(format_class_report(res))
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if not self.pending or logs is None:
+            return
+        logs.update(self.pending)
+        if state.log_history:  # entrée ajoutée par Trainer.log juste avant on_log
+            state.log_history[-1].update(self.pending)
+        self.pending = {}
+
+
+def format_class_report(res: Dict) -> str:
+    """Tableau texte loss / précision / part de la loss par classe de token."""
+    lines = [f"   {'classe':9} {'tokens':>8} {'loss':>7} {'acc':>6} {'part loss':>9}"]
+    for name, c in sorted(res["by_class"].items(), key=lambda kv: -kv[1]["loss_share"]):
+        lines.append(f"   {name:9} {c['tokens']:8d} {c['loss']:7.3f} {c['accuracy']:6.1%} {c['loss_share']:9.1%}")
+    return "\n".join(lines)
@@ -0,0 +1,237 @@
+# bachgen/training/launch.py
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from pathlib import Path
+import json
+import os
+import socket
+import tempfile
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from bachgen.training.cpu_profile import numa_cpu_split
+
+# Entraînement data-parallel sur CPU : N processus locaux (éventuellement sur plusieurs machines)
+# reliés par gloo. Chaque rang reçoit les variables d'environnement de torchrun
+# (RANK, WORLD_SIZE, LOCAL_RANK, MASTER_ADDR, MASTER_PORT) : le Trainer HF passe alors tout seul en
+# DistributedDataParallel, avec un DistributedSampler qui donne à chaque rang sa part des blocs ;
+# seul le rang 0 écrit les checkpoints. Chaque rang a ses propres cœurs (threads + affinité).
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rank_cpus(local_rank: int, nprocs: int) -> List[int]:
+    """Tranche contiguë des cœurs disponibles pour un rang local (cœurs voisins -> même nœud NUMA)."""
+    cpus = numa_cpu_split(0)[0]
+    per_rank = max(1, len(cpus) // nprocs)
+    start = (local_rank * per_rank) % len(cpus)
+    return cpus[start:start + per_rank]
+
+
+def _worker(local_rank: int, fn: Callable, nprocs: int, nnodes: int, node_rank: int, master_addr: str,
+            master_port: int, pin_cpus: bool, fn_args: Tuple) -> None:
+    world_size = nprocs * nnodes
+    rank = node_rank * nprocs + local_rank
+    os.environ.update({
+        "RANK": str(rank), "WORLD_SIZE": str(world_size), "LOCAL_RANK": str(local_rank),
+        "LOCAL_WORLD_SIZE": str(nprocs), "MASTER_ADDR": master_addr, "MASTER_PORT": str(master_port),
+    })
+    cpus = rank_cpus(local_rank, nprocs)
+    os.environ["OMP_NUM_THREADS"] = str(len(cpus))
+    torch.set_num_threads(len(cpus))
+    if pin_cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, set(cpus))
+    fn(*fn_args)
+
+
+def launch(
+    fn: Callable,
+    nprocs: int,
+    args: Sequence = (),
+    nnodes: int = 1,
+    node_rank: int = 0,
+    master_addr: str = "127.0.0.1",
+    master_port: Optional[int] = None,
+    pin_cpus: bool = True,
+) -> None:
+    """
+    Lance fn(*args) dans nprocs processus locaux (spawn). Sur plusieurs machines, lancer la même
+    commande sur chacune avec nnodes, node_rank et l'adresse / le port du nœud 0.
+    fn doit être importable (fonction de module) ; elle appelle init_distributed() si besoin
+    (le Trainer HF le fait lui-même).
+    """
+    if master_port is None:
+        if nnodes > 1:
+            raise ValueError("master_port doit être fixé (identique sur tous les nœuds) quand nnodes > 1.")
+        master_port = free_port()
+    mp.spawn(_worker, args=(fn, nprocs, nnodes, node_rank, master_addr, master_port, pin_cpus, tuple(args)),
+             nprocs=nprocs, join=True)
+
+
+def init_distributed() -> Tuple[int, int]:
+    """Initialise le groupe gloo depuis l'environnement (idempotent) ; renvoie (rang, nombre de rangs)."""
+    if "WORLD_SIZE" not in os.environ:
+        return 0, 1
+    if not dist.is_initialized():
+        dist.init_process_group("gloo")
+    return dist.get_rank(), dist.get_world_size()
+
+
+def is_main_process() -> bool:
+    return int(os.environ.get("RANK", "0")) == 0
+
+
+# -------------------------
+# Entraînement GPT-2 par rang
+# -------------------------
+
+def run_training(cfg: Dict) -> None:
+    """
+    Point d'entrée d'un rang : même pipeline que le notebook (load_split -> make_datasets ->
+    build_gpt2_config -> default_training_args -> train_gpt2 -> save_model), en DDP gloo.
+
+    cfg : {"vocab", "train", "valid", "out_dir", "block_size", "epochs", "batch_size", "grad_accum",
+           "lr", "random_windows", "max_steps", "profile_path", "gradient_checkpointing",
+           "n_embd", "n_layer", "n_head"} (splits : dossiers packés de préférence, lus en memmap :
+           chaque rang ne touche que les pages de ses propres blocs)
+    block_size > 1024 (jusqu'à 8192) : config et arguments "contexte long" (SDPA, sans cache KV,
+    gradient checkpointing sauf cfg["gradient_checkpointing"] = false).
+    """
+    from bachgen.training.splits import load_split, load_vocab_ids
+    from bachgen.training.train_gpt2 import (
+        build_gpt2_config, default_training_args, make_datasets, save_model, train_gpt2,
+    )
+    from bachgen.vocab_utils import is_packed_corpus
+
+    def _split(path):
+        path = Path(path)
+        return path if is_packed_corpus(path) else load_split(path)
+
+    vocab_size, pad_id, bos_id, eos_id = load_vocab_ids(Path(cfg["vocab"]))
+    block_size = cfg.get("block_size", 1024)
+    train_ds, valid_ds, _ = make_datasets(_split(cfg["train"]), _split(cfg["valid"]), [], block_size=block_size,
+                                          random_windows=cfg.get("random_windows", False))
+    config = build_gpt2_config(vocab_size, pad_id, bos_id, eos_id, n_positions=block_size,
+                               **{k: cfg[k] for k in ("n_embd", "n_layer", "n_head") if k in cfg})
+    extra = {"max_steps": cfg["max_steps"]} if cfg.get("max_steps") else {}
+    args = default_training_args(Path(cfg["out_dir"]), num_epochs=cfg.get("epochs", 8),
+                                 per_device_bs=cfg.get("batch_size", 2), grad_accum=cfg.get("grad_accum", 4),
+                                 lr=cfg.get("lr", 3e-4), fp16=False, num_workers=cfg.get("num_workers", 0),
+                                 block_size=block_size, gradient_checkpointing=cfg.get("gradient_checkpointing"),
+                                 ddp_backend="gloo", use_cpu=True, save_on_each_node=False, **extra)
+    if args.world_size != int(os.environ.get("WORLD_SIZE", "1")):
+        raise RuntimeError(f"TrainingArguments voit {args.world_size} rang(s) au lieu de {os.environ['WORLD_SIZE']} : "
+                           "pas de DDP (variables d'environnement absentes à la construction ?)")
+    trainer, _ = train_gpt2(train_ds, valid_ds, config, args,
+                            profile_path=cfg.get("profile_path") if is_main_process() else None)
+    if trainer.is_world_process_zero():
+        save_model(trainer, Path(cfg["out_dir"]) / "final")
+
+
+# -------------------------
+# Comparaison de débit 1 processus / N processus
+# -------------------------
+
+def _ddp_bench(cfg: Dict, out_path: str) -> None:
+    from torch.nn.parallel import DistributedDataParallel as DDP
+    from transformers import GPT2LMHeadModel
+    from bachgen.training.train_gpt2 import build_gpt2_config
+
+    rank, world = init_distributed()
+    torch.manual_seed(0)  # mêmes poids initiaux partout (DDP les diffuse de toute façon depuis le rang 0)
+    config = build_gpt2_config(cfg["vocab_size"], 0, 2, 3, n_positions=cfg["block_size"], n_embd=cfg["n_embd"],
+                               n_layer=cfg["n_layer"], n_head=cfg["n_head"])
+    model = GPT2LMHeadModel(config)
+    model.train()
+    ddp = DDP(model) if world > 1 else model
+    opt = torch.optim.AdamW(ddp.parameters(), lr=1e-4)
+    g = torch.Generator().manual_seed(1000 + rank)  # chaque rang a sa part des données
+    shape = (cfg["batch_size"], cfg["block_size"])
+    for i in range(cfg["warmup"] + cfg["steps"]):
+        if i == cfg["warmup"]:
+            if world > 1:
+                dist.barrier()
+            t0 = time.perf_counter()
+        ids = torch.randint(4, cfg["vocab_size"], shape, generator=g)
+        ddp(input_ids=ids, labels=ids).loss.backward()
+        opt.step()
+        opt.zero_grad(set_to_none=True)
+    if world > 1:
+        dist.barrier()
+    elapsed = time.perf_counter() - t0
+
+    # poids identiques sur tous les rangs après l'entraînement : checkpoint cohérent
+    checksum = torch.tensor([sum(float(p.double().sum()) for p in model.parameters())], dtype=torch.float64)
+    if world > 1:
+        all_sums = [torch.zeros_like(checksum) for _ in range(world)]
+        dist.all_gather(all_sums, checksum)
+        consistent = all(torch.allclose(s, checksum) for s in all_sums)
+        dist.destroy_process_group()
+    else:
+        consistent = True
+    if rank == 0:
+        tokens = cfg["steps"] * shape[0] * shape[1] * world
+        Path(out_path).write_text(json.dumps({"nprocs": world, "tokens_per_s": tokens / elapsed,
+                                              "step_s": elapsed / cfg["steps"], "consistent": consistent}))
+
+
+def benchmark_ddp(
+    nprocs_list: Sequence[int] = (1, 2, 4),
+    steps: int = 20,
+    warmup: int = 2,
+    batch_size: int = 2,
+    block_size: int = 256,
+    vocab_size: int = 364,
+    n_embd: int = 1024,
+    n_layer: int = 4,
+    n_head: int = 4,
+    verbose: bool = True,
+) -> List[Dict]:
+    """Débit agrégé (tokens/s) d'un entraînement DDP gloo sur ids synthétiques, pour chaque nombre de rangs."""
+    cfg = dict(steps=steps, warmup=warmup, batch_size=batch_size, block_size=block_size, vocab_size=vocab_size,
+               n_embd=n_embd, n_layer=n_layer, n_head=n_head)
+    results: List[Dict] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in nprocs_list:
+            out = str(Path(tmp) / f"bench_{n}.json")
+            launch(_ddp_bench, n, args=(cfg, out))
+            res = json.loads(Path(out).read_text())
+            results.append(res)
+            if verbose:
+                speedup = res["tokens_per_s"] / results[0]["tokens_per_s"]
+                print(f"🖥️ {n} processus : {res['tokens_per_s']:.0f} tokens/s (x{speedup:.2f}), "
+                      f"{res['step_s'] * 1000:.0f} ms/step, poids cohérents : {res['consistent']}")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Entraînement GPT-2 data-parallel sur CPU (gloo).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_train = sub.add_parser("train")
+    p_train.add_argument("--nproc", type=int, required=True, help="processus par machine")
+    p_train.add_argument("--nnodes", type=int, default=1)
+    p_train.add_argument("--node-rank", type=int, default=0)
+    p_train.add_argument("--master-addr", default="127.0.0.1")
+    p_train.add_argument("--master-port", type=int, default=None)
+    p_train.add_argument("--config", required=True, help="JSON : vocab, train, valid, out_dir, block_size...")
+    p_bench = sub.add_parser("bench")
+    p_bench.add_argument("--nproc", type=int, nargs="+", default=[1, 2, 4])
+    p_bench.add_argument("--steps", type=int, default=20)
+    p_bench.add_argument("--block-size", type=int, default=256)
+    args = parser.parse_args()
+
+    if args.cmd == "train":
+        cfg = json.loads(Path(args.config).read_text(encoding="utf-8"))
+        launch(run_training, args.nproc, args=(cfg,), nnodes=args.nnodes, node_rank=args.node_rank,
+               master_addr=args.master_addr, master_port=args.master_port)
+    else:
+        benchmark_ddp(args.nproc, steps=args.steps, block_size=args.block_size)
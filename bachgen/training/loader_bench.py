@@ -0,0 +1,139 @@
+# bachgen/training/loader_bench.py
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional, Sequence
+import time
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from bachgen.training.datasets import SimpleDataCollator
+
+# Mesure du débit du DataLoader : temps passé à attendre les batches vs temps de calcul.
+# Si "loader_bound_pct" est élevé, le modèle attend les données : augmenter num_workers /
+# prefetch_factor (cf. train_gpt2.default_training_args).
+
+
+def make_dataloader(
+    ds: Dataset,
+    batch_size: int = 2,
+    collate_fn: Optional[Callable] = None,
+    num_workers: int = 0,
+    prefetch_factor: int = 4,
+    persistent_workers: bool = True,
+    pin_memory: bool = False,
+    shuffle: bool = True,
+) -> DataLoader:
+    """DataLoader avec les mêmes options que celles passées au Trainer."""
+    return DataLoader(
+        ds,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        collate_fn=collate_fn or SimpleDataCollator(),
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor if num_workers > 0 else None,
+        persistent_workers=persistent_workers and num_workers > 0,
+        pin_memory=pin_memory,
+    )
+
+
+def loader_throughput(
+    loader: DataLoader,
+    n_batches: int = 50,
+    step_fn: Optional[Callable[[Dict[str, torch.Tensor]], None]] = None,
+    warmup: int = 2,
+) -> Dict[str, float]:
+    """
+    Itère n_batches batches (après warmup batches non comptés : démarrage des workers)
+    et sépare le temps d'attente du loader du temps de step_fn (ex. forward + backward).
+    """
+    it = iter(loader)
+    wait = step = 0.0
+    tokens = batches = 0
+    for i in range(warmup + n_batches):
+        t0 = time.perf_counter()
+        try:
+            batch = next(it)
+        except StopIteration:
+            it = iter(loader)
+            batch = next(it)
+        t1 = time.perf_counter()
+        if step_fn is not None:
+            step_fn(batch)
+        t2 = time.perf_counter()
+        if i >= warmup:
+            wait += t1 - t0
+            step += t2 - t1
+            tokens += batch["input_ids"].numel()
+            batches += 1
+    total = wait + step
+    return {
+        "batches": batches,
+        "batches_per_s": batches / total if total else float("inf"),
+        "tokens_per_s": tokens / total if total else float("inf"),
+        "wait_s": wait,
+        "step_s": step,
+        "loader_bound_pct": 100.0 * wait / total if total else 0.0,
+    }
+
+
+def model_step_fn(model: torch.nn.Module, lr: float = 1e-4) -> Callable[[Dict[str, torch.Tensor]], None]:
+    """Étape d'entraînement minimale (forward + backward + SGD) pour simuler le Trainer."""
+    opt = torch.optim.SGD(model.parameters(), lr=lr)
+    model.train()
+
+    def step(batch: Dict[str, torch.Tensor]) -> None:
+        loss = model(**batch).loss
+        loss.backward()
+        opt.step()
+        opt.zero_grad(set_to_none=True)
+
+    return step
+
+
+def benchmark_loaders(
+    ds: Dataset,
+    batch_size: int = 2,
+    worker_counts: Sequence[int] = (0, 2, 4),
+    n_batches: int = 50,
+    step_fn: Optional[Callable] = None,
+    collate_fn: Optional[Callable] = None,
+    verbose: bool = True,
+) -> List[Dict[str, float]]:
+    results: List[Dict[str, float]] = []
+    for w in worker_counts:
+        loader = make_dataloader(ds, batch_size=batch_size, collate_fn=collate_fn, num_workers=w)
+        res = {"num_workers": w, **loader_throughput(loader, n_batches=n_batches, step_fn=step_fn)}
+        results.append(res)
+        if verbose:
+            print(f"⏱️ workers={w}: {res['batches_per_s']:.1f} batch/s, {res['tokens_per_s']:.0f} tokens/s, "
+                  f"attente loader {res['loader_bound_pct']:.1f} %")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    from pathlib import Path
+    from transformers import GPT2LMHeadModel
+    from bachgen.training.train_gpt2 import build_gpt2_config, make_dataset
+
+    parser = argparse.ArgumentParser(description="Débit du DataLoader avec différents nombres de workers.")
+    parser.add_argument("split", help="split packé (dossier) ou fichier de split .txt")
+    parser.add_argument("--vocab-size", type=int, required=True)
+    parser.add_argument("--block-size", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4])
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--model", action="store_true", help="inclut forward/backward d'un petit GPT-2")
+    args = parser.parse_args()
+
+    path = Path(args.split)
+    if path.is_dir():
+        ds = make_dataset(path, block_size=args.block_size)
+    else:
+        from bachgen.training.splits import load_split
+        ds = make_dataset(load_split(path), block_size=args.block_size)
+    step_fn = None
+    if args.model:
+        config = build_gpt2_config(args.vocab_size, 0, 2, 3, n_positions=args.block_size, n_embd=256, n_layer=2, n_head=4)
+        step_fn = model_step_fn(GPT2LMHeadModel(config))
+    benchmark_loaders(ds, batch_size=args.batch_size, worker_counts=args.workers, n_batches=args.batches, step_fn=step_fn)
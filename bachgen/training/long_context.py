@@ -0,0 +1,161 @@
+# bachgen/training/long_context.py
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import multiprocessing as mp
+import time
+
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from bachgen.training.profiling import peak_rss_mb
+from bachgen.training.train_gpt2 import build_gpt2_config
+
+# Contextes longs (2k à 8k tokens) pour voir des morceaux entiers :
+# - n_positions = block_size (embeddings de position appris jusque-là)
+# - attention SDPA : pas de matrice (L x L) de scores matérialisée par couche
+# - gradient checkpointing : seules les entrées des couches sont gardées pour le backward,
+#   les activations internes sont recalculées (≈ +30 % de calcul, mémoire ~ O(couches x L x dim))
+# block_size_report mesure mémoire max et débit pour chaque taille de bloc.
+# Dans le pipeline : build_gpt2_config(n_positions > LONG_CONTEXT) et default_training_args(block_size=...)
+# prennent ces réglages d'eux-mêmes (cf. launch.run_training, cfg["block_size"]).
+
+
+def long_context_config(
+    vocab_size: int,
+    pad_id: int,
+    bos_id: int,
+    eos_id: int,
+    block_size: int = 4096,
+    attn_implementation: str = "sdpa",
+    **kwargs,
+) -> GPT2Config:
+    """build_gpt2_config avec n_positions = block_size, SDPA et sans cache KV à l'entraînement."""
+    # use_cache : incompatible avec le gradient checkpointing, inutile à l'entraînement
+    return build_gpt2_config(vocab_size, pad_id, bos_id, eos_id, n_positions=block_size,
+                             attn_implementation=attn_implementation, use_cache=False, **kwargs)
+
+
+def estimate_activation_mb(
+    config: GPT2Config,
+    block_size: int,
+    batch_size: int = 1,
+    checkpointing: bool = False,
+    bytes_per_value: int = 4,
+    attn_implementation: str = "sdpa",
+) -> float:
+    """
+    Ordre de grandeur de la mémoire d'activations d'un step (forward gardé pour le backward).
+    Par couche : ~34 valeurs par token et par dimension, plus les scores d'attention
+    (n_head x L x L, x2 avec softmax/dropout) si attn_implementation == "eager".
+    Avec checkpointing : l'entrée de chaque couche + une seule couche complète.
+    """
+    L, h, a = block_size, config.n_embd, config.n_head
+    per_layer = batch_size * L * h * 34
+    if attn_implementation == "eager":
+        per_layer += batch_size * a * L * L * 2
+    logits = batch_size * L * config.vocab_size * 2
+    if checkpointing:
+        total = config.n_layer * batch_size * L * h + per_layer + logits
+    else:
+        total = config.n_layer * per_layer + logits
+    return total * bytes_per_value / 1024 ** 2
+
+
+def _measure(job: Dict) -> Dict:
+    torch.manual_seed(0)
+    torch.set_num_threads(job["threads"])
+    model = GPT2LMHeadModel(GPT2Config.from_dict(job["config"]))
+    model.set_attn_implementation(job["attn"])
+    config = model.config
+    if job["checkpointing"]:
+        model.gradient_checkpointing_enable()
+    model.train()
+    opt = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    base_rss = peak_rss_mb()
+    ids = torch.randint(4, config.vocab_size, (job["batch_size"], job["block_size"]))
+    times = []
+    for i in range(job["warmup"] + job["steps"]):
+        t0 = time.perf_counter()
+        model(input_ids=ids, labels=ids).loss.backward()
+        opt.step()
+        opt.zero_grad(set_to_none=True)
+        if i >= job["warmup"]:
+            times.append(time.perf_counter() - t0)
+    step_s = sum(times) / len(times)
+    return {
+        "block_size": job["block_size"],
+        "checkpointing": job["checkpointing"],
+        "attn": job["attn"],
+        "step_s": step_s,
+        "tokens_per_s": ids.numel() / step_s,
+        "peak_rss_mb": peak_rss_mb(),
+        "step_rss_mb": peak_rss_mb() - base_rss,
+    }
+
+
+def block_size_report(
+    block_sizes: Sequence[int] = (1024, 2048, 4096, 8192),
+    checkpointing: Sequence[bool] = (False, True),
+    attn: Sequence[str] = ("sdpa",),
+    batch_size: int = 1,
+    steps: int = 3,
+    warmup: int = 1,
+    vocab_size: int = 364,
+    n_embd: int = 1024,
+    n_layer: int = 4,
+    n_head: int = 4,
+    threads: Optional[int] = None,
+    isolate: bool = True,
+    out_csv: Optional[str] = None,
+    verbose: bool = True,
+) -> List[Dict]:
+    """
+    Mémoire max et tokens/s d'un step d'entraînement pour chaque (block_size, checkpointing, attention).
+    isolate=True : chaque mesure tourne dans un processus neuf (la mémoire max d'un processus
+    ne redescend jamais) ; isolate=False : mesure sur place, plus rapide mais cumulative.
+    Une configuration qui manque de mémoire est rapportée avec "error".
+    """
+    threads = threads or torch.get_num_threads()
+    results: List[Dict] = []
+    for L, ckpt, impl in itertools.product(block_sizes, checkpointing, attn):
+        config = build_gpt2_config(vocab_size, 0, 2, 3, n_positions=L, n_embd=n_embd, n_layer=n_layer,
+                                   n_head=n_head, attn_implementation=impl, use_cache=False)
+        job = {"config": config.to_dict(), "attn": impl, "checkpointing": ckpt, "block_size": L,
+               "batch_size": batch_size, "steps": steps, "warmup": warmup, "threads": threads}
+        try:
+            if isolate:
+                with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as ex:
+                    res = ex.submit(_measure, job).result()
+            else:
+                res = _measure(job)
+        except Exception as e:  # MemoryError, processus tué par l'OOM killer...
+            res = {"block_size": L, "checkpointing": ckpt, "attn": impl, "error": type(e).__name__}
+        res["estimated_activation_mb"] = estimate_activation_mb(config, L, batch_size, ckpt, attn_implementation=impl)
+        results.append(res)
+        if verbose:
+            if "error" in res:
+                print(f"📏 L={L:5d} ckpt={ckpt!s:5} attn={impl:5}: ❌ {res['error']}")
+            else:
+                print(f"📏 L={L:5d} ckpt={ckpt!s:5} attn={impl:5}: {res['tokens_per_s']:.0f} tokens/s, "
+                      f"{res['step_s']:.2f} s/step, RSS max {res['peak_rss_mb']:.0f} Mo "
+                      f"(activations estimées {res['estimated_activation_mb']:.0f} Mo)")
+
+    if out_csv is not None:
+        import pandas as pd
+        pd.DataFrame(results).to_csv(out_csv, index=False)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mémoire / débit d'entraînement par taille de bloc.")
+    parser.add_argument("--block-sizes", type=int, nargs="+", default=[1024, 2048, 4096, 8192])
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--attn", nargs="+", default=["sdpa"])
+    parser.add_argument("--csv", default=None)
+    args = parser.parse_args()
+    block_size_report(args.block_sizes, attn=args.attn, batch_size=args.batch_size, steps=args.steps, out_csv=args.csv)
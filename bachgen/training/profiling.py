@@ -0,0 +1,257 @@
+# bachgen/training/profiling.py
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from pathlib import Path
+import csv
+import json
+import resource
+import statistics
+import sys
+import time
+
+import torch
+from transformers import TrainerCallback
+
+# Mesures par step d'entraînement :
+#   data_wait_s | forward_s | backward_s | optimizer_s | step_s | tokens | tokens_per_s | peak_rss_mb (| peak_cuda_mb)
+# écrites ligne par ligne en JSONL (ou CSV selon l'extension), avec en option une trace
+# torch.profiler sur une fenêtre de steps et un résumé en fin d'entraînement.
+
+PHASES = ("data_wait_s", "forward_s", "backward_s", "optimizer_s")
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024  # octets sur macOS, Ko sur Linux
+
+
+class StepProfiler:
+    """
+    Profileur autonome, utilisable dans une boucle écrite à la main :
+
+        prof = StepProfiler("runs/steps.jsonl")
+        for batch in loader:                       # l'attente du loader est mesurée entre end_step et start_step
+            prof.start_step()
+            with prof.phase("forward_s"):
+                loss = model(**batch).loss
+            with prof.phase("backward_s"):
+                loss.backward()
+            with prof.phase("optimizer_s"):
+                opt.step(); opt.zero_grad()
+            prof.end_step(tokens=batch["input_ids"].numel())
+        prof.close()
+
+    trace_steps=(a, b) : trace torch.profiler des steps a..b-1 exportée dans trace_dir.
+    """
+    def __init__(
+        self,
+        out_path: Optional[Path | str] = None,
+        trace_dir: Optional[Path | str] = None,
+        trace_steps: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        self.out_path = Path(out_path) if out_path is not None else None
+        self.trace_dir = Path(trace_dir) if trace_dir is not None else None
+        self.trace_steps = trace_steps
+        self.records: List[Dict[str, float]] = []
+        self._fh = None
+        self._csv = None
+        self._current: Optional[Dict[str, float]] = None
+        self._t_start = 0.0
+        self._t_last_end: Optional[float] = None
+        self._trace = None
+        if self.out_path is not None:
+            self.out_path.parent.mkdir(parents=True, exist_ok=True)
+            self._fh = open(self.out_path, "w", newline="", encoding="utf-8")
+
+    # --- steps ---
+
+    @property
+    def step(self) -> int:
+        return len(self.records)
+
+    def start_step(self) -> None:
+        now = time.perf_counter()
+        self._current = {p: 0.0 for p in PHASES}
+        self._current["data_wait_s"] = now - self._t_last_end if self._t_last_end is not None else 0.0
+        self._t_start = now
+        self._maybe_start_trace()
+
+    def add(self, phase: str, seconds: float) -> None:
+        if self._current is not None:
+            self._current[phase] = self._current.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def end_step(self, tokens: int = 0, **extra) -> Dict[str, float]:
+        now = time.perf_counter()
+        rec = self._current or {p: 0.0 for p in PHASES}
+        rec["step"] = self.step
+        rec["step_s"] = now - self._t_start
+        rec["tokens"] = int(tokens)
+        total = rec["step_s"] + rec["data_wait_s"]
+        rec["tokens_per_s"] = tokens / total if total > 0 else 0.0
+        rec["peak_rss_mb"] = peak_rss_mb()
+        if torch.cuda.is_available():
+            rec["peak_cuda_mb"] = torch.cuda.max_memory_allocated() / 1024 ** 2
+        rec.update(extra)
+        self.records.append(rec)
+        self._write(rec)
+        self._current = None
+        self._t_last_end = now
+        self._maybe_stop_trace()
+        return rec
+
+    def reset_wait(self) -> None:
+        """À appeler après un événement hors chargement (évaluation, sauvegarde) pour ne pas le compter."""
+        self._t_last_end = time.perf_counter()
+
+    def _write(self, rec: Dict[str, float]) -> None:
+        if self._fh is None:
+            return
+        if self.out_path.suffix == ".csv":
+            if self._csv is None:
+                self._csv = csv.DictWriter(self._fh, fieldnames=list(rec), extrasaction="ignore")
+                self._csv.writeheader()
+            self._csv.writerow(rec)
+        else:
+            self._fh.write(json.dumps(rec) + "\n")
+        self._fh.flush()
+
+    # --- trace torch.profiler ---
+
+    def _maybe_start_trace(self) -> None:
+        if self.trace_steps is None or self._trace is not None or self.step != self.trace_steps[0]:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._trace = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+        self._trace.__enter__()
+
+    def _maybe_stop_trace(self) -> None:
+        if self._trace is None or self.step < self.trace_steps[1]:
+            return
+        self._trace.__exit__(None, None, None)
+        trace_dir = self.trace_dir or (self.out_path.parent if self.out_path is not None else Path("."))
+        trace_dir.mkdir(parents=True, exist_ok=True)
+        a, b = self.trace_steps
+        self._trace.export_chrome_trace(str(trace_dir / f"trace_steps_{a}-{b}.json"))
+        self._trace = None
+
+    # --- résumé ---
+
+    def summary(self, skip: int = 1) -> Dict[str, float]:
+        """Moyennes sur les steps (les `skip` premiers, qui incluent le démarrage, sont ignorés si possible)."""
+        recs = self.records[skip:] if len(self.records) > skip else self.records
+        if not recs:
+            return {}
+        step_s = [r["step_s"] for r in recs]
+        wall = sum(r["step_s"] + r["data_wait_s"] for r in recs)
+        out = {
+            "steps": len(recs),
+            "step_s_mean": statistics.fmean(step_s),
+            "step_s_median": statistics.median(step_s),
+            "tokens_per_s": sum(r["tokens"] for r in recs) / wall if wall else 0.0,
+            "peak_rss_mb": max(r["peak_rss_mb"] for r in recs),
+        }
+        for p in PHASES:
+            out[p.replace("_s", "_pct")] = 100.0 * sum(r[p] for r in recs) / wall if wall else 0.0
+        if "peak_cuda_mb" in recs[-1]:
+            out["peak_cuda_mb"] = max(r["peak_cuda_mb"] for r in recs)
+        return out
+
+    def print_summary(self) -> None:
+        s = self.summary()
+        if not s:
+            return
+        print(f"⏱️ {s['steps']} steps : {s['step_s_mean'] * 1000:.0f} ms/step (médiane {s['step_s_median'] * 1000:.0f}), "
+              f"{s['tokens_per_s']:.0f} tokens/s, RSS max {s['peak_rss_mb']:.0f} Mo")
+        print(f"   attente données {s['data_wait_pct']:.1f} % | forward {s['forward_pct']:.1f} % | "
+              f"backward {s['backward_pct']:.1f} % | optimizer {s['optimizer_pct']:.1f} %")
+
+    def close(self) -> None:
+        if self._trace is not None:
+            self._trace.__exit__(None, None, None)
+            self._trace = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class ThroughputCallback(TrainerCallback):
+    """
+    Branche un StepProfiler sur le Trainer :
+    - attente des données : entre la fin d'un step (ou une éval / sauvegarde / log) et le début du suivant
+    - forward : hooks sur le modèle (toutes les micro-batches d'accumulation, tokens comptés au passage)
+    - backward : reste du temps de calcul avant l'optimizer
+    - optimizer : entre on_pre_optimizer_step et on_optimizer_step
+    """
+    def __init__(self, out_path: Optional[Path | str] = None, trace_steps: Optional[Tuple[int, int]] = None,
+                 trace_dir: Optional[Path | str] = None, verbose: bool = True) -> None:
+        self.profiler = StepProfiler(out_path, trace_dir=trace_dir, trace_steps=trace_steps)
+        self.verbose = verbose
+        self._in_step = False
+        self._tokens = 0
+        self._t_fwd = 0.0
+        self._t_pre_opt = 0.0
+        self._hooks = []
+
+    def _forward_pre(self, module, args, kwargs):
+        if self._in_step:
+            ids = kwargs.get("input_ids", args[0] if args else None)
+            if ids is not None:
+                self._tokens += ids.numel()
+            self._t_fwd = time.perf_counter()
+
+    def _forward_post(self, module, args, kwargs, output):
+        if self._in_step:
+            self.profiler.add("forward_s", time.perf_counter() - self._t_fwd)
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        if model is not None and not self._hooks:
+            self._hooks = [
+                model.register_forward_pre_hook(self._forward_pre, with_kwargs=True),
+                model.register_forward_hook(self._forward_post, with_kwargs=True),
+            ]
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._in_step = True
+        self._tokens = 0
+        self.profiler.start_step()
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._t_pre_opt = time.perf_counter()
+        rec = self.profiler._current
+        if rec is not None:
+            rec["backward_s"] = max(0.0, self._t_pre_opt - self.profiler._t_start - rec["forward_s"])
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        self.profiler.add("optimizer_s", time.perf_counter() - self._t_pre_opt)
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self._in_step = False
+        self.profiler.end_step(tokens=self._tokens, global_step=state.global_step)
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        self.profiler.reset_wait()
+
+    def on_save(self, args, state, control, **kwargs):
+        self.profiler.reset_wait()
+
+    def on_log(self, args, state, control, **kwargs):
+        self.profiler.reset_wait()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        for h in self._hooks:
+            h.remove()
+        self._hooks = []
+        if self.verbose:
+            self.profiler.print_summary()
+        self.profiler.close()
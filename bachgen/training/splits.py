@@ -1,10 +1,18 @@
 # bachgen/training/splits.py
 from __future__ import annotations
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Tuple
 from pathlib import Path
+import csv
+import hashlib
 import json
 import random
 
+import numpy as np
+
+from bachgen.vocab_utils import (
+    MANIFEST, PackedCorpus, PackedCorpusWriter, file_stem, is_packed_corpus, load_manifest,
+)
+
 def load_vocab_ids(vocab_path: Path):
     """
     Charge le vocab {token->id} et renvoie (VOCAB_SIZE, PAD, BOS, EOS).
@@ -30,8 +38,11 @@ def read_ids_file(path: Path) -> List[int]:
 
 def load_all_ids(ids_dir: Path, suffix: str = ".txt") -> List[List[int]]:
     """
-    Charge toutes les séquences d'IDs depuis un dossier (un fichier = une séquence).
+    Charge toutes les séquences d'IDs depuis un dossier (un fichier = une séquence),
+    ou depuis un corpus packé (cf. vocab_utils.PackedCorpus).
     """
+    if is_packed_corpus(ids_dir):
+        return [ids for ids in PackedCorpus(ids_dir).to_lists() if ids]
     seqs: List[List[int]] = []
     for p in sorted(Path(ids_dir).glob(f"*{suffix}")):
         ids = read_ids_file(p)
@@ -43,8 +54,9 @@ def split_sequences(
     sequences: List[List[int]],
     train_ratio=0.90, valid_ratio=0.05, seed=42
 ) -> Tuple[List[List[int]], List[List[int]], List[List[int]]]:
-    random.seed(seed)
-    random.shuffle(sequences)
+    # générateur local et copie : ni l'état global de `random` ni la liste de l'appelant ne sont modifiés
+    sequences = list(sequences)
+    random.Random(seed).shuffle(sequences)
     n = len(sequences)
     n_train = int(train_ratio * n)
     n_valid = int(valid_ratio * n)
@@ -60,7 +72,17 @@ def save_split(seqs: List[List[int]], path: Path) -> None:
         for s in seqs:
             f.write(" ".join(map(str, s)) + "\n")
 
+def save_split_packed(seqs: List[List[int]], out_dir: Path, vocab_size: int) -> None:
+    """
+    Variante binaire de save_split : écrit le split comme un corpus packé (uint16 + offsets).
+    """
+    with PackedCorpusWriter(out_dir, vocab_size=vocab_size) as w:
+        for s in seqs:
+            w.add(s)
+
 def load_split(path: Path) -> List[List[int]]:
+    if is_packed_corpus(path):
+        return PackedCorpus(path).to_lists()
     seqs: List[List[int]] = []
     with path.open("r", encoding="utf-8") as f:
         for line in f:
@@ -68,3 +90,98 @@ def load_split(path: Path) -> List[List[int]]:
             if line:
                 seqs.append([int(x) for x in line.split()])
     return seqs
+
+
+# -------------------------
+# Splits par hachage (au niveau des fichiers)
+# -------------------------
+#
+# Le split d'un morceau ne dépend que de son identité (le stem du fichier source) :
+# ajouter ou retirer des fichiers ne déplace jamais les autres entre train / valid / test.
+# Seul un petit index stem -> split est écrit (split_index.csv), les ids restent où ils sont.
+
+SPLITS = ("train", "valid", "test")
+SPLIT_INDEX = "split_index.csv"
+
+
+def split_of(key: str, train_ratio: float = 0.90, valid_ratio: float = 0.05, salt: str = "bachgen") -> str:
+    """Split déterministe d'un fichier : position de sha1(salt:key) dans [0, 1)."""
+    h = int(hashlib.sha1(f"{salt}:{key}".encode("utf-8")).hexdigest()[:16], 16) / 2 ** 64
+    if h < train_ratio:
+        return "train"
+    if h < train_ratio + valid_ratio:
+        return "valid"
+    return "test"
+
+
+def iter_stems(source: Path) -> Iterator[str]:
+    """
+    Stems des documents d'une source, sans lire les ids : corpus packé (docs.csv),
+    manifest.json d'un dossier d'ids (ou le fichier lui-même), ou dossier de .ids.txt.
+    """
+    source = Path(source)
+    if is_packed_corpus(source):
+        yield from PackedCorpus(source).stems
+    elif source.name == MANIFEST or (source / MANIFEST).exists():
+        files = load_manifest(source.parent if source.name == MANIFEST else source)["files"]
+        for name in sorted(files):
+            yield file_stem(name)
+    else:
+        for p in sorted(source.glob("*.ids.txt")):
+            yield file_stem(p)
+
+
+def build_split_index(
+    source: Path,
+    train_ratio: float = 0.90,
+    valid_ratio: float = 0.05,
+    salt: str = "bachgen",
+) -> Dict[str, str]:
+    return {stem: split_of(stem, train_ratio, valid_ratio, salt) for stem in iter_stems(source)}
+
+
+def save_split_index(index: Dict[str, str], path: Path) -> None:
+    """Écrit l'index (stem, split) ; path peut être un dossier (-> split_index.csv)."""
+    path = Path(path)
+    if path.suffix != ".csv":
+        path = path / SPLIT_INDEX
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["stem", "split"])
+        for stem in sorted(index):
+            writer.writerow([stem, index[stem]])
+
+
+def load_split_index(path: Path) -> Dict[str, str]:
+    path = Path(path)
+    if path.suffix != ".csv":
+        path = path / SPLIT_INDEX
+    with open(path, "r", encoding="utf-8") as f:
+        return {row["stem"]: row["split"] for row in csv.DictReader(f)}
+
+
+def iter_split(source: Path, index: Dict[str, str], split: str) -> Iterator[np.ndarray]:
+    """
+    Ids des documents du split demandé, un document à la fois : vues memmap pour un corpus
+    packé, lecture fichier par fichier pour un dossier de .ids.txt. Les documents vides sont ignorés.
+    """
+    source = Path(source)
+    if source.name == MANIFEST:
+        source = source.parent
+    if is_packed_corpus(source):
+        corpus = PackedCorpus(source)
+        lengths = corpus.lengths  # propriété (np.diff des offsets) : calculée une fois, pas par document
+        for i, stem in enumerate(corpus.stems):
+            if index.get(stem) == split and lengths[i]:
+                yield corpus[i]
+    else:
+        for p in sorted(source.glob("*.ids.txt")):
+            if index.get(file_stem(p)) == split:
+                ids = read_ids_file(p)
+                if ids:
+                    yield np.asarray(ids, dtype=np.int64)
+
+
+def split_stats(index: Dict[str, str]) -> Dict[str, int]:
+    return {name: sum(1 for v in index.values() if v == name) for name in SPLITS}
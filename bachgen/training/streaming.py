@@ -0,0 +1,264 @@
+# bachgen/training/streaming.py
+from __future__ import annotations
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
+from pathlib import Path
+import hashlib
+import os
+import posixpath
+import time
+import zipfile
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from bachgen.vocab_utils import Vocab, as_vocab
+
+# Entraînement directement depuis les MusicXML, sans passer par tokenize_folder_with_stats,
+# build_and_encode et les scripts de split : chaque worker du DataLoader tokenise sa part des
+# fichiers, encode avec un vocab figé et garde le résultat (.npy) dans un cache disque.
+# La 1re époque recouvre donc le prétraitement par l'entraînement, les suivantes lisent le cache.
+#
+# Sources : fichiers .musicxml / .xml / .mxl, dossiers, ou archives .zip (membres "archive.zip::membre").
+
+XML_SUFFIXES = (".musicxml", ".xml", ".mxl")
+MEMBER_SEP = "::"
+
+
+def list_sources(inputs: Path | str | Iterable[Path | str], suffixes: Sequence[str] = XML_SUFFIXES) -> List[str]:
+    """Fichiers, dossiers (récursif) et archives .zip -> liste triée de sources."""
+    if isinstance(inputs, (str, Path)):
+        inputs = [inputs]
+    sources: List[str] = []
+    for item in inputs:
+        p = Path(item)
+        if p.is_dir():
+            sources += sorted(str(f) for f in p.rglob("*") if f.suffix.lower() in suffixes)
+        elif p.suffix.lower() == ".zip":
+            with zipfile.ZipFile(p) as zf:
+                sources += sorted(f"{p}{MEMBER_SEP}{m}" for m in zf.namelist()
+                                  if posixpath.splitext(m)[1].lower() in suffixes and not m.startswith("__MACOSX"))
+        else:
+            sources.append(str(p))
+    return sources
+
+
+def _mxl_rootfile(data: bytes) -> bytes:
+    """Contenu MusicXML d'un .mxl (zip) : le rootfile de META-INF/container.xml, sinon le 1er .xml/.musicxml."""
+    with zipfile.ZipFile(BytesIO(data)) as zf:
+        names = zf.namelist()
+        if "META-INF/container.xml" in names:
+            from bs4 import BeautifulSoup
+            container = BeautifulSoup(zf.read("META-INF/container.xml"), "lxml-xml")
+            root = container.find("rootfile")
+            if root is not None and root.get("full-path") in names:
+                return zf.read(root["full-path"])
+        name = next(n for n in names if n.lower().endswith((".musicxml", ".xml")) and not n.startswith("META-INF"))
+        return zf.read(name)
+
+
+def read_musicxml(source: str) -> bytes:
+    if MEMBER_SEP in source:
+        archive, member = source.split(MEMBER_SEP, 1)
+        with zipfile.ZipFile(archive) as zf:
+            data = zf.read(member)
+    else:
+        data = Path(source).read_bytes()
+    return _mxl_rootfile(data) if source.lower().endswith(".mxl") else data
+
+
+def tokenize_source(source: str, note_name: bool = True) -> List[str]:
+    """Une source -> tokens (mêmes tokens que MusicXML_to_tokens, prints de debug avalés)."""
+    from bs4 import BeautifulSoup
+    from bachgen.score_to_tokens_simplify import MusicXML_to_tokens
+
+    soup = BeautifulSoup(read_musicxml(source), "lxml-xml")
+    with redirect_stdout(StringIO()):
+        return MusicXML_to_tokens(soup, note_name=note_name)
+
+
+class TokenCache:
+    """
+    Cache disque des sources déjà tokenisées : un .npy d'ids par source, dont la clé dépend
+    de la source (chemin, taille, date de modification), de l'empreinte du vocab et de note_name.
+    Une source en échec laisse un .err (message) pour ne pas être retentée à chaque époque.
+    Écritures atomiques (fichier temporaire + os.replace) : plusieurs workers peuvent écrire en même temps.
+    """
+    def __init__(self, cache_dir: Path | str, vocab: Vocab, note_name: bool = True) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.salt = f"{vocab.fingerprint}|{note_name}"
+
+    def key(self, source: str) -> str:
+        st = Path(source.split(MEMBER_SEP, 1)[0]).stat()
+        raw = f"{source}|{st.st_size}|{st.st_mtime_ns}|{self.salt}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self.cache_dir / f"{key}.npy"
+        return np.load(path) if path.exists() else None
+
+    def failed(self, key: str) -> bool:
+        return (self.cache_dir / f"{key}.err").exists()
+
+    def _write(self, path: Path, write) -> None:
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+
+    def put(self, key: str, ids: np.ndarray) -> None:
+        self._write(self.cache_dir / f"{key}.npy", lambda f: np.save(f, ids))
+
+    def put_error(self, key: str, message: str) -> None:
+        self._write(self.cache_dir / f"{key}.err", lambda f: f.write(message.encode("utf-8")))
+
+
+class StreamingMusicXMLDataset(IterableDataset):
+    """
+    IterableDataset qui lit les MusicXML au fil de l'eau :
+    - les sources sont mélangées à chaque époque (seed, époque) puis réparties entre les workers
+      du DataLoader (chacun tokenise uniquement sa part)
+    - en DDP, pas de découpage par rang : avec un IterableDataset, accelerate (Trainer HF) fait
+      itérer le seul rang 0 (dispatch_batches=True) et envoie à chaque rang sa part de chaque batch
+    - tokens -> ids avec le vocab figé (inconnus -> [UNK]), BOS/EOS optionnels, résultat mis en cache
+    - flux concaténé découpé en blocs de block_size (comme PostTokenizedDataset), passés par un
+      tampon de mélange de shuffle_buffer blocs
+    Sans __len__ : donner max_steps au Trainer. set_epoch est partagé avec les workers persistants.
+    """
+    def __init__(
+        self,
+        sources: Path | str | Iterable[Path | str],
+        vocab: Vocab | Dict[str, int] | Path | str,
+        block_size: int = 1024,
+        cache_dir: Optional[Path | str] = None,
+        shuffle_buffer: int = 256,
+        seed: int = 0,
+        note_name: bool = True,
+        add_bos: bool = True,
+        add_eos: bool = True,
+        verbose: bool = True,
+    ) -> None:
+        self.sources = list_sources(sources)
+        self.vocab = Vocab.load(vocab) if isinstance(vocab, (str, Path)) else as_vocab(vocab)
+        self.block_size = block_size
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.shuffle_buffer = max(1, shuffle_buffer)
+        self.seed = seed
+        self.note_name = note_name
+        self.add_bos = add_bos
+        self.add_eos = add_eos
+        self.verbose = verbose
+        self._epoch = torch.zeros(1, dtype=torch.long).share_memory_()
+        if verbose:
+            print(f"  -> {len(self.sources)} sources MusicXML en streaming (blocs de {block_size}, "
+                  f"tampon de {self.shuffle_buffer}, cache {self.cache_dir or 'désactivé'})")
+
+    @property
+    def epoch(self) -> int:
+        return int(self._epoch[0])
+
+    def set_epoch(self, epoch: int) -> None:
+        self._epoch[0] = epoch
+
+    def shard(self) -> List[str]:
+        """Sources de ce worker pour l'époque courante (les rangs DDP sont servis par accelerate)."""
+        order = np.random.default_rng((self.seed, self.epoch)).permutation(len(self.sources))
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        return [self.sources[i] for i in order[worker_id::num_workers].tolist()]
+
+    def encode_source(self, source: str, cache: Optional[TokenCache] = None) -> Optional[np.ndarray]:
+        """Ids d'une source (cache si possible) ; None si la tokenisation échoue."""
+        key = cache.key(source) if cache is not None else None
+        if cache is not None:
+            ids = cache.get(key)
+            if ids is not None:
+                return ids
+            if cache.failed(key):
+                return None
+        try:
+            tokens = tokenize_source(source, note_name=self.note_name)
+        except Exception as e:
+            if self.verbose:
+                print(f"❌ {source} : {type(e).__name__}: {e}")
+            if cache is not None:
+                cache.put_error(key, f"{type(e).__name__}: {e}")
+            return None
+        ids = self.vocab.encode(tokens, add_bos=self.add_bos, add_eos=self.add_eos)
+        if cache is not None:
+            cache.put(key, ids)
+        return ids
+
+    def iter_blocks(self) -> Iterator[np.ndarray]:
+        """Blocs dans l'ordre du flux (avant mélange) ; le reste final < block_size est ignoré."""
+        cache = TokenCache(self.cache_dir, self.vocab, self.note_name) if self.cache_dir is not None else None
+        pending: List[np.ndarray] = []
+        n_pending = 0
+        for source in self.shard():
+            ids = self.encode_source(source, cache)
+            if ids is None or not ids.size:
+                continue
+            pending.append(ids)
+            n_pending += ids.size
+            if n_pending < self.block_size:
+                continue
+            stream = np.concatenate(pending)
+            n_blocks = stream.size // self.block_size
+            yield from stream[:n_blocks * self.block_size].reshape(n_blocks, self.block_size)
+            rest = stream[n_blocks * self.block_size:]
+            pending, n_pending = [rest], rest.size
+
+    def __iter__(self) -> Iterator[Dict[str, torch.Tensor]]:
+        info = get_worker_info()
+        rng = np.random.default_rng((self.seed, self.epoch, info.id if info is not None else 0, 1))
+        buffer: List[np.ndarray] = []
+
+        def _pop() -> Dict[str, torch.Tensor]:
+            i = int(rng.integers(len(buffer)))
+            buffer[i], buffer[-1] = buffer[-1], buffer[i]
+            x = torch.from_numpy(buffer.pop().astype(np.int64))
+            return {"input_ids": x, "labels": x}
+
+        for block in self.iter_blocks():
+            buffer.append(block)
+            if len(buffer) >= self.shuffle_buffer:
+                yield _pop()
+        while buffer:
+            yield _pop()
+
+
+def warm_cache(
+    dataset: StreamingMusicXMLDataset,
+    num_workers: int = 0,
+    verbose: bool = True,
+) -> Dict[str, float]:
+    """Une passe complète (sans entraînement) pour remplir le cache ; renvoie blocs et blocs/s."""
+    from torch.utils.data import DataLoader
+
+    loader = DataLoader(dataset, batch_size=None, num_workers=num_workers)
+    t0 = time.perf_counter()
+    n_blocks = sum(1 for _ in loader)
+    elapsed = time.perf_counter() - t0
+    res = {"blocks": n_blocks, "seconds": elapsed, "blocks_per_s": n_blocks / elapsed if elapsed else 0.0}
+    if verbose:
+        print(f"🔥 cache : {n_blocks} blocs en {elapsed:.1f} s ({res['blocks_per_s']:.1f} blocs/s)")
+    return res
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tokenise des MusicXML en streaming et remplit le cache d'ids.")
+    parser.add_argument("sources", nargs="+", help="fichiers, dossiers ou archives .zip")
+    parser.add_argument("--vocab", required=True)
+    parser.add_argument("--cache", required=True)
+    parser.add_argument("--block-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--midi", action="store_true", help="note_<midi> au lieu des noms de notes")
+    args = parser.parse_args()
+    ds = StreamingMusicXMLDataset(args.sources, args.vocab, block_size=args.block_size, cache_dir=args.cache,
+                                  note_name=not args.midi)
+    warm_cache(ds, num_workers=args.workers)
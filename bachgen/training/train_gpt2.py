@@ -1,12 +1,28 @@
 # bachgen/training/train_gpt2.py
 from __future__ import annotations
-from typing import Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 from pathlib import Path
+import inspect
 import math
+import os
 import torch
-from transformers import GPT2Config, GPT2LMHeadModel, TrainingArguments, Trainer
+from transformers import GPT2Config, GPT2LMHeadModel, TrainingArguments, Trainer, TrainerCallback
+from transformers.integrations import get_reporting_integration_callbacks
 
-from bachgen.training.datasets import PostTokenizedDataset, SimpleDataCollator
+from bachgen.training.augment import TransposeAugmentDataset
+from bachgen.training.bar_index import BarAlignedDataset
+from bachgen.training.cpu_profile import apply_cpu_profile, pin_loader_workers
+from bachgen.training.evaluation import SlidingWindowEvalCallback, SlidingWindowEvaluator
+from bachgen.training.profiling import ThroughputCallback
+from bachgen.training.datasets import (
+    MemmapTokenDataset, PackedDocumentDataset, PostTokenizedDataset, RandomWindowDataset,
+    SimpleDataCollator, install_block_diagonal_mask,
+)
+from bachgen.vocab_utils import is_packed_corpus
+
+# Au-delà de LONG_CONTEXT tokens par bloc : attention SDPA, pas de cache KV et gradient
+# checkpointing par défaut (cf. long_context.py pour les mesures mémoire / débit).
+LONG_CONTEXT = 1024
 
 def build_gpt2_config(
     vocab_size: int,
@@ -17,7 +33,17 @@ def build_gpt2_config(
     n_embd: int = 1024,
     n_layer: int = 4,
     n_head: int = 4,
+    attn_implementation: Optional[str] = None,
+    use_cache: Optional[bool] = None,
 ) -> GPT2Config:
+    """
+    n_positions > LONG_CONTEXT (contextes de 2k à 8k) : attn_implementation="sdpa" et use_cache=False
+    sauf valeur explicite.
+    """
+    long_context = n_positions > LONG_CONTEXT
+    if attn_implementation is None and long_context:
+        attn_implementation = "sdpa"
+    kwargs = {} if attn_implementation is None else {"attn_implementation": attn_implementation}
     return GPT2Config(
         vocab_size=vocab_size,
         n_positions=n_positions,
@@ -28,14 +54,90 @@ def build_gpt2_config(
         pad_token_id=pad_id,
         bos_token_id=bos_id,
         eos_token_id=eos_id,
+        use_cache=not long_context if use_cache is None else use_cache,
+        **kwargs,
     )
 
-def make_datasets(train_seqs, valid_seqs, test_seqs, block_size=1024):
-    train_ds = PostTokenizedDataset(train_seqs, block_size=block_size)
-    valid_ds = PostTokenizedDataset(valid_seqs, block_size=block_size)
-    test_ds  = PostTokenizedDataset(test_seqs,  block_size=block_size)
+def make_dataset(seqs, block_size=1024, packing=False, pad_id=0, bar_id=None):
+    """
+    Liste de séquences -> PostTokenizedDataset ; dossier de corpus packé -> MemmapTokenDataset.
+    packing=True -> PackedDocumentDataset (morceaux entiers, positions et attention par morceau).
+    """
+    if packing:
+        return PackedDocumentDataset(seqs, block_size=block_size, pad_id=pad_id, bar_id=bar_id)
+    if isinstance(seqs, (str, Path)) and is_packed_corpus(Path(seqs)):
+        return MemmapTokenDataset(Path(seqs), block_size=block_size)
+    return PostTokenizedDataset(seqs, block_size=block_size)
+
+def make_datasets(train_seqs, valid_seqs, test_seqs, block_size=1024, packing=False, pad_id=0, bar_id=None,
+                  random_windows=False, samples_per_epoch=None, seed=0, transpose_tables=None, bar_aligned_vocab=None):
+    """
+    Chaque split peut être une liste de séquences ou le dossier d'un split packé
+    (cf. splits.save_split_packed) : dans ce cas il est lu en memmap.
+    random_windows=True : le train tire ses fenêtres au hasard à chaque époque
+    (RandomWindowDataset) ; valid/test gardent des blocs fixes pour rester comparables.
+    Incompatible avec packing (blocs de morceaux entiers) et bar_aligned_vocab.
+    transpose_tables (augment.TranspositionTables) : transpositions aléatoires du train.
+    bar_aligned_vocab (Vocab) : blocs alignés sur les mesures avec en-tête clef/key/time
+    (bar_index.BarAlignedDataset), pour les trois splits : un seul collator sert au train et à l'éval.
+    Incompatible avec packing.
+    """
+    if sum((packing, random_windows, bar_aligned_vocab is not None)) > 1:
+        raise ValueError("packing, random_windows et bar_aligned_vocab sont incompatibles deux à deux "
+                         "(trois façons de couper les blocs du train).")
+    kw = dict(block_size=block_size, packing=packing, pad_id=pad_id, bar_id=bar_id)
+    if bar_aligned_vocab is not None:
+        train_ds = BarAlignedDataset(train_seqs, bar_aligned_vocab, block_size=block_size)
+    elif random_windows:
+        train_ds = RandomWindowDataset(train_seqs, block_size=block_size, samples_per_epoch=samples_per_epoch, seed=seed)
+    else:
+        train_ds = make_dataset(train_seqs, **kw)
+    if transpose_tables is not None:
+        train_ds = TransposeAugmentDataset(train_ds, transpose_tables, seed=seed)
+    if bar_aligned_vocab is not None:
+        valid_ds = BarAlignedDataset(valid_seqs, bar_aligned_vocab, block_size=block_size)
+        test_ds  = BarAlignedDataset(test_seqs,  bar_aligned_vocab, block_size=block_size)
+    else:
+        valid_ds = make_dataset(valid_seqs, **kw)
+        test_ds  = make_dataset(test_seqs,  **kw)
     return train_ds, valid_ds, test_ds
 
+def dataset_collator(ds):
+    """Collator choisi par le dataset (attribut collator, ex. PackedDocumentDataset) ; sinon blocs simples."""
+    return getattr(ds, "collator", None) or SimpleDataCollator()
+
+class SetEpochCallback(TrainerCallback):
+    """
+    Transmet l'époque courante aux datasets qui ont un set_epoch (ex. RandomWindowDataset) :
+    le Trainer ne le fait que pour les IterableDataset.
+    """
+    def __init__(self, *datasets) -> None:
+        self.datasets = [ds for ds in datasets if hasattr(ds, "set_epoch")]
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        for ds in self.datasets:
+            ds.set_epoch(int(state.epoch or 0))
+
+class LoaderPinningCallback(TrainerCallback):
+    """
+    Place les workers du DataLoader d'entraînement sur les cœurs de chargement du profil CPU
+    (cpu_profile.pin_loader_workers) : on_train_begin passe avant le lancement des workers.
+    """
+    def __init__(self, cpus) -> None:
+        self.cpus = list(cpus)
+
+    def on_train_begin(self, args, state, control, train_dataloader=None, **kwargs):
+        if train_dataloader is not None:
+            pin_loader_workers(train_dataloader, self.cpus)
+
+def auto_num_workers() -> int:
+    """min(4, cœurs par processus - 1) : les cœurs sont partagés entre les rangs DDP locaux (LOCAL_WORLD_SIZE)."""
+    local_world = int(os.environ.get("LOCAL_WORLD_SIZE", "1"))
+    return min(4, max(0, (os.cpu_count() or 1) // local_world - 1))
+
+# retirés de TrainingArguments dans transformers 5 : passés seulement si la version installée les connaît
+LEGACY_TRAINING_ARGS = ("overwrite_output_dir", "logging_dir")
+
 def default_training_args(
     out_dir: Path,
     num_epochs: int = 8,
@@ -44,8 +146,46 @@ def default_training_args(
     lr: float = 3e-4,
     warmup_steps: int = 200,
     fp16: Optional[bool] = None,
+    num_workers: Optional[int | str] = None,
+    prefetch_factor: int = 4,
+    persistent_workers: bool = True,
+    pin_memory: Optional[bool] = None,
+    cpu_profile: Optional[Dict] = None,
+    gradient_checkpointing: Optional[bool] = None,
+    block_size: Optional[int] = None,
+    **kwargs,
 ) -> TrainingArguments:
-    return TrainingArguments(
+    """
+    DataLoader : num_workers=None -> 0 (chargement dans le processus principal, comme avant) ;
+    num_workers="auto" -> auto_num_workers() processus de chargement par rang. Les workers sont
+    gardés d'une époque à l'autre (persistent_workers) avec prefetch_factor batches d'avance
+    chacun ; pin_memory par défaut si CUDA est disponible.
+
+    cpu_profile (cf. cpu_profile.cpu_profile()) : entraînement sur CPU, bf16 si supporté,
+    torch.compile en option et nombre de workers du profil. Sans effet sur le processus :
+    threads et affinités sont appliqués par train_gpt2(cpu_profile=...).
+
+    gradient_checkpointing : recalcule les activations au backward ; None -> activé si
+    block_size > LONG_CONTEXT (contextes longs, cf. long_context.py).
+
+    kwargs : autres champs de TrainingArguments (ex. ddp_backend, use_cpu, max_steps). Ils doivent
+    être donnés ici : l'environnement distribué (WORLD_SIZE, backend) est lu à la construction,
+    le modifier ensuite sur l'objet ne lance pas DDP.
+    """
+    extra = {}
+    if cpu_profile is not None:
+        fp16 = False
+        pin_memory = False
+        if num_workers is None:
+            num_workers = cpu_profile["num_workers"]
+        extra = dict(use_cpu=True, bf16=cpu_profile["bf16"], torch_compile=cpu_profile["torch_compile"])
+    if gradient_checkpointing is None:
+        gradient_checkpointing = block_size is not None and block_size > LONG_CONTEXT
+    if num_workers is None:
+        num_workers = 0
+    elif num_workers == "auto":
+        num_workers = auto_num_workers()
+    fields = dict(
         output_dir=str(out_dir),
         overwrite_output_dir=True,
         num_train_epochs=num_epochs,
@@ -61,25 +201,83 @@ def default_training_args(
         logging_dir="./logs",
         logging_steps=50,
         fp16=torch.cuda.is_available() if fp16 is None else fp16,
-        dataloader_num_workers=0,
+        gradient_checkpointing=gradient_checkpointing,
+        dataloader_num_workers=num_workers,
+        dataloader_persistent_workers=persistent_workers and num_workers > 0,
+        dataloader_prefetch_factor=prefetch_factor if num_workers > 0 else None,
+        dataloader_pin_memory=torch.cuda.is_available() if pin_memory is None else pin_memory,
         push_to_hub=False,
         report_to="none",
     )
+    fields.update(extra)
+    fields.update(kwargs)
+    supported = inspect.signature(TrainingArguments.__init__).parameters
+    for name in LEGACY_TRAINING_ARGS:
+        if name not in supported:
+            fields.pop(name)
+    return TrainingArguments(**fields)
 
 def train_gpt2(
     train_ds,
     valid_ds,
     config: GPT2Config,
     training_args: TrainingArguments,
+    profile_path: Optional[Path] = None,
+    trace_steps: Optional[Tuple[int, int]] = None,
+    cpu_profile: Optional[Dict] = None,
+    callbacks: Optional[List[TrainerCallback]] = None,
+    sliding_eval: Optional[SlidingWindowEvaluator] = None,
 ):
+    """
+    profile_path : série temporelle par step (JSONL ou CSV) de ThroughputCallback
+    (tokens/s, attente données / forward / backward / optimizer, mémoire max) ;
+    trace_steps=(a, b) ajoute une trace torch.profiler des steps a..b-1.
+    cpu_profile (le même que pour default_training_args) : attention du profil (SDPA par défaut),
+    threads de calcul et processus principal sur les cœurs de calcul (apply_cpu_profile),
+    workers du DataLoader sur les cœurs de chargement.
+    callbacks : TrainerCallback supplémentaires ; sliding_eval : évaluation glissante rapide à chaque
+    époque (SlidingWindowEvalCallback), métriques sw_eval_* dans les logs du Trainer.
+    """
+    if cpu_profile is not None:
+        apply_cpu_profile(cpu_profile)
     model = GPT2LMHeadModel(config)
+    if cpu_profile is not None:
+        model.set_attn_implementation(cpu_profile["attn_implementation"])
+    if training_args.gradient_checkpointing:
+        model.config.use_cache = False  # cache KV incompatible avec le recalcul des activations
+    # le Trainer n'a qu'un collator pour le train et l'éval : les deux datasets doivent demander le même
+    collator = dataset_collator(train_ds)
+    if valid_ds is not None:
+        eval_collator = dataset_collator(valid_ds)
+        if (type(eval_collator), vars(eval_collator)) != (type(collator), vars(collator)):
+            raise ValueError(f"train et valid demandent des collators différents ({type(collator).__name__} "
+                             f"{vars(collator)} / {type(eval_collator).__name__} {vars(eval_collator)}) : "
+                             "construire les splits dans le même mode (cf. make_datasets).")
+    if getattr(collator, "block_diagonal", False):
+        install_block_diagonal_mask(model)
+    # SlidingWindowEvalCallback en tête : sw_eval_* sont ajoutées aux logs dans son on_log
+    extra_callbacks = callbacks or []
+    callbacks = [SlidingWindowEvalCallback(sliding_eval)] if sliding_eval is not None else []
+    callbacks += [SetEpochCallback(train_ds), *extra_callbacks]
+    if profile_path is not None or trace_steps is not None:
+        callbacks.append(ThroughputCallback(profile_path, trace_steps=trace_steps))
+    if cpu_profile is not None:
+        callbacks.append(LoaderPinningCallback(cpu_profile["loader_cpus"]))
     trainer = Trainer(
         model=model,
         args=training_args,
         train_dataset=train_ds,
         eval_dataset=valid_ds,
-        data_collator=SimpleDataCollator(),
+        data_collator=collator,
+        callbacks=callbacks,
     )
+    if sliding_eval is not None:
+        # le Trainer place les intégrations de report_to avant nos callbacks : on les remet après,
+        # pour qu'elles reçoivent les logs complétés par SlidingWindowEvalCallback
+        for cls in get_reporting_integration_callbacks(training_args.report_to):
+            reporter = trainer.pop_callback(cls)
+            if reporter is not None:
+                trainer.add_callback(reporter)
     trainer.train()
     return trainer, model
 
@@ -92,6 +290,16 @@ def evaluate(trainer: Trainer, ds) -> Tuple[float, float]:
     ppl  = math.exp(loss) if loss < 20 else float("inf")
     return loss, ppl
 
+def evaluate_sliding(model, seqs, block_size=1024, stride=None, batch_size=16, max_windows=None) -> Tuple[float, float]:
+    """
+    Comme evaluate, mais en fenêtres glissantes (chaque token a jusqu'à block_size - stride
+    tokens de contexte). seqs : liste de séquences, dossier packé ou SlidingWindowEvaluator déjà construit.
+    """
+    evaluator = seqs if isinstance(seqs, SlidingWindowEvaluator) else SlidingWindowEvaluator(
+        seqs, block_size=block_size, stride=stride, batch_size=batch_size, pad_id=model.config.pad_token_id or 0)
+    res = evaluator.evaluate(model, max_windows=max_windows)
+    return res["loss"], res["ppl"]
+
 def save_model(trainer: Trainer, out_dir: Path):
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
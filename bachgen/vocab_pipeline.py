@@ -1,7 +1,11 @@
 # bachgen/vocab_pipeline.py
+from __future__ import annotations
 from pathlib import Path
-from typing import Iterable, Tuple, Dict
-from bachgen.vocab_utils import build_vocab, save_vocab, encode_dir_to_ids
+from typing import Iterable, Optional, Tuple, Dict
+from bachgen.vocab_utils import (
+    encode_dir_incremental, extend_vocab, load_manifest, load_vocab, save_file_counts, save_vocab,
+    scan_token_files, vocab_from_counts,
+)
 
 def build_and_encode(
     token_dir: Path,
@@ -12,15 +16,53 @@ def build_and_encode(
     pattern: str = "*.txt",
     add_bos: bool = True,
     add_eos: bool = True,
+    workers: Optional[int] = None,
+    frozen_vocab: Optional[Path | Dict[str, int]] = None,
+    file_counts_csv: Optional[Path] = None,
+    incremental: bool = False,
 ) -> Tuple[Dict[str, int], int]:
     """
-    1) Construit le vocab depuis token_dir
+    1) Construit le vocab depuis token_dir (comptage parallèle sur `workers` processus)
     2) Sauvegarde le vocab dans vocab_out
     3) Encode tout token_dir -> ids_out_dir
+    Avec frozen_vocab (chemin ou dict), le vocab n'est pas reconstruit : comptage et encodage
+    se font dans la même lecture du corpus.
+    Avec incremental=True et un vocab_out existant, le vocab est étendu (append-only) avec les
+    tokens des seuls fichiers nouveaux ou modifiés, puis seuls ces fichiers sont ré-encodés
+    (cf. vocab_utils.encode_dir_incremental).
+    file_counts_csv : écrit les comptes par fichier (tokens, [UNK]).
     Retourne (token2id, vocab_size).
     """
     token_files = sorted(token_dir.glob(pattern))
-    token2id, _ = build_vocab(token_files, specials=list(specials), min_freq=min_freq)
+    if incremental and frozen_vocab is None and Path(vocab_out).exists():
+        token2id, _ = load_vocab(Path(vocab_out))
+        known = load_manifest(ids_out_dir)["files"]
+        changed = [f for f in token_files if f.name not in known or f.stat().st_size != known[f.name]["size"]
+                   or f.stat().st_mtime_ns != known[f.name]["mtime_ns"]]
+        counts, _ = scan_token_files(changed, workers=workers)
+        token2id, added = extend_vocab(token2id, counts, min_freq=min_freq)
+        if added:
+            print(f"➕ {len(added)} nouveaux tokens ajoutés au vocab")
+        save_vocab(vocab_out, token2id)
+        encode_dir_incremental(token_dir, ids_out_dir, token2id, add_bos=add_bos, add_eos=add_eos,
+                               pattern=pattern, workers=workers)
+        if file_counts_csv is not None:
+            save_file_counts(file_counts_csv, load_manifest(ids_out_dir)["files"])
+        return token2id, len(token2id)
+
+    if frozen_vocab is not None:
+        token2id = load_vocab(Path(frozen_vocab))[0] if isinstance(frozen_vocab, (str, Path)) else dict(frozen_vocab)
+    else:
+        counts, _ = scan_token_files(token_files, workers=workers)
+        token2id, _ = vocab_from_counts(counts, specials=list(specials), min_freq=min_freq)
+    if incremental:
+        encode_dir_incremental(token_dir, ids_out_dir, token2id, add_bos=add_bos, add_eos=add_eos,
+                               pattern=pattern, workers=workers)
+        per_file = load_manifest(ids_out_dir)["files"]
+    else:
+        _, per_file = scan_token_files(token_files, workers=workers, token2id=token2id, ids_dir=ids_out_dir,
+                                       add_bos=add_bos, add_eos=add_eos)
     save_vocab(vocab_out, token2id)
-    encode_dir_to_ids(token_dir, ids_out_dir, token2id, add_bos=add_bos, add_eos=add_eos, pattern=pattern)
+    if file_counts_csv is not None:
+        save_file_counts(file_counts_csv, per_file)
     return token2id, len(token2id)
@@ -1,9 +1,33 @@
 # bachgen/vocab_utils.py
 from __future__ import annotations
-from typing import Dict, Iterable, List, Tuple, Set
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Set
+from itertools import repeat
 from pathlib import Path
+import csv
+import hashlib
 import json
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import os
+import weakref
+
+import numpy as np
+
+# extensions des fichiers du pipeline, les composées d'abord (a.b.ids.txt -> a.b)
+PIPELINE_SUFFIXES = (".ids.txt", ".musicxml", ".mxl", ".xml", ".txt", ".png", ".npy")
+
+
+def file_stem(path) -> str:
+    """
+    Stem d'un fichier du pipeline : nom sans son extension connue (.ids.txt, .musicxml, .txt...).
+    Contrairement à name.split(".")[0], "a.b.musicxml" et "a.c.musicxml" restent distincts.
+    """
+    name = Path(str(path)).name
+    lower = name.lower()
+    for suffix in PIPELINE_SUFFIXES:
+        if lower.endswith(suffix) and len(name) > len(suffix):
+            return name[:-len(suffix)]
+    return Path(name).stem
 
 # -------------------------
 # Lecture des fichiers tokens
@@ -31,16 +55,27 @@ def build_vocab(
     token_files: Iterable[Path],
     specials: List[str] = ("[PAD]", "[UNK]", "<BOS>", "<EOS>"),
     min_freq: int = 1,
+    workers: Optional[int] = None,
 ) -> Tuple[Dict[str, int], Dict[int, str]]:
     """
     Construit un vocab {token->id} et {id->token}.
     - specials apparaissent en tête, dans l'ordre donné.
     - min_freq filtre les tokens trop rares (redirigés vers [UNK] à l'encodage).
+    - workers : comptage map-reduce, cf. scan_token_files (None = tous les cœurs, 1 = sur place),
+      même défaut que vocab_pipeline.build_and_encode.
     """
-    counts = Counter()
-    for toks in iter_token_lines(token_files):
-        counts.update(toks)
+    counts, _ = scan_token_files(token_files, workers=workers)
+    return vocab_from_counts(counts, specials=specials, min_freq=min_freq)
+
 
+def vocab_from_counts(
+    counts: Counter,
+    specials: List[str] = ("[PAD]", "[UNK]", "<BOS>", "<EOS>"),
+    min_freq: int = 1,
+) -> Tuple[Dict[str, int], Dict[int, str]]:
+    """
+    Attribue les ids à partir de comptes déjà agrégés (mêmes règles que build_vocab).
+    """
     # Assure la présence d’[UNK]
     specials = list(specials)
     if "[UNK]" not in specials:
@@ -83,6 +118,196 @@ def load_vocab(path: Path) -> Tuple[Dict[str, int], Dict[int, str]]:
     return token2id, id2token
 
 
+# -------------------------
+# Empreinte et extension append-only
+# -------------------------
+
+def vocab_fingerprint(token2id: Dict[str, int], size: Optional[int] = None) -> str:
+    """
+    Empreinte du contenu d'un vocab (paires id/token triées par id), indépendante de l'ordre du JSON.
+    size : empreinte des `size` premiers ids seulement (préfixe d'un vocab étendu).
+    """
+    pairs = sorted((i, t) for t, i in token2id.items() if size is None or i < size)
+    h = hashlib.sha256(json.dumps(pairs, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def extend_vocab(
+    token2id: Dict[str, int],
+    counts: Counter | Iterable[Path],
+    min_freq: int = 1,
+) -> Tuple[Dict[str, int], List[str]]:
+    """
+    Extension append-only : les nouveaux tokens (fréquence >= min_freq) reçoivent de nouveaux ids
+    à la suite des existants, triés comme dans build_vocab. Les ids existants ne bougent pas :
+    les fichiers déjà encodés restent valides et l'embedding du modèle peut simplement être
+    agrandi (model.resize_token_embeddings) au lieu d'être réappris.
+
+    Args:
+        counts: Counter déjà calculé ou liste de fichiers de tokens à compter
+
+    Returns:
+        (nouveau token2id, tokens ajoutés)
+    """
+    if not isinstance(counts, Counter):
+        counts = Counter(t for toks in iter_token_lines(counts) for t in toks)
+    items = [(tok, freq) for tok, freq in counts.items() if freq >= min_freq and tok not in token2id]
+    items.sort(key=lambda x: (-x[1], x[0]))
+
+    extended = dict(token2id)
+    next_id = max(token2id.values()) + 1 if token2id else 0
+    for tok, _ in items:
+        extended[tok] = next_id
+        next_id += 1
+    return extended, [tok for tok, _ in items]
+
+
+# -------------------------
+# Vocab vectorisé (chargé une fois, encodage / décodage par tableaux)
+# -------------------------
+
+# noms reconnus pour les tokens spéciaux (cf. training.splits.load_vocab_ids)
+SPECIAL_NAMES = {
+    "pad": ("<PAD>", "[PAD]", "PAD"),
+    "unk": ("[UNK]",),
+    "bos": ("<BOS>", "<bos>", "BOS"),
+    "eos": ("<EOS>", "<eos>", "EOS"),
+}
+
+_VOCAB_CACHE: Dict[Tuple[str, int], "Vocab"] = {}
+
+
+def packed_dtype(vocab_size: int) -> np.dtype:
+    return np.dtype(np.uint16) if vocab_size <= np.iinfo(np.uint16).max + 1 else np.dtype(np.uint32)
+
+
+class Vocab:
+    """
+    Vocabulaire figé :
+    - token -> id : table de hachage (dict) appliquée en C via map() sur des séquences entières
+    - id -> token : tableau NumPy (objets str) indexé par des tableaux d'ids
+    - special_mask : tableau bool (vocab_size,) des ids spéciaux ([PAD], [UNK], <BOS>, <EOS>)
+    Vocab.load met en cache par fichier : recharger un vocab.json inchangé ne coûte rien.
+    """
+    def __init__(self, token2id: Dict[str, int]) -> None:
+        self.token2id: Dict[str, int] = dict(token2id)
+        size = max(self.token2id.values()) + 1 if self.token2id else 0
+        self.id2token = np.full(size, "[UNK]", dtype=object)
+        for tok, idx in self.token2id.items():
+            self.id2token[idx] = tok
+        self.dtype = packed_dtype(size)
+
+        def _get_id(names):
+            return next((self.token2id[n] for n in names if n in self.token2id), None)
+
+        self.pad_id = _get_id(SPECIAL_NAMES["pad"])
+        self.unk_id = _get_id(SPECIAL_NAMES["unk"])
+        self.bos_id = _get_id(SPECIAL_NAMES["bos"])
+        self.eos_id = _get_id(SPECIAL_NAMES["eos"])
+        self.special_mask = np.zeros(size, dtype=bool)
+        for idx in (self.pad_id, self.unk_id, self.bos_id, self.eos_id):
+            if idx is not None:
+                self.special_mask[idx] = True
+        self.fingerprint = vocab_fingerprint(self.token2id)
+
+    def extends(self, fingerprint: str, size: int) -> bool:
+        """True si ce vocab est (une extension append-only de) celui d'empreinte `fingerprint`."""
+        if size > len(self):
+            return False
+        return fingerprint == (self.fingerprint if size == len(self) else vocab_fingerprint(self.token2id, size))
+
+    @classmethod
+    def load(cls, path: Path | str) -> "Vocab":
+        path = Path(path).resolve()
+        key = (str(path), path.stat().st_mtime_ns)
+        vocab = _VOCAB_CACHE.get(key)
+        if vocab is None:
+            token2id, _ = load_vocab(path)
+            vocab = _VOCAB_CACHE[key] = cls(token2id)
+        return vocab
+
+    def __len__(self) -> int:
+        return len(self.id2token)
+
+    # --- encodage ---
+
+    def encode(self, tokens: str | Iterable[str], add_bos: bool = False, add_eos: bool = False) -> np.ndarray:
+        """
+        Tokens (liste ou chaîne séparée par des espaces) -> tableau d'ids (uint16 si possible).
+        Les inconnus vont sur [UNK].
+        """
+        if self.unk_id is None:
+            raise ValueError("Le vocab ne contient pas [UNK].")
+        tokens = tokens.split() if isinstance(tokens, str) else list(tokens)
+        ids = np.fromiter(map(self.token2id.get, tokens, repeat(self.unk_id)), dtype=self.dtype, count=len(tokens))
+        head = [self.bos_id] if add_bos and self.bos_id is not None else []
+        tail = [self.eos_id] if add_eos and self.eos_id is not None else []
+        if head or tail:
+            ids = np.concatenate([np.array(head, dtype=self.dtype), ids, np.array(tail, dtype=self.dtype)])
+        return ids
+
+    def encode_batch(
+        self,
+        sequences: Iterable[str | List[str]],
+        add_bos: bool = False,
+        add_eos: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Encode un corpus entier en un seul tableau plat.
+        Renvoie (ids concaténés, offsets int64 (n + 1,)) : la séquence i est ids[offsets[i]:offsets[i+1]].
+        """
+        chunks = [self.encode(seq, add_bos=add_bos, add_eos=add_eos) for seq in sequences]
+        offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+        np.cumsum([c.size for c in chunks], out=offsets[1:])
+        flat = np.concatenate(chunks) if chunks else np.empty(0, dtype=self.dtype)
+        return flat, offsets
+
+    # --- décodage ---
+
+    def _as_array(self, ids) -> np.ndarray:
+        if hasattr(ids, "detach"):  # tenseur torch
+            ids = ids.detach().cpu().numpy()
+        ids = np.asarray(ids, dtype=np.int64)
+        # ids hors vocab -> [UNK] (comme id2token.get(i, "[UNK]"))
+        return np.where((ids >= 0) & (ids < len(self)), ids, self.unk_id if self.unk_id is not None else 0)
+
+    def is_special(self, ids) -> np.ndarray:
+        """Masque bool des ids spéciaux, de même forme que ids."""
+        return self.special_mask[self._as_array(ids)]
+
+    def _drop_mask(self, arr: np.ndarray, drop_specials: bool | Set[str]) -> Optional[np.ndarray]:
+        if drop_specials is True:
+            return self.special_mask[arr]
+        if drop_specials:
+            return np.isin(arr, [self.token2id[t] for t in drop_specials if t in self.token2id])
+        return None
+
+    def decode(self, ids, drop_specials: bool | Set[str] = False) -> List[str]:
+        """
+        Ids (liste, tableau NumPy 1D, tenseur) -> liste de tokens.
+        drop_specials=True retire [PAD]/[UNK]/<BOS>/<EOS> ; un ensemble retire ces tokens-là.
+        """
+        arr = self._as_array(ids).ravel()
+        drop = self._drop_mask(arr, drop_specials)
+        if drop is not None:
+            arr = arr[~drop]
+        return self.id2token[arr].tolist()
+
+    def decode_batch(self, flat, offsets: np.ndarray, drop_specials: bool | Set[str] = False) -> List[List[str]]:
+        """Inverse de encode_batch : (ids concaténés, offsets) -> une liste de tokens par séquence."""
+        arr = self._as_array(flat).ravel()
+        drop = self._drop_mask(arr, drop_specials)
+        if drop is not None:  # on recale les offsets sur les tokens conservés
+            kept = np.concatenate([[0], np.cumsum(~drop)])
+            offsets, arr = kept[offsets], arr[~drop]
+        tokens = self.id2token[arr].tolist()
+        return [tokens[a:b] for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def as_vocab(vocab: "Vocab" | Dict[str, int]) -> "Vocab":
+    return vocab if isinstance(vocab, Vocab) else Vocab(vocab)
+
+
 # -------------------------
 # Encodage / décodage en mémoire
 # -------------------------
@@ -103,9 +328,7 @@ def encode_tokens(
     if add_bos and "<BOS>" in token2id:
         ids.append(token2id["<BOS>"])
 
-    unk_id = token2id["[UNK]"]
-    for t in tokens:
-        ids.append(token2id.get(t, unk_id))
+    ids += map(token2id.get, tokens, repeat(token2id["[UNK]"]))
 
     if add_eos and "<EOS>" in token2id:
         ids.append(token2id["<EOS>"])
@@ -122,14 +345,10 @@ def decode_ids(
     Convertit liste d'ids -> liste de tokens.
     drop_specials pour omettre ex: {"[PAD]", "<BOS>", "<EOS>"}.
     """
-    out: List[str] = []
-    drop_specials = drop_specials or set()
-    for i in ids:
-        tok = id2token.get(int(i), "[UNK]")
-        if tok in drop_specials:
-            continue
-        out.append(tok)
-    return out
+    out = map(id2token.get, map(int, ids), repeat("[UNK]"))
+    if drop_specials:
+        return [tok for tok in out if tok not in drop_specials]
+    return list(out)
 
 
 # -------------------------
@@ -139,13 +358,14 @@ def decode_ids(
 def encode_file_to_ids(
     in_path: Path,
     out_path: Path,
-    token2id: Dict[str, int],
+    token2id: Dict[str, int] | Vocab,
     add_bos: bool = False,
     add_eos: bool = False,
 ) -> None:
     """
     Lit un .txt (tokens espace), écrit un .ids.txt (ids espace), 1 ligne => 1 ligne.
     """
+    vocab = as_vocab(token2id)
     out_path.parent.mkdir(parents=True, exist_ok=True)
     with open(in_path, "r", encoding="utf-8") as fin, open(out_path, "w", encoding="utf-8") as fout:
         for line in fin:
@@ -153,14 +373,14 @@ def encode_file_to_ids(
             if not toks:
                 fout.write("\n")
                 continue
-            ids = encode_tokens(toks, token2id, add_bos=add_bos, add_eos=add_eos)
-            fout.write(" ".join(str(i) for i in ids) + "\n")
+            ids = vocab.encode(toks, add_bos=add_bos, add_eos=add_eos)
+            fout.write(" ".join(map(str, ids.tolist())) + "\n")
 
 
 def encode_dir_to_ids(
     token_dir: Path,
     ids_dir: Path,
-    token2id: Dict[str, int],
+    token2id: Dict[str, int] | Vocab,
     add_bos: bool = True,
     add_eos: bool = True,
     pattern: str = "*.txt",
@@ -168,10 +388,11 @@ def encode_dir_to_ids(
     """
     Encode tous les fichiers 'pattern' de token_dir -> ids_dir avec même stem et suffixe .ids.txt
     """
+    vocab = as_vocab(token2id)
     ids_dir.mkdir(parents=True, exist_ok=True)
     for tf in sorted(token_dir.glob(pattern)):
         out = ids_dir / (tf.stem + ".ids.txt")
-        encode_file_to_ids(tf, out, token2id, add_bos=add_bos, add_eos=add_eos)
+        encode_file_to_ids(tf, out, vocab, add_bos=add_bos, add_eos=add_eos)
 
 
 def decode_ids_file(
@@ -180,10 +401,381 @@ def decode_ids_file(
     join_tokens: bool = True,
 ) -> str | List[str]:
     """
-    Décoder rapidement un fichier .ids.txt via un vocab sauvegardé.
+    Décoder rapidement un fichier .ids.txt via un vocab sauvegardé (chargé une seule fois).
     """
-    token2id, id2token = load_vocab(vocab_path)
+    vocab = Vocab.load(vocab_path)
     with open(ids_path, "r", encoding="utf-8") as f:
-        ids = [int(x) for x in f.read().strip().split() if x.strip()]
-    toks = decode_ids(ids, id2token)
+        ids = np.array(f.read().split(), dtype=np.int64)
+    toks = vocab.decode(ids)
     return " ".join(toks) if join_tokens else toks
+
+
+# -------------------------
+# Comptage parallèle (map-reduce) et encodage dans la même passe
+# -------------------------
+
+_WORKER_VOCAB: Optional[Vocab] = None
+
+
+def _init_scan_worker(token2id: Optional[Dict[str, int]]) -> None:
+    # le vocab figé est envoyé une fois par processus, pas une fois par fichier
+    global _WORKER_VOCAB
+    _WORKER_VOCAB = Vocab(token2id) if token2id is not None else None
+
+
+def _scan_file(job) -> Tuple[str, Counter, int]:
+    """
+    Lit un fichier de tokens une seule fois : compte ses tokens et, si un vocab figé
+    est chargé dans le processus, écrit son .ids.txt (même format que encode_file_to_ids).
+    Renvoie (chemin, comptes, nb d'ids [UNK] produits).
+    """
+    path, out_path, add_bos, add_eos = job
+    counts: Counter = Counter()
+    n_unk = 0
+    lines: List[str] = []
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            toks = line.strip().split()
+            if not toks:
+                lines.append("")
+                continue
+            counts.update(toks)
+            if _WORKER_VOCAB is not None:
+                ids = _WORKER_VOCAB.encode(toks, add_bos=add_bos, add_eos=add_eos)
+                n_unk += int(np.count_nonzero(ids == _WORKER_VOCAB.unk_id))
+                lines.append(" ".join(map(str, ids.tolist())))
+    if out_path is not None:
+        with open(out_path, "w", encoding="utf-8") as fout:
+            fout.writelines(l + "\n" for l in lines)
+    return str(path), counts, n_unk
+
+
+def scan_token_files(
+    token_files: Iterable[Path],
+    workers: Optional[int] = None,
+    token2id: Optional[Dict[str, int] | Vocab] = None,
+    ids_dir: Optional[Path] = None,
+    add_bos: bool = True,
+    add_eos: bool = True,
+    chunksize: int = 16,
+) -> Tuple[Counter, Dict[str, Dict[str, int]]]:
+    """
+    Compte les tokens d'un corpus sur un pool de processus (un Counter par fichier, fusionnés à la fin).
+    Si token2id (vocab figé) et ids_dir sont donnés, chaque fichier est encodé dans la même lecture
+    vers ids_dir/<stem>.ids.txt.
+
+    Args:
+        workers: nombre de processus (None = os.cpu_count(), 1 = dans le processus courant),
+            jamais plus que de fichiers
+        chunksize: nombre de fichiers envoyés d'un coup à un processus
+
+    Returns:
+        (comptes globaux, {nom de fichier: {"tokens": n, "unk": n_unk}})
+    """
+    files = [Path(f) for f in token_files]
+    if ids_dir is not None:
+        if token2id is None:
+            raise ValueError("ids_dir demande un vocab figé (token2id).")
+        ids_dir = Path(ids_dir)
+        ids_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [(f, ids_dir / (f.stem + ".ids.txt") if ids_dir is not None else None, add_bos, add_eos) for f in files]
+    frozen = token2id.token2id if isinstance(token2id, Vocab) else token2id
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    if workers == 1:
+        _init_scan_worker(frozen)
+        try:
+            results = [_scan_file(j) for j in jobs]
+        finally:
+            _init_scan_worker(None)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_scan_worker, initargs=(frozen,)) as ex:
+            results = list(ex.map(_scan_file, jobs, chunksize=chunksize))
+
+    counts: Counter = Counter()
+    per_file: Dict[str, Dict[str, int]] = {}
+    for path, c, n_unk in results:
+        counts.update(c)
+        per_file[Path(path).name] = {"tokens": sum(c.values()), "unk": n_unk}
+    return counts, per_file
+
+
+def save_file_counts(path: Path, per_file: Dict[str, Dict[str, int]]) -> None:
+    """Écrit les comptes par fichier de scan_token_files en CSV (file, tokens, unk)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "tokens", "unk"])
+        for name, stats in per_file.items():
+            writer.writerow([name, stats["tokens"], stats["unk"]])
+
+
+# -------------------------
+# Corpus binaire "packé" (un seul fichier d'ids + index d'offsets)
+# -------------------------
+#
+#   out_dir/
+#     tokens.bin   ids de tous les documents à la suite (uint16, uint32 si vocab > 65535)
+#     offsets.npy  int64 (n_docs + 1,) : le document i occupe tokens[offsets[i]:offsets[i+1]]
+#     docs.csv     doc_id, stem, length
+#     meta.json    dtype, n_docs, n_tokens, vocab_size
+
+PACKED_TOKENS = "tokens.bin"
+PACKED_OFFSETS = "offsets.npy"
+PACKED_DOCS = "docs.csv"
+PACKED_META = "meta.json"
+
+
+class PackedCorpusWriter:
+    """
+    Écrit un corpus packé document par document (en flux : rien n'est gardé en mémoire
+    à part les offsets). S'utilise comme gestionnaire de contexte :
+
+        with PackedCorpusWriter(out_dir, vocab_size=len(token2id)) as w:
+            w.add(ids, stem="piece_001")
+
+    tokens.bin n'est ouvert qu'au premier add ; si close() n'est jamais appelé, le fichier est
+    fermé au ramasse-miettes (le corpus reste alors incomplet : pas de meta.json).
+    """
+    def __init__(self, out_dir: Path, vocab_size: int, vocab_fingerprint: Optional[str] = None) -> None:
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.vocab_size = vocab_size
+        self.vocab_fingerprint = vocab_fingerprint
+        self.dtype = packed_dtype(vocab_size)
+        self.offsets: List[int] = [0]
+        self.stems: List[str] = []
+        self._fh = None
+        self._finalizer = None
+        self._closed = False
+
+    def _file(self):
+        if self._fh is None:
+            self._fh = open(self.out_dir / PACKED_TOKENS, "wb")
+            self._finalizer = weakref.finalize(self, self._fh.close)
+        return self._fh
+
+    def add(self, ids, stem: Optional[str] = None) -> None:
+        arr = np.asarray(ids, dtype=np.int64)
+        if arr.size and (arr.min() < 0 or arr.max() >= self.vocab_size):
+            raise ValueError(f"id hors vocab (0..{self.vocab_size - 1}) dans {stem!r}.")
+        if self._closed:
+            raise ValueError("PackedCorpusWriter déjà fermé.")
+        self._file().write(arr.astype(self.dtype).tobytes())
+        self.offsets.append(self.offsets[-1] + int(arr.size))
+        self.stems.append(stem if stem is not None else str(len(self.stems)))
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._file()  # corpus vide : tokens.bin existe quand même
+        self._finalizer()
+        offsets = np.asarray(self.offsets, dtype=np.int64)
+        np.save(self.out_dir / PACKED_OFFSETS, offsets)
+        with open(self.out_dir / PACKED_DOCS, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["doc_id", "stem", "length"])
+            for i, (stem, length) in enumerate(zip(self.stems, np.diff(offsets))):
+                writer.writerow([i, stem, int(length)])
+        meta = {
+            "dtype": self.dtype.name,
+            "n_docs": len(self.stems),
+            "n_tokens": int(offsets[-1]),
+            "vocab_size": self.vocab_size,
+            "vocab_fingerprint": self.vocab_fingerprint,
+        }
+        (self.out_dir / PACKED_META).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+    def __enter__(self) -> "PackedCorpusWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class PackedCorpus:
+    """
+    Lecture d'un corpus packé. Les ids sont mappés en mémoire (np.memmap) :
+    corpus[i] renvoie une vue sans copie du document i.
+    """
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.meta = json.loads((self.path / PACKED_META).read_text(encoding="utf-8"))
+        self.offsets: np.ndarray = np.load(self.path / PACKED_OFFSETS)
+        n_tokens = self.meta["n_tokens"]
+        if n_tokens:
+            self.tokens = np.memmap(self.path / PACKED_TOKENS, dtype=self.meta["dtype"], mode="r", shape=(n_tokens,))
+        else:  # np.memmap refuse les fichiers vides
+            self.tokens = np.empty(0, dtype=self.meta["dtype"])
+        with open(self.path / PACKED_DOCS, "r", encoding="utf-8") as f:
+            self.stems: List[str] = [row["stem"] for row in csv.DictReader(f)]
+        self._by_stem: Optional[Dict[str, int]] = None
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def n_tokens(self) -> int:
+        return int(self.offsets[-1])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def doc(self, stem: str) -> np.ndarray:
+        if self._by_stem is None:
+            self._by_stem = {s: i for i, s in enumerate(self.stems)}
+        return self[self._by_stem[stem]]
+
+    def to_lists(self) -> List[List[int]]:
+        return [self[i].tolist() for i in range(len(self))]
+
+
+def is_packed_corpus(path: Path) -> bool:
+    return (Path(path) / PACKED_META).exists()
+
+
+def encode_dir_to_packed(
+    token_dir: Path,
+    out_dir: Path,
+    token2id: Dict[str, int] | Vocab,
+    add_bos: bool = True,
+    add_eos: bool = True,
+    pattern: str = "*.txt",
+) -> PackedCorpus:
+    """
+    Équivalent packé de encode_dir_to_ids : 1 fichier de tokens => 1 document
+    (les lignes d'un même fichier, encodées comme dans encode_file_to_ids, sont concaténées).
+    """
+    vocab = as_vocab(token2id)
+    with PackedCorpusWriter(out_dir, vocab_size=len(vocab), vocab_fingerprint=vocab.fingerprint) as w:
+        for tf in sorted(Path(token_dir).glob(pattern)):
+            ids, _ = vocab.encode_batch(iter_token_lines([tf]), add_bos=add_bos, add_eos=add_eos)
+            w.add(ids, stem=file_stem(tf))
+    return PackedCorpus(out_dir)
+
+
+def pack_ids_dir(ids_dir: Path, out_dir: Path, vocab_size: int, pattern: str = "*.ids.txt") -> PackedCorpus:
+    """
+    Convertit un dossier de .ids.txt existant (1 fichier = 1 document) en corpus packé.
+    """
+    with PackedCorpusWriter(out_dir, vocab_size=vocab_size) as w:
+        for f in sorted(Path(ids_dir).glob(pattern)):
+            with open(f, "r", encoding="utf-8") as fh:
+                ids = np.array(fh.read().split(), dtype=np.int64)
+            w.add(ids, stem=file_stem(f))
+    return PackedCorpus(out_dir)
+
+
+# -------------------------
+# Encodage incrémental (manifest par dossier d'ids)
+# -------------------------
+#
+#   ids_dir/manifest.json = {"vocab_fingerprint": <vocab courant>, "vocab_size": n,
+#                            "files": {<source>: {"sha1", "size", "mtime_ns", "vocab_fingerprint",
+#                                                 "vocab_size", "tokens", "unk"}}}
+
+MANIFEST = "manifest.json"
+
+
+def load_manifest(ids_dir: Path) -> Dict:
+    path = Path(ids_dir) / MANIFEST
+    if not path.exists():
+        return {"files": {}}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_manifest(ids_dir: Path, manifest: Dict) -> None:
+    path = Path(ids_dir) / MANIFEST
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True), encoding="utf-8")
+
+
+def _file_sha1(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _is_up_to_date(entry: Optional[Dict], src: Path, ids_path: Path, vocab: Vocab) -> bool:
+    """
+    Un .ids.txt est réutilisable si sa source n'a pas changé et si le vocab courant est celui
+    qui l'a produit, ou une extension append-only de celui-ci quand le fichier n'avait aucun [UNK]
+    (sinon un token inconnu à l'époque pourrait maintenant avoir un id).
+    """
+    if entry is None or not ids_path.exists():
+        return False
+    st = src.stat()
+    if (st.st_size, st.st_mtime_ns) != (entry["size"], entry["mtime_ns"]) and _file_sha1(src) != entry["sha1"]:
+        return False
+    if entry["vocab_fingerprint"] == vocab.fingerprint:
+        return True
+    return entry["unk"] == 0 and vocab.extends(entry["vocab_fingerprint"], entry["vocab_size"])
+
+
+def encode_dir_incremental(
+    token_dir: Path,
+    ids_dir: Path,
+    token2id: Dict[str, int] | Vocab,
+    add_bos: bool = True,
+    add_eos: bool = True,
+    pattern: str = "*.txt",
+    workers: Optional[int] = None,
+    verbose: bool = True,
+) -> Dict[str, List[str]]:
+    """
+    Comme encode_dir_to_ids, mais ne ré-encode que les fichiers nouveaux, modifiés, ou encodés
+    avec un vocab incompatible. L'empreinte du vocab est stockée dans ids_dir/manifest.json pour
+    chaque fichier produit.
+
+    Returns:
+        {"encoded": [...], "skipped": [...], "removed": [...]} (noms des fichiers sources)
+    """
+    token_dir, ids_dir = Path(token_dir), Path(ids_dir)
+    vocab = as_vocab(token2id)
+    manifest = load_manifest(ids_dir)
+    if manifest.get("options") not in (None, {"add_bos": add_bos, "add_eos": add_eos}):
+        manifest["files"] = {}  # options d'encodage changées : tout est à refaire
+    entries: Dict[str, Dict] = manifest["files"]
+
+    sources = sorted(token_dir.glob(pattern))
+    todo = [src for src in sources
+            if not _is_up_to_date(entries.get(src.name), src, ids_dir / (src.stem + ".ids.txt"), vocab)]
+    todo_set = set(todo)
+    skipped = [src.name for src in sources if src not in todo_set]
+    removed = sorted(set(entries) - {src.name for src in sources})
+    for name in removed:
+        del entries[name]
+
+    if todo:
+        _, per_file = scan_token_files(todo, workers=workers, token2id=vocab, ids_dir=ids_dir,
+                                       add_bos=add_bos, add_eos=add_eos)
+        for src in todo:
+            st = src.stat()
+            entries[src.name] = {
+                "sha1": _file_sha1(src), "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                "vocab_fingerprint": vocab.fingerprint, "vocab_size": len(vocab),
+                **per_file[src.name],
+            }
+
+    manifest.update({"vocab_fingerprint": vocab.fingerprint, "vocab_size": len(vocab),
+                     "options": {"add_bos": add_bos, "add_eos": add_eos}})
+    save_manifest(ids_dir, manifest)
+    if verbose:
+        print(f"🔁 {len(todo)} fichiers encodés, ⏭️ {len(skipped)} à jour, 🗑️ {len(removed)} retirés du manifest")
+    return {"encoded": [src.name for src in todo], "skipped": skipped, "removed": removed}
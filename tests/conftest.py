@@ -1,5 +1,6 @@
 import pytest
 import os
+import random
 import sys
 
 # Add the project root to Python path
@@ -13,4 +14,45 @@ def sample_tokens():
 @pytest.fixture
 def sample_xml_path():
     """Fixture providing path to minimal MusicXML file"""
-    return "musicxml_sample/minimal.musicxml"
\ No newline at end of file
+    return "musicxml_sample/minimal.musicxml"
+
+def random_tokens(seed, n_measures=6):
+    """Séquence aléatoire riche en altérations, accords, liaisons, voix et changements d'armure"""
+    rng = random.Random(seed)
+
+    def group():
+        if rng.random() < 0.1:
+            return ['rest', 'len_1']
+        g = ['note_' + rng.choice('CDEFGAB') + rng.choice(['', '', '#', 'b', '##', 'bb']) + str(rng.choice([3, 4, 5]))
+             for _ in range(rng.choice([1, 1, 2, 3]))]
+        g.append('len_' + rng.choice(['1', '1/2', '2']))
+        if rng.random() < 0.2:
+            g.append('tie_' + rng.choice(['start', 'stop', 'continue']))
+        return g
+
+    tokens = []
+    for hand, clef in (('R', 'clef_treble'), ('L', 'clef_bass')):
+        tokens.append(hand)
+        for i in range(n_measures):
+            tokens.append('bar')
+            if i == 0 or rng.random() < 0.15:
+                k = rng.randint(-7, 7)
+                tokens.append('key_natural_0' if k == 0 else (f'key_sharp_{k}' if k > 0 else f'key_flat_{-k}'))
+                if i == 0:
+                    tokens += ['time_4/4', clef]
+            if rng.random() < 0.2:
+                tokens += group()
+                for _ in range(2):
+                    tokens.append('<voice>')
+                    for _ in range(rng.randint(1, 3)):
+                        tokens += group()
+                    tokens.append('</voice>')
+            else:
+                for _ in range(rng.randint(1, 6)):
+                    tokens += group()
+    return ' '.join(tokens)
+
+@pytest.fixture
+def random_token_strings():
+    """Fixture providing random_tokens for seeds 0..n-1"""
+    return lambda n: [random_tokens(seed) for seed in range(n)]
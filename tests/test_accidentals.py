@@ -0,0 +1,21 @@
+import glob
+import pytest
+from conftest import random_tokens
+from bachgen.score_to_tokens_simplify import MusicXML_to_tokens
+from bachgen.tokens_to_score import tokens_to_score
+
+def printed_accidentals(score):
+    return [(p.nameWithOctave, p.accidental.displayStatus if p.accidental else None)
+            for part in score.parts for n in part.recurse().notes for p in n.pitches]
+
+def sample_corpus():
+    seqs = [open('token_sample/minimal.tokens').read()]
+    for path in sorted(glob.glob('musicxml_sample/*.musicxml')):
+        seqs.append(' '.join(MusicXML_to_tokens(path)))
+    return seqs + [random_tokens(seed) for seed in range(50)]
+
+@pytest.mark.parametrize("token_string", sample_corpus())
+def test_table_accidentals_match_music21(token_string):
+    """Le moteur à tables imprime les mêmes altérations que la passe makeAccidentals de music21"""
+    expected = printed_accidentals(tokens_to_score(token_string, accidentals='music21'))
+    assert printed_accidentals(tokens_to_score(token_string, accidentals='table')) == expected
@@ -0,0 +1,45 @@
+import numpy as np
+import torch
+from bachgen.training.augment import TranspositionTables, TransposeAugmentDataset, transpose_pitch, parse_pitch
+from bachgen.training.datasets import PostTokenizedDataset
+from bachgen.vocab_utils import Vocab
+
+NOTES = [f"note_{s}{a}{o}" for o in range(1, 9) for s in "CDEFGAB" for a in ("", "#", "b")]
+VOCAB = Vocab({t: i for i, t in enumerate(
+    ["[PAD]", "[UNK]", "<BOS>", "<EOS>", "R", "L", "bar", "len_1", "len_2", "clef_treble", "note_60", "note_62", "note_108"]
+    + [f"key_sharp_{n}" for n in range(1, 8)] + [f"key_flat_{n}" for n in range(1, 8)] + ["key_natural_0"] + NOTES
+)})
+
+def test_transpose_pitch_spelling():
+    assert transpose_pitch(*parse_pitch("C4"), 2) == parse_pitch("D4")
+    assert transpose_pitch(*parse_pitch("F#4"), 2) == parse_pitch("G#4")
+    assert transpose_pitch(*parse_pitch("Bb4"), 1) == (0, -1, 5)   # Cb5 (seconde mineure)
+    assert transpose_pitch(*parse_pitch("E4"), -4) == parse_pitch("C4")
+
+def test_transposition_tables():
+    tables = TranspositionTables(VOCAB)
+    tokens = "R bar clef_treble key_natural_0 note_C4 note_E4 len_2 note_Bb4 len_1 note_60 len_1 L bar".split()
+    assert tables.transpose_tokens(tokens, 2) == ("R bar clef_treble key_sharp_2 note_D4 note_F#4 len_2 "
+                                                  "note_C5 len_1 note_62 len_1 L bar").split()
+    # +1 : do majeur -> ré bémol majeur (Bb -> Cb) ; +6 : G# -> C## absent du vocab -> enharmonique D
+    assert tables.transpose_tokens(tokens, 1)[3:8] == ["key_flat_5", "note_Db4", "note_F4", "len_2", "note_Cb5"]
+    assert tables.transpose_tokens(["key_natural_0", "note_G#4"], 6) == ["key_sharp_6", "note_D5"]
+    assert tables.transpose_tokens(tables.transpose_tokens(tokens, 2), -2) == tokens
+
+    # C8 (midi 108) ne peut pas monter ; note_60 + 1 = note_61 absent du vocab
+    assert tables.allowed_shifts(VOCAB.encode(["note_C4", "note_C8"])) == [-5, -4, -3, -2, -1, 0]
+    assert tables.allowed_shifts(VOCAB.encode(["note_60"])) == [0, 2]
+
+def test_augment_dataset_applies_one_gather():
+    tables = TranspositionTables(VOCAB, shifts=(-2, 0, 2))
+    seq = VOCAB.encode("R bar key_natural_0 note_C4 len_1 note_E4 len_1 L bar note_C3 len_2".split()).astype(np.int64)
+    base = PostTokenizedDataset([seq.tolist()], block_size=len(seq))
+    ds = TransposeAugmentDataset(base, tables, p=1.0, seed=3)
+    out = [ds[0]["input_ids"].tolist()]
+    ds.set_epoch(1)
+    out.append(ds[0]["input_ids"].tolist())
+    ds.set_epoch(2)
+    out.append(ds[0]["input_ids"].tolist())
+    expected = {tuple(tables.transpose(seq, s).tolist()) for s in (-2, 2)}
+    assert {tuple(o) for o in out} <= expected
+    assert ds[0]["labels"] is not None and torch.equal(ds[0]["labels"], ds[0]["input_ids"])
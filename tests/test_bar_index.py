@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from bachgen.training.bar_index import BarAlignedDataset, BarIndex
+from bachgen.training.datasets import IGNORE_INDEX
+from bachgen.vocab_utils import PackedCorpusWriter, Vocab
+
+TOKENS = ["[PAD]", "[UNK]", "<BOS>", "<EOS>", "R", "L", "bar", "clef_treble", "clef_bass", "key_sharp_1",
+          "key_natural_0", "time_4/4", "time_3/4", "note_C4", "note_E4", "len_1/4", "rest"]
+VOCAB = Vocab({t: i for i, t in enumerate(TOKENS)})
+
+DOCS = [
+    "<BOS> R bar clef_treble key_sharp_1 time_4/4 note_C4 len_1/4 bar note_E4 len_1/4 bar time_3/4 rest len_1/4 "
+    "L bar clef_bass key_sharp_1 time_4/4 note_C4 len_1/4 bar rest len_1/4 <EOS>",
+    "<BOS> R bar clef_treble key_natural_0 time_3/4 note_E4 len_1/4 bar note_C4 len_1/4 <EOS>",
+]
+
+
+def _ids(doc):
+    return VOCAB.encode(doc).astype(np.int64).tolist()
+
+
+def test_bar_index_state_and_measure_access(tmp_path):
+    seqs = [_ids(d) for d in DOCS]
+    index = BarIndex.build(seqs, VOCAB)
+    assert len(index) == 7
+    flat = np.concatenate(seqs)
+
+    start, end = index.measure(0, 1, hand="R")
+    assert VOCAB.decode(flat[start:end]) == ["bar", "note_E4", "len_1/4"]
+    assert VOCAB.decode(index.header_ids(index.bar(0, 2, "R"))) == ["R", "clef_treble", "key_sharp_1", "time_4/4"]
+    # l'état repart de zéro à chaque main : au 1er bar de L, seule la main est connue
+    assert VOCAB.decode(index.header_ids(index.bar(0, 0, "L"))) == ["L"]
+    assert VOCAB.decode(index.header_ids(index.bar(0, 1, "L"))) == ["L", "clef_bass", "key_sharp_1", "time_4/4"]
+    assert index.measure(1, 0) == (len(seqs[0]) + 2, len(seqs[0]) + 8)
+    with pytest.raises(IndexError):
+        index.measure(1, 0, hand="L")
+
+    again = BarIndex.load(index.save(tmp_path))
+    assert np.array_equal(again.header, index.header) and again.measure(0, 1, "L") == index.measure(0, 1, "L")
+
+
+def test_bar_aligned_windows_start_on_bar_with_header(tmp_path):
+    with PackedCorpusWriter(tmp_path, vocab_size=len(VOCAB)) as w:
+        for d in DOCS:
+            w.add(_ids(d))
+    ds = BarAlignedDataset(tmp_path, VOCAB, block_size=12, verbose=False)
+    assert (tmp_path / "bar_index.npz").exists() and len(ds) > 1
+    for k in range(len(ds)):
+        item = ds[k]
+        tokens = VOCAB.decode(item["input_ids"])
+        n_head = int((item["labels"] == IGNORE_INDEX).sum())
+        assert len(tokens) == 12 and tokens[n_head] == "bar"
+        assert tokens[0] in ("R", "L") and item["labels"][n_head:].tolist() == item["input_ids"][n_head:].tolist()
+
+
+def test_for_corpus_rebuilds_on_new_vocab_and_picks_collator(tmp_path):
+    import json
+    from bachgen.training.datasets import PackedDataCollator
+    from bachgen.vocab_utils import PACKED_META
+
+    with PackedCorpusWriter(tmp_path, vocab_size=len(VOCAB), vocab_fingerprint=VOCAB.fingerprint) as w:
+        for d in DOCS:
+            w.add(_ids(d))
+    first = BarIndex.for_corpus(tmp_path, VOCAB, verbose=False)
+    assert BarIndex.for_corpus(tmp_path, VOCAB, verbose=False).key == first.key
+    assert not list(tmp_path.glob("*.tmp"))  # écriture atomique, pas de reste
+
+    # mêmes n_tokens / n_docs, corpus réencodé avec un autre vocab : l'index est reconstruit
+    meta = json.loads((tmp_path / PACKED_META).read_text())
+    meta["vocab_fingerprint"] = "autre"
+    (tmp_path / PACKED_META).write_text(json.dumps(meta))
+    assert BarIndex.for_corpus(tmp_path, VOCAB, verbose=False).key["vocab_fingerprint"] == "autre"
+    assert BarIndex.load(tmp_path).key["vocab_fingerprint"] == "autre"
+
+    collator = BarAlignedDataset(tmp_path, VOCAB, block_size=12, verbose=False).collator
+    assert isinstance(collator, PackedDataCollator) and not collator.block_diagonal
@@ -0,0 +1,70 @@
+import os
+import pytest
+import torch
+from transformers import GPT2Config, TrainingArguments
+from bachgen.training.cpu_profile import (
+    LoaderWorkerPinning, benchmark_cpu_profiles, configure_cpu_threads, cpu_profile, numa_cpu_split,
+)
+from bachgen.training.datasets import PostTokenizedDataset
+
+@pytest.fixture
+def restore_process(monkeypatch):
+    # apply_cpu_profile agit sur tout le processus pytest : on remet threads, affinité et OMP_* en place
+    for var in ("OMP_NUM_THREADS", "OMP_PROC_BIND", "OMP_PLACES"):
+        monkeypatch.delenv(var, raising=False)
+    threads, cpus = torch.get_num_threads(), os.sched_getaffinity(0)
+    yield
+    torch.set_num_threads(threads)
+    os.sched_setaffinity(0, cpus)
+
+def test_cpu_profile_and_benchmark(tmp_path):
+    prof = cpu_profile(num_workers=0)
+    assert prof["attn_implementation"] == "sdpa" and prof["intra_op_threads"] >= 1
+    compute, loader = numa_cpu_split(0)
+    assert compute == loader and prof["compute_cpus"] == compute
+
+    res = benchmark_cpu_profiles(steps=2, warmup=1, block_size=16, vocab_size=32, n_embd=16, n_layer=1, n_head=2,
+                                 bf16_options=(False,), compile_options=(False,), out_csv=str(tmp_path / "bench.csv"),
+                                 verbose=False)
+    assert [r["attn"] for r in res] == ["eager", "sdpa"]
+    assert all(r["tokens_per_s"] > 0 and "error" not in r for r in res)
+    assert (tmp_path / "bench.csv").read_text().startswith("bf16,torch_compile,attn,threads,tokens_per_s")
+
+def test_configure_threads_keeps_user_env(restore_process, monkeypatch):
+    monkeypatch.setenv("OMP_NUM_THREADS", "3")
+    configure_cpu_threads(1)
+    assert os.environ["OMP_NUM_THREADS"] == "3" and torch.get_num_threads() == 1
+    assert os.environ["OMP_PROC_BIND"] == "close"
+
+def test_loader_pinning_chains_init_fn():
+    seen = []
+    pin = LoaderWorkerPinning(sorted(os.sched_getaffinity(0)), init_fn=seen.append)
+    threads = torch.get_num_threads()
+    try:
+        pin(3)
+    finally:
+        torch.set_num_threads(threads)
+    assert seen == [3]
+
+class AffinityDataset(PostTokenizedDataset):
+    def __getitem__(self, idx):
+        if torch.utils.data.get_worker_info() is not None:
+            self.seen_dir.joinpath(str(os.getpid())).write_text(",".join(map(str, sorted(os.sched_getaffinity(0)))))
+        return super().__getitem__(idx)
+
+def test_train_gpt2_pins_loader_workers(tmp_path, restore_process):
+    from bachgen.training.train_gpt2 import train_gpt2
+
+    prof = cpu_profile(num_workers=1)
+    ds = AffinityDataset([list(range(4, 36)) * 4], block_size=16)
+    ds.seen_dir = tmp_path
+    args = TrainingArguments(output_dir=str(tmp_path / "out"), max_steps=2, per_device_train_batch_size=2,
+                             dataloader_num_workers=1, save_strategy="no", report_to="none", use_cpu=True)
+    config = GPT2Config(vocab_size=40, n_positions=16, n_embd=16, n_layer=1, n_head=2, attn_implementation="eager")
+    trainer, model = train_gpt2(ds, None, config, args, cpu_profile=prof)
+
+    assert model.config._attn_implementation == prof["attn_implementation"] == "sdpa"
+    assert os.sched_getaffinity(0) == set(prof["compute_cpus"])
+    assert isinstance(trainer.callback_handler.train_dataloader.worker_init_fn, LoaderWorkerPinning)
+    pids = [p for p in tmp_path.iterdir() if p.name.isdigit()]
+    assert pids and all(set(map(int, p.read_text().split(","))) <= set(prof["loader_cpus"]) for p in pids)
@@ -0,0 +1,132 @@
+import pytest
+import torch
+import torch.nn.functional as F
+from transformers import GPT2Config, GPT2LMHeadModel
+from bachgen.training.evaluation import SlidingWindowEvaluator, window_spans
+
+def tiny_model(n_positions=16):
+    torch.manual_seed(0)
+    return GPT2LMHeadModel(GPT2Config(vocab_size=32, n_positions=n_positions, n_embd=16, n_layer=1, n_head=2)).eval()
+
+def test_window_spans_score_each_token_once():
+    for n, L, s in [(10, 4, 2), (17, 8, 3), (5, 8, 4), (8, 8, 8)]:
+        spans = window_spans(n, L, s)
+        targets = [t for b, e, f in spans for t in range(f, e)]
+        assert targets == list(range(1, n))
+        assert all(e - b <= L for b, e, _ in spans)
+
+def test_sliding_eval_matches_full_context_when_docs_fit(tmp_path):
+    model = tiny_model()
+    torch.manual_seed(1)
+    seqs = [torch.randint(4, 32, (n,)).tolist() for n in (16, 9, 12)]
+    ev = SlidingWindowEvaluator(seqs, block_size=16, stride=8, batch_size=2, cache_path=tmp_path / "w.pt", verbose=False)
+    nll = sum(F.cross_entropy(model(torch.tensor([s])).logits[0, :-1], torch.tensor(s[1:]), reduction="sum").item()
+              for s in seqs)
+    res = ev.evaluate(model)
+    assert res["tokens"] == 15 + 8 + 11
+    assert abs(res["loss"] - nll / res["tokens"]) < 1e-5
+    assert model.training is False
+
+    # fenêtres rechargées depuis le cache, sous-ensemble stable
+    again = SlidingWindowEvaluator(seqs, block_size=16, stride=8, cache_path=tmp_path / "w.pt", verbose=False)
+    assert torch.equal(again.windows, ev.windows)
+    assert again.subset(2).tolist() == again.subset(2).tolist()
+    # autres données, mêmes paramètres : le cache n'est pas réutilisé
+    other = SlidingWindowEvaluator(seqs[:1], block_size=16, stride=8, cache_path=tmp_path / "w.pt", verbose=False)
+    assert len(other) == 1
+    assert len(SlidingWindowEvaluator([], block_size=16, stride=8, cache_path=tmp_path / "w.pt", verbose=False)) == 0
+
+def test_stride_is_validated():
+    seq = [list(range(4, 12))]
+    assert SlidingWindowEvaluator(seq, block_size=1, verbose=False).stride == 1  # block_size // 2 == 0
+    for stride in (-1, 9):
+        with pytest.raises(ValueError):
+            SlidingWindowEvaluator(seq, block_size=8, stride=stride, verbose=False)
+
+def test_overlapping_windows_give_more_context():
+    model = tiny_model(n_positions=8)
+    seq = [[(i * 7) % 28 + 4 for i in range(40)]]
+    disjoint = SlidingWindowEvaluator(seq, block_size=8, stride=8, verbose=False)
+    sliding = SlidingWindowEvaluator(seq, block_size=8, stride=2, verbose=False)
+    # blocs disjoints : le 1er token de chaque bloc (sans contexte) n'est pas évalué
+    assert disjoint.evaluate(model)["tokens"] == 39 - 4
+    assert sliding.evaluate(model)["tokens"] == 39
+    assert len(sliding) > len(disjoint)
+
+def test_per_class_loss_and_accuracy():
+    from bachgen.training.evaluation import TOKEN_CLASSES, format_class_report, token_class, token_class_ids
+    from bachgen.vocab_utils import Vocab
+
+    assert [token_class(t) for t in ["note_Bb4", "note_61", "len_1/2", "bar", "R", "</voice>", "key_flat_2",
+                                     "time_3/4", "beam_start", "tie_stop", "rest", "clef_bass"]] == \
+        ["pitch", "pitch", "duration", "bar", "hand", "voice", "key", "time", "beam", "tie", "rest", "clef"]
+    tokens = ["[PAD]", "[UNK]", "<BOS>", "<EOS>", "R", "L", "bar", "rest", "clef_treble", "key_natural_0",
+              "time_4/4", "len_1", "len_2", "note_C4", "note_E4", "note_G4"]
+    vocab = Vocab({t: i for i, t in enumerate(tokens)})
+    classes = token_class_ids(vocab)
+    assert TOKEN_CLASSES[classes[2]] == "special" and TOKEN_CLASSES[classes[13]] == "pitch"
+
+    torch.manual_seed(0)
+    model = GPT2LMHeadModel(GPT2Config(vocab_size=len(tokens), n_positions=32, n_embd=16, n_layer=1, n_head=2)).eval()
+    seqs = [vocab.encode("R bar clef_treble key_natural_0 time_4/4 note_C4 len_1 note_E4 len_2 rest len_1 L bar note_G4 len_2".split(),
+                         add_bos=True, add_eos=True).tolist()]
+    res = SlidingWindowEvaluator(seqs, block_size=32, stride=16, vocab=vocab, verbose=False).evaluate(model)
+
+    s = seqs[0]
+    logits = model(torch.tensor([s])).logits[0, :-1]
+    losses = F.cross_entropy(logits, torch.tensor(s[1:]), reduction="none")
+    hits = logits.argmax(-1) == torch.tensor(s[1:])
+    for name in ("pitch", "duration", "hand"):
+        sel = [i for i, t in enumerate(s[1:]) if TOKEN_CLASSES[classes[t]] == name]
+        assert res["by_class"][name]["tokens"] == len(sel)
+        assert abs(res["by_class"][name]["loss"] - losses[sel].mean().item()) < 1e-5
+        assert abs(res["by_class"][name]["accuracy"] - hits[sel].float().mean().item()) < 1e-6
+    assert abs(sum(c["loss_share"] for c in res["by_class"].values()) - 1) < 1e-9
+    assert abs(res["loss"] - losses.mean().item()) < 1e-5
+    assert "pitch" in format_class_report(res)
+
+def test_sliding_eval_metrics_go_through_trainer_logs(tmp_path):
+    from transformers import TrainerCallback, TrainingArguments
+    from bachgen.training.datasets import PostTokenizedDataset
+    from bachgen.training.train_gpt2 import train_gpt2
+
+    class Recorder(TrainerCallback):
+        def __init__(self):
+            self.logs = []
+
+        def on_log(self, args, state, control, logs=None, **kwargs):
+            self.logs.append(dict(logs))
+
+    torch.manual_seed(0)
+    seqs = [torch.randint(4, 32, (96,)).tolist()]
+    evaluator = SlidingWindowEvaluator(seqs, block_size=16, stride=8, verbose=False)
+    args = TrainingArguments(output_dir=str(tmp_path / "out"), num_train_epochs=2, per_device_train_batch_size=2,
+                             logging_steps=1000, save_strategy="no", report_to="none", use_cpu=True)
+    config = GPT2Config(vocab_size=32, n_positions=16, n_embd=16, n_layer=1, n_head=2)
+    recorder = Recorder()
+    trainer, _ = train_gpt2(PostTokenizedDataset(seqs, block_size=16), None, config, args,
+                            callbacks=[recorder], sliding_eval=evaluator)
+
+    # un log par fin d'époque (demandé par le callback), vu par les autres callbacks et dans l'historique
+    sw = [log for log in recorder.logs if "sw_eval_loss" in log]
+    assert len(sw) == 2 and all("loss" in log for log in sw)
+    history = [h for h in trainer.state.log_history if "sw_eval_loss" in h]
+    assert [h["step"] for h in history] == [3, 6]
+    names = [type(cb).__name__ for cb in trainer.callback_handler.callbacks]
+    assert names.index("SlidingWindowEvalCallback") < names.index("Recorder")
+    assert names[-1] in ("ProgressCallback", "PrinterCallback")  # callbacks par défaut laissés en place
+
+def test_window_cache_detects_packed_corpus_with_same_counts(tmp_path):
+    from bachgen.vocab_utils import PackedCorpusWriter
+
+    torch.manual_seed(2)
+    corpora = []
+    for name in ("a", "b"):
+        with PackedCorpusWriter(tmp_path / name, vocab_size=32, vocab_fingerprint="v") as w:
+            for n in (20, 12):
+                w.add(torch.randint(4, 32, (n,)).tolist())
+        corpora.append(tmp_path / name)
+    first = SlidingWindowEvaluator(corpora[0], block_size=8, stride=4, cache_path=tmp_path / "w.pt", verbose=False)
+    # mêmes n_tokens / n_docs / vocab, autres tokens : fenêtres reconstruites
+    second = SlidingWindowEvaluator(corpora[1], block_size=8, stride=4, cache_path=tmp_path / "w.pt", verbose=False)
+    assert first.windows.shape == second.windows.shape and not torch.equal(first.windows, second.windows)
@@ -0,0 +1,45 @@
+import json
+from pathlib import Path
+import torch
+import torch.distributed as dist
+from bachgen.training.launch import benchmark_ddp, init_distributed, launch, rank_cpus
+
+def _all_reduce(out_dir):
+    rank, world = init_distributed()
+    t = torch.tensor([rank + 1.0])
+    dist.all_reduce(t)
+    Path(out_dir, f"rank{rank}.json").write_text(json.dumps({"world": world, "sum": t.item()}))
+    dist.destroy_process_group()
+
+def test_launch_local_ranks(tmp_path):
+    launch(_all_reduce, 2, args=(str(tmp_path),))
+    res = [json.loads((tmp_path / f"rank{r}.json").read_text()) for r in range(2)]
+    assert res == [{"world": 2, "sum": 3.0}] * 2
+    assert all(len(rank_cpus(r, 2)) >= 1 for r in range(2))
+
+def test_benchmark_ddp_keeps_ranks_consistent():
+    res = benchmark_ddp((1, 2), steps=2, warmup=1, block_size=16, vocab_size=32, n_embd=16, n_layer=1, n_head=2,
+                        verbose=False)
+    assert [r["nprocs"] for r in res] == [1, 2]
+    assert all(r["consistent"] and r["tokens_per_s"] > 0 for r in res)
+
+def test_run_training_two_ranks(tmp_path):
+    from bachgen.training.launch import run_training
+    from bachgen.training.splits import save_split_packed
+
+    vocab = {"[PAD]": 0, "[UNK]": 1, "<BOS>": 2, "<EOS>": 3, **{f"t{i}": i for i in range(4, 32)}}
+    (tmp_path / "vocab.json").write_text(json.dumps(vocab))
+    g = torch.Generator().manual_seed(0)
+    save_split_packed([torch.randint(4, 32, (16 * 8,), generator=g).tolist()], tmp_path / "train", vocab_size=32)
+    save_split_packed([torch.randint(4, 32, (16 * 2,), generator=g).tolist()], tmp_path / "valid", vocab_size=32)
+    cfg = {"vocab": str(tmp_path / "vocab.json"), "train": str(tmp_path / "train"), "valid": str(tmp_path / "valid"),
+           "out_dir": str(tmp_path / "out"), "block_size": 16, "epochs": 1, "batch_size": 2, "grad_accum": 1,
+           "n_embd": 16, "n_layer": 1, "n_head": 2}
+    launch(run_training, 2, args=(cfg,))
+
+    # 8 blocs, 2 rangs x 2 blocs par step -> 2 steps par rang (4 sans DDP) ; un seul checkpoint (rang 0)
+    checkpoints = sorted(p.name for p in (tmp_path / "out").glob("checkpoint-*"))
+    assert checkpoints == ["checkpoint-2"]
+    state = json.loads((tmp_path / "out" / "checkpoint-2" / "trainer_state.json").read_text())
+    assert state["global_step"] == 2
+    assert (tmp_path / "out" / "final" / "config.json").exists()
@@ -0,0 +1,41 @@
+import torch
+from transformers import GPT2LMHeadModel
+from bachgen.training.long_context import block_size_report, estimate_activation_mb, long_context_config
+
+def test_checkpointing_gives_same_gradients():
+    config = long_context_config(32, 0, 2, 3, block_size=64, n_embd=16, n_layer=2, n_head=2)
+    assert config.n_positions == 64 and not config.use_cache
+    config.resid_pdrop = config.embd_pdrop = config.attn_pdrop = 0.0
+    torch.manual_seed(0)
+    ids = torch.randint(4, 32, (2, 64))
+    grads = []
+    for ckpt in (False, True):
+        torch.manual_seed(1)
+        model = GPT2LMHeadModel(config)
+        if ckpt:
+            model.gradient_checkpointing_enable()
+        model.train()
+        model(input_ids=ids, labels=ids).loss.backward()
+        grads.append(model.transformer.h[0].mlp.c_fc.weight.grad.clone())
+    assert torch.allclose(grads[0], grads[1], atol=1e-6)
+
+    big = long_context_config(364, 0, 2, 3, block_size=4096)
+    assert estimate_activation_mb(big, 4096, checkpointing=True) < estimate_activation_mb(big, 4096) / 2
+    assert estimate_activation_mb(big, 4096, attn_implementation="eager") > estimate_activation_mb(big, 4096)
+
+def test_pipeline_config_switches_to_long_context():
+    from bachgen.training.train_gpt2 import build_gpt2_config
+
+    assert build_gpt2_config(32, 0, 2, 3, n_positions=1024, n_embd=16, n_layer=1, n_head=2).use_cache
+    long = build_gpt2_config(32, 0, 2, 3, n_positions=4096, n_embd=16, n_layer=1, n_head=2)
+    assert long.n_positions == 4096 and not long.use_cache
+    model = GPT2LMHeadModel(long)
+    model.set_attn_implementation("eager")  # API publique, comme block_size_report
+    assert model.config.n_positions == 4096
+
+def test_block_size_report_in_process(tmp_path):
+    res = block_size_report((32, 64), vocab_size=32, n_embd=16, n_layer=1, n_head=2, steps=1, isolate=False,
+                            out_csv=str(tmp_path / "report.csv"), verbose=False)
+    assert [(r["block_size"], r["checkpointing"]) for r in res] == [(32, False), (32, True), (64, False), (64, True)]
+    assert all(r["tokens_per_s"] > 0 for r in res)
+    assert (tmp_path / "report.csv").exists()
@@ -0,0 +1,53 @@
+import pandas as pd
+import pyarrow.dataset as pads
+from bachgen.parquet_export import export_token_dataset, load_metadata, load_token_dataset, query_token_dataset
+from bachgen.vocab_utils import Vocab, build_vocab
+
+def make_corpus(root):
+    token_dir = root / "tokens"
+    token_dir.mkdir()
+    pieces = {
+        "bach_1": "R bar note_C4 len_4 L bar note_C3 len_4",
+        "bach_2": "R bar note_D4 len_2 note_E4 len_2 L bar rest len_4",
+        "satie_1": "R bar rest len_4 L bar",
+    }
+    for stem, tokens in pieces.items():
+        (token_dir / f"{stem}.txt").write_text(tokens, encoding="utf-8")
+    pd.DataFrame({
+        "file": [f"{s}.musicxml" for s in pieces],
+        "transparent_pct": [0.0, 1.5, 0.0],
+    }).to_csv(root / "stats.csv", index=False)
+    pdmx = pd.DataFrame({
+        "mxl": ["./mxl/1/bach_1.mxl", "./mxl/2/bach_2.mxl", "./mxl/3/satie_1.mxl", "./mxl/4/other.mxl"],
+        "genres": ["classical", "classical", "modern", "pop"],
+        "composer_name": ["Bach", "Bach", "Satie", None],
+        "n_tracks": [2, 2, 2, 1],
+    })
+    return token_dir, pieces, pdmx
+
+def test_export_and_query(tmp_path):
+    token_dir, pieces, pdmx = make_corpus(tmp_path)
+    token2id, _ = build_vocab(sorted(token_dir.glob("*.txt")))
+    out = export_token_dataset(token_dir, tmp_path / "parquet", vocab=token2id, stats_csv=tmp_path / "stats.csv",
+                               pdmx=pdmx, partition_col="genres", rows_per_file=2, verbose=False)
+    assert sorted(p.name for p in out.iterdir()) == ["genres=classical", "genres=modern"]
+
+    table = query_token_dataset(out, pads.field("composer_name") == "Bach", columns=["stem", "tokens", "ids"])
+    assert sorted(table["stem"].to_pylist()) == ["bach_1", "bach_2"]
+    vocab = Vocab(token2id)
+    for row in table.to_pylist():
+        assert row["tokens"] == pieces[row["stem"]].split()
+        assert vocab.decode(row["ids"], drop_specials=True) == row["tokens"]
+
+    ds = load_token_dataset(out, streaming=True, filters=[("genres", "=", "classical"), ("transparent_pct", ">", 1.0)])
+    rows = list(ds)
+    assert [r["stem"] for r in rows] == ["bach_2"]
+    assert rows[0]["n_tracks"] == 2 and rows[0]["n_tokens"] == 10
+
+def test_metadata_with_duplicate_stems(tmp_path):
+    _, _, pdmx = make_corpus(tmp_path)
+    pd.DataFrame({"file": ["a/bach_1.musicxml", "b/bach_1.musicxml"], "transparent_pct": [0.0, 2.0]}).to_csv(
+        tmp_path / "dup.csv", index=False)
+    meta = load_metadata(tmp_path / "dup.csv", pd.concat([pdmx, pdmx.iloc[:1]]), ["genres"])
+    assert meta.index.is_unique
+    assert meta.loc["bach_1", "transparent_pct"] == 0.0 and meta.loc["bach_1", "genres"] == "classical"
@@ -0,0 +1,47 @@
+import numpy as np
+from bachgen.piano_roll import HAND_COLORS, note_to_midi, render_dir, render_piano_roll, tokens_to_events
+
+TOKENS = ("R bar clef_treble key_flat_2 time_4/4 note_Bb4 note_D5 len_2 rest len_1 note_C#5 len_1/2 len_1/2 "
+          "bar <voice> note_F5 len_4 </voice> <voice> note_A4 len_2 note_G4 len_2 </voice> "
+          "L bar clef_bass time_4/4 note_48 len_4 bar note_C3 len_3")
+
+def test_note_to_midi():
+    assert note_to_midi("C4") == 60
+    assert note_to_midi("Bb4") == 70
+    assert note_to_midi("C##3") == 50
+    assert note_to_midi("61") == 61
+
+def test_tokens_to_events():
+    """Les accords, silences, notes liées, voix simultanées et mesures sont placés sur une même grille"""
+    ev = tokens_to_events(TOKENS)
+    notes = sorted(tuple(float(x) for x in row) for row in ev["notes"])
+    assert notes == [
+        (0, 0, 2, 70), (0, 0, 2, 74), (0, 3, 1, 73),
+        (0, 4, 2, 69), (0, 4, 4, 77), (0, 6, 2, 67),
+        (1, 0, 4, 48), (1, 4, 3, 48),
+    ]
+    assert ev["bars"].tolist() == [0, 4]
+    assert ev["length"] == 8
+
+def test_render_piano_roll_from_ids():
+    tokens = TOKENS.split()
+    id2token = dict(enumerate(["[PAD]", "<BOS>", "<EOS>"] + sorted(set(tokens))))
+    token2id = {t: i for i, t in id2token.items()}
+    ids = np.array([1] + [token2id[t] for t in tokens] + [2])
+
+    img = render_piano_roll(ids, id2token, px_per_quarter=8, px_per_semitone=2, pitch_range=(40, 80))
+    assert img.shape == (82, 64, 3) and img.dtype == np.uint8
+    assert np.array_equal(img, render_piano_roll(TOKENS, px_per_quarter=8, px_per_semitone=2, pitch_range=(40, 80)))
+    assert tuple(img[(80 - 70) * 2, 4]) == HAND_COLORS["R"]   # Bb4 main droite
+    assert tuple(img[(80 - 48) * 2, 4]) == HAND_COLORS["L"]   # C3 main gauche
+
+def test_render_dir(tmp_path):
+    src = tmp_path / "tokens"
+    src.mkdir()
+    for i in range(3):
+        (src / f"sample_{i}.txt").write_text(TOKENS, encoding="utf-8")
+    (src / "broken.txt").write_text("R bar note_C4 len_x", encoding="utf-8")
+
+    written = render_dir(src, tmp_path / "rolls", workers=2, max_quarters=4)
+    assert sorted(p.name for p in written) == ["sample_0.png", "sample_1.png", "sample_2.png"]
+    assert (tmp_path / "rolls" / "contact_sheet.png").exists()
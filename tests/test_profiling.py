@@ -0,0 +1,37 @@
+import json
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel, Trainer, TrainingArguments
+from bachgen.training.datasets import PostTokenizedDataset, SimpleDataCollator
+from bachgen.training.profiling import PHASES, StepProfiler, ThroughputCallback
+
+def test_step_profiler_manual_loop(tmp_path):
+    prof = StepProfiler(tmp_path / "steps.csv", trace_steps=(1, 2))
+    for _ in range(3):
+        prof.start_step()
+        with prof.phase("forward_s"):
+            torch.randn(64, 64) @ torch.randn(64, 64)
+        prof.end_step(tokens=128)
+    prof.close()
+    lines = (tmp_path / "steps.csv").read_text().splitlines()
+    assert len(lines) == 4 and lines[0].startswith("data_wait_s,forward_s")
+    assert (tmp_path / "trace_steps_1-2.json").exists()
+    s = prof.summary()
+    assert s["steps"] == 2 and s["tokens_per_s"] > 0
+
+def test_throughput_callback_with_trainer(tmp_path):
+    torch.manual_seed(0)
+    seqs = [torch.randint(4, 32, (200,)).tolist()]
+    ds = PostTokenizedDataset(seqs, block_size=16)
+    model = GPT2LMHeadModel(GPT2Config(vocab_size=32, n_positions=16, n_embd=16, n_layer=1, n_head=2))
+    args = TrainingArguments(output_dir=str(tmp_path / "out"), max_steps=4, per_device_train_batch_size=2,
+                             gradient_accumulation_steps=2, logging_steps=2, save_strategy="no",
+                             report_to="none", use_cpu=True)
+    cb = ThroughputCallback(tmp_path / "steps.jsonl", verbose=False)
+    Trainer(model=model, args=args, train_dataset=ds, data_collator=SimpleDataCollator(), callbacks=[cb]).train()
+
+    recs = [json.loads(l) for l in (tmp_path / "steps.jsonl").read_text().splitlines()]
+    assert [r["global_step"] for r in recs] == [1, 2, 3, 4]
+    assert all(r["tokens"] == 2 * 2 * 16 for r in recs)
+    assert all(r[p] >= 0 for r in recs for p in PHASES)
+    assert all(r["forward_s"] > 0 and r["optimizer_s"] > 0 for r in recs)
+    assert not model._forward_hooks and not model._forward_pre_hooks
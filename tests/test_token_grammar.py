@@ -0,0 +1,33 @@
+import pytest
+from bachgen.token_grammar import find_first_error, is_valid_tokens, repair_tokens
+from bachgen.tokens_to_score import tokens_to_score
+
+def test_minimal_tokens_are_valid(sample_tokens):
+    assert find_first_error(sample_tokens) is None
+
+@pytest.mark.parametrize("tokens, pos", [
+    ("R bar len_1 L bar", 2),                          # len sans note
+    ("R bar <voice> note_C4 len_1 bar L bar", 5),      # <voice> non fermée
+    ("R bar note_C4 len_1", 4),                        # R sans L
+    ("R bar note_C4 key_flat_1 len_1 L bar", 3),       # key dans un accord
+    ("R bar time_4-4 note_C4 len_1 L bar", 2),         # time inconnu
+    ("R bar note_C4 bar L bar", 3),                    # note sans len
+])
+def test_first_error_position(tokens, pos):
+    err = find_first_error(tokens)
+    assert err is not None
+    assert err[0] == pos
+
+@pytest.mark.parametrize("tokens", [
+    "R bar len_1 L bar",
+    "R bar <voice> note_C4 len_1 bar L bar",
+    "R bar note_C4 len_1",
+    "R bar note_C4 key_flat_1 len_1 L bar",
+    "note_C4 len_1 </voice> L",
+])
+def test_repaired_tokens_convert(tokens):
+    fixed, errors = repair_tokens(tokens)
+    assert errors
+    assert is_valid_tokens(fixed)
+    score = tokens_to_score(" ".join(fixed))
+    assert len(score.parts) == 2
@@ -0,0 +1,41 @@
+import glob
+import numpy as np
+from bachgen.score_to_tokens_simplify import MusicXML_to_tokens
+from bachgen.token_merges import TokenMerges
+from bachgen.vocab_utils import Vocab
+
+def corpus(random_strings):
+    seqs = [open('token_sample/minimal.tokens').read().split()]
+    seqs += [MusicXML_to_tokens(path) for path in sorted(glob.glob('musicxml_sample/*.musicxml'))]
+    seqs += [s.split() for s in random_strings]
+    token2id = {t: i for i, t in enumerate(["[PAD]", "[UNK]", "<BOS>", "<EOS>"])}
+    for seq in seqs:
+        for t in seq:
+            token2id.setdefault(t, len(token2id))
+    vocab = Vocab(token2id)
+    return vocab, [vocab.encode(seq, add_bos=True, add_eos=True) for seq in seqs]
+
+def test_merges_roundtrip_and_boundaries(tmp_path, random_token_strings):
+    vocab, seqs = corpus(random_token_strings(20))
+    merges = TokenMerges.train(seqs, vocab, n_merges=200, verbose=False)
+    assert 0 < len(merges.merges) <= 200
+
+    boundaries = {vocab.token2id[t] for t in ("bar", "R", "L", "<voice>", "</voice>")} | {2, 3}
+    for i in range(merges.base_size, merges.vocab_size):
+        assert not boundaries & set(merges.expand([i]).tolist())  # aucune fusion ne traverse une frontière
+
+    for seq in seqs:
+        encoded = merges.encode(seq)
+        assert np.array_equal(merges.expand(encoded), seq)
+        assert merges.expand_tokens([merges.token(i) for i in encoded]) == vocab.decode(seq)
+
+    stats = merges.compression_ratio(seqs)
+    assert stats["ratio"] > 1.3
+
+    merges.save(tmp_path / "merges.json")
+    reloaded = TokenMerges.load(tmp_path / "merges.json", vocab)
+    assert np.array_equal(reloaded.encode(seqs[1]), merges.encode(seqs[1]))
+    assert len(reloaded.extended_token2id()) == merges.vocab_size
+
+    score = merges.to_score(merges.encode(seqs[0]))
+    assert [n.pitch.nameWithOctave for n in score.parts[0].recurse().notes] == ['C4']
@@ -26,4 +26,62 @@ def test_minimal_tokens_to_score():
     notes = measure.notes
     assert len(notes) == 1
     assert notes[0].pitch.nameWithOctave == 'C4'
-    assert notes[0].quarterLength == 4.0
\ No newline at end of file
+    assert notes[0].quarterLength == 4.0
+
+def test_ids_to_score_matches_tokens():
+    """Test converting an id sequence (list, NumPy, torch) with a vocab, without strings"""
+    import numpy as np
+    import torch
+
+    tokens = ("R bar clef_treble key_flat_3 time_3/4 note_C4 note_Eb4 len_1 rest len_1 "
+              "note_Bb4 len_1/2_up note_C5 len_1/2 L bar clef_bass key_flat_3 time_3/4 note_C3 len_3").split()
+    token2id = {"[PAD]": 0, "[UNK]": 1, "<BOS>": 2, "<EOS>": 3}
+    for t in tokens:
+        token2id.setdefault(t, len(token2id))
+    ids = [2] + [token2id[t] for t in tokens] + [3]
+
+    expected = tokens_to_score(" ".join(tokens))
+    for seq in (ids, np.array(ids), torch.tensor([ids])):
+        score = tokens_to_score(seq, vocab=token2id)
+        for p_exp, p_got in zip(expected.parts, score.parts):
+            exp = [(str(n.pitches), n.quarterLength, n.offset) for n in p_exp.recurse().notesAndRests]
+            got = [(str(n.pitches), n.quarterLength, n.offset) for n in p_got.recurse().notesAndRests]
+            assert exp == got
+
+def test_id_table_follows_vocab_updates(tmp_path):
+    """Test that an extended vocab (file or dict) is not served from a stale table"""
+    import json
+    from bachgen.tokens_to_score import ids_to_hands, split_hands
+
+    token2id = {"[PAD]": 0, "[UNK]": 1, "<BOS>": 2, "<EOS>": 3, "R": 4, "L": 5, "bar": 6, "note_C4": 7, "len_1": 8}
+    path = tmp_path / "token2id.json"
+    path.write_text(json.dumps(token2id), encoding="utf-8")
+    assert ids_to_hands([4, 6, 7, 8], path) == (["bar", "note_C4", "len_1"], [])
+
+    token2id.update({"note_D4": 9, "mystery": 10})  # extension append-only, puis mise à jour en place
+    path.write_text(json.dumps(token2id, indent=1), encoding="utf-8")
+    ids = [2, 4, 6, 9, 8, 10, 5, 6, 7, 8, 3]
+    tokens = ["R", "bar", "note_D4", "len_1", "mystery", "L", "bar", "note_C4", "len_1"]
+    for vocab in (path, token2id):
+        assert ids_to_hands(ids, vocab) == split_hands(tokens)
+
+def test_measure_cache_matches_uncached():
+    """Test that memoized measures rebuild the same notes, offsets, attributes and accidentals"""
+    from bachgen.tokens_to_score import MeasureCache
+
+    body = ("bar note_Bb4 note_D5 len_1 note_B4 len_1/2_up_start note_C#5 len_1/2_up_stop note_Eb5 len_2 "
+            "bar note_C5 len_2 <voice> note_E5 len_1 note_F5 len_1 </voice> <voice> note_G4 len_2 </voice> ") * 4
+    token_string = ("R bar clef_treble key_flat_2 time_4/4 note_C5 len_4 " + body + "bar key_sharp_1 note_F5 len_4 "
+                    + body + "L bar clef_bass key_flat_2 time_4/4 note_C3 len_4 " + body.replace('5', '3'))
+
+    def describe(score):
+        return [(type(e).__name__, str(getattr(e, 'pitches', '')), e.quarterLength, e.getOffsetInHierarchy(part),
+                 [p.accidental.displayStatus if p.accidental else None for p in getattr(e, 'pitches', ())])
+                for part in score.parts for e in part.recurse() if not e.isStream]
+
+    cache = MeasureCache()
+    expected = describe(tokens_to_score(token_string))
+    assert describe(tokens_to_score(token_string, measure_cache=cache)) == expected
+    assert cache.hits > 0
+    assert describe(tokens_to_score(token_string, measure_cache=cache)) == expected
+    assert cache.misses == cache.stats()['size']
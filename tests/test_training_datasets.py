@@ -0,0 +1,197 @@
+import pickle
+import pytest
+import numpy as np
+import torch
+from bachgen.training.datasets import MemmapTokenDataset, PostTokenizedDataset
+from bachgen.training.splits import save_split_packed
+from bachgen.training.train_gpt2 import make_dataset
+
+SEQS = [[2, 5, 6, 3], [2, 3], [2, 7, 7, 7, 8, 3], [2, 9, 3]]
+
+def test_memmap_dataset_matches_list_dataset(tmp_path):
+    save_split_packed(SEQS, tmp_path / "train", vocab_size=10)
+    ref = PostTokenizedDataset(SEQS, block_size=4)
+    ds = make_dataset(tmp_path / "train", block_size=4)
+    assert isinstance(ds, MemmapTokenDataset)
+    assert len(ds) == len(ref) == 3
+    for i in range(len(ds)):
+        item = ds[i]
+        assert item["input_ids"].dtype == torch.long
+        assert torch.equal(item["input_ids"], ref[i]["input_ids"])
+        assert item["labels"] is item["input_ids"]
+
+    # le memmap n'est pas transmis aux workers : il est ré-ouvert à la demande
+    ds[0]
+    clone = pickle.loads(pickle.dumps(ds))
+    assert clone._tokens is None
+    assert torch.equal(clone[-1]["input_ids"], ref[2]["input_ids"])
+
+def test_memmap_dataset_dataloader_workers(tmp_path):
+    save_split_packed(SEQS, tmp_path / "train", vocab_size=10)
+    ds = MemmapTokenDataset(tmp_path / "train", block_size=3, verbose=False)
+    loader = torch.utils.data.DataLoader(ds, batch_size=2, num_workers=2)
+    batches = [b["input_ids"] for b in loader]
+    assert torch.equal(torch.cat(batches), torch.stack([ds[i]["input_ids"] for i in range(len(ds))]))
+
+def test_packed_documents_positions_labels_and_stats():
+    from bachgen.training.datasets import IGNORE_INDEX, PackedDocumentDataset, segment_document
+
+    seqs = [[2, 5, 6, 3], [2, 3], [2, 7, 7, 3], [2, 4, 8, 4, 8, 4, 8, 3]]  # 4 = bar
+    assert segment_document(8, 6, np.array([1, 3, 5])) == [(0, 5), (5, 8)]
+    assert segment_document(8, 6) == [(0, 6), (6, 8)]
+
+    ds = PackedDocumentDataset(seqs, block_size=6, pad_id=0, bar_id=4, verbose=False)
+    assert ds.stats["n_tokens"] == 18 and ds.stats["n_segments"] == 5
+    assert len(ds) == 4 and ds.stats["pad_pct"] == 25.0  # [5] [4 2] [4] [3]
+    seen = []
+    for i in range(len(ds)):
+        item = ds[i]
+        ids, pos, labels = (item[k].tolist() for k in ("input_ids", "position_ids", "labels"))
+        starts = [j for j, p in enumerate(pos) if p == 0]
+        for a, b in zip(starts, starts[1:] + [6]):
+            if ids[a] == 0:  # padding
+                assert labels[a:b] == [IGNORE_INDEX] * (b - a)
+                continue
+            seen.append(ids[a:b])
+            assert labels[a] == IGNORE_INDEX and labels[a + 1:b] == ids[a + 1:b]
+    assert sorted(seen) == sorted([[2, 5, 6, 3], [2, 3], [2, 7, 7, 3], [2, 4, 8, 4, 8], [4, 8, 3]])
+
+def test_packed_block_matches_separate_documents():
+    """Avec le masque bloc-diagonal, un document packé donne les mêmes logits que seul"""
+    from transformers import GPT2Config, GPT2LMHeadModel
+    from bachgen.training.datasets import PackedDataCollator, PackedDocumentDataset, install_block_diagonal_mask
+
+    torch.manual_seed(0)
+    model = GPT2LMHeadModel(GPT2Config(vocab_size=10, n_positions=8, n_embd=16, n_layer=1, n_head=2)).eval()
+    install_block_diagonal_mask(model)
+    seqs = [[2, 5, 6, 3], [2, 7, 3]]
+    ds = PackedDocumentDataset(seqs, block_size=8, verbose=False)
+    batch = PackedDataCollator()([ds[0]])
+    assert batch["document_ids"].dtype == torch.long and "attention_mask" not in batch  # rien de (L x L) à transférer
+    with torch.no_grad():
+        packed = model(**batch).logits[0]
+        ids = batch["input_ids"][0].tolist()
+        for seq in seqs:
+            start = next(j for j in range(8) if ids[j:j + len(seq)] == seq)
+            alone = model(torch.tensor([seq])).logits[0]
+            assert torch.allclose(packed[start:start + len(seq)], alone, atol=1e-5)
+
+    with pytest.raises(ValueError):
+        PackedDataCollator(max_len=4)([ds[0]])
+
+def test_random_windows_are_seeded_per_epoch(tmp_path):
+    from bachgen.training.datasets import RandomWindowDataset
+    from bachgen.training.train_gpt2 import SetEpochCallback
+
+    seqs = [list(range(i * 10, i * 10 + 10)) for i in range(5)]  # flux 0..49
+    ds = RandomWindowDataset(seqs, block_size=8, samples_per_epoch=12, seed=1, verbose=False)
+    assert len(ds) == 12
+    first = [ds[i]["input_ids"].tolist() for i in range(12)]
+    assert all(w == list(range(w[0], w[0] + 8)) for w in first)
+    assert first == [ds[i]["input_ids"].tolist() for i in range(12)]
+
+    # mêmes fenêtres depuis un corpus packé, avec 2 workers, et nouvelle découpe à l'époque suivante
+    save_split_packed(seqs, tmp_path / "train", vocab_size=64)
+    packed = RandomWindowDataset(tmp_path / "train", block_size=8, samples_per_epoch=12, seed=1, verbose=False)
+    loader = torch.utils.data.DataLoader(packed, batch_size=4, num_workers=2, persistent_workers=True)
+    assert torch.cat([b["input_ids"] for b in loader]).tolist() == first
+    SetEpochCallback(packed).on_epoch_begin(None, type("S", (), {"epoch": 1.0})(), None)
+    second = torch.cat([b["input_ids"] for b in loader]).tolist()
+    assert second != first and second == [packed[i]["input_ids"].tolist() for i in range(12)]
+
+    strat = RandomWindowDataset(seqs, block_size=8, samples_per_epoch=6, stratified=True, verbose=False)
+    starts = [strat.offset(i) for i in range(6)]
+    assert all(int(i * 43 / 6) <= s < int((i + 1) * 43 / 6) for i, s in enumerate(starts))
+
+class SlowDataset(torch.utils.data.Dataset):
+    """Simule un chargement coûteux (I/O, décodage) : 10 ms par exemple"""
+    def __len__(self):
+        return 64
+
+    def __getitem__(self, idx):
+        import os
+        import time
+        time.sleep(0.01)
+        x = torch.full((8,), idx, dtype=torch.long)
+        return {"input_ids": x, "labels": x, "pid": os.getpid()}
+
+def test_default_training_args_dataloader(tmp_path):
+    from bachgen.training.train_gpt2 import default_training_args
+
+    args = default_training_args(tmp_path, num_workers=2, pin_memory=False)
+    assert args.dataloader_num_workers == 2 and args.dataloader_persistent_workers
+    assert args.dataloader_prefetch_factor == 4
+    assert default_training_args(tmp_path, num_workers=0).dataloader_prefetch_factor is None
+    assert default_training_args(tmp_path).dataloader_num_workers == 0  # pas de workers imposés par défaut
+    assert default_training_args(tmp_path, block_size=4096).gradient_checkpointing
+    assert not default_training_args(tmp_path, block_size=1024).gradient_checkpointing
+    # champs passés à la construction (pas modifiés après coup)
+    args = default_training_args(tmp_path, use_cpu=True, max_steps=7)
+    assert args.use_cpu and args.max_steps == 7
+
+def test_collator_shares_labels_and_loading_runs_in_workers(monkeypatch):
+    import os
+    from bachgen.training.datasets import SimpleDataCollator
+    from bachgen.training.loader_bench import benchmark_loaders
+    from bachgen.training.train_gpt2 import auto_num_workers
+
+    batch = SimpleDataCollator()([SlowDataset()[i] for i in range(3)])
+    assert batch["labels"] is batch["input_ids"] and batch["input_ids"].shape == (3, 8)
+
+    # structure plutôt que chronométrage : qui a chargé les batches, et combien
+    def collate(items):
+        return {"input_ids": torch.stack([b["input_ids"] for b in items]), "pids": {b["pid"] for b in items}}
+    pids = {0: set(), 2: set()}
+    for w in pids:
+        res = benchmark_loaders(SlowDataset(), batch_size=4, worker_counts=(w,), n_batches=8, collate_fn=collate,
+                                step_fn=lambda b, w=w: pids[w].update(b["pids"]), verbose=False)
+        assert res[0]["batches"] == 8 and res[0]["num_workers"] == w
+    assert pids[0] == {os.getpid()}
+    assert len(pids[2]) == 2 and os.getpid() not in pids[2]
+
+    monkeypatch.setattr(os, "cpu_count", lambda: 16)
+    monkeypatch.setenv("LOCAL_WORLD_SIZE", "4")
+    assert auto_num_workers() == 3
+
+def test_train_gpt2_rejects_mismatched_eval_collator(tmp_path):
+    from transformers import GPT2Config, TrainingArguments
+    from bachgen.training.datasets import PackedDocumentDataset, RandomWindowDataset
+    from bachgen.training.train_gpt2 import train_gpt2
+
+    seqs = [list(range(4, 30)), list(range(4, 20))]
+    args = TrainingArguments(output_dir=str(tmp_path), max_steps=1, report_to="none", use_cpu=True, save_strategy="no")
+    config = GPT2Config(vocab_size=32, n_positions=16, n_embd=16, n_layer=1, n_head=2)
+    train_ds = RandomWindowDataset(seqs, block_size=16, samples_per_epoch=4)
+    # SimpleDataCollator perdrait position_ids et compterait le padding dans la loss d'éval
+    with pytest.raises(ValueError, match="collators différents"):
+        train_gpt2(train_ds, PackedDocumentDataset(seqs, block_size=16, verbose=False), config, args)
+
+def test_make_datasets_combinations_train_and_evaluate(tmp_path):
+    import itertools
+    from transformers import GPT2Config, TrainingArguments
+    from bachgen.training.augment import TranspositionTables
+    from bachgen.training.train_gpt2 import evaluate, make_datasets, train_gpt2
+    from bachgen.vocab_utils import Vocab
+
+    tokens = ["[PAD]", "[UNK]", "<BOS>", "<EOS>", "R", "L", "bar", "clef_treble", "key_natural_0", "time_4/4",
+              "note_C4", "note_E4", "note_G4", "len_1/4"]
+    vocab = Vocab({t: i for i, t in enumerate(tokens)})
+    bar = "bar note_C4 len_1/4 note_E4 len_1/4 note_G4 len_1/4"
+    docs = [vocab.encode(f"<BOS> R bar clef_treble key_natural_0 time_4/4 {' '.join([bar] * n)} <EOS>".split()).tolist()
+            for n in (3, 5, 4)]
+    config = GPT2Config(vocab_size=len(vocab), n_positions=16, n_embd=16, n_layer=1, n_head=2)
+    args = TrainingArguments(output_dir=str(tmp_path), max_steps=1, per_device_train_batch_size=2,
+                             report_to="none", use_cpu=True, save_strategy="no")
+    tables = TranspositionTables(vocab, shifts=(-2, 0, 2))
+
+    modes = [{}, {"packing": True}, {"random_windows": True, "samples_per_epoch": 4}, {"bar_aligned_vocab": vocab}]
+    for mode, transpose in itertools.product(modes, (None, tables)):
+        train_ds, valid_ds, test_ds = make_datasets(docs, docs, docs, block_size=16, transpose_tables=transpose, **mode)
+        trainer, _ = train_gpt2(train_ds, valid_ds, config, args)
+        loss, ppl = evaluate(trainer, test_ds)
+        assert np.isfinite(loss) and ppl > 1, mode
+
+    for bad in ({"packing": True, "random_windows": True}, {"packing": True, "bar_aligned_vocab": vocab},
+                {"random_windows": True, "bar_aligned_vocab": vocab}):
+        with pytest.raises(ValueError):
+            make_datasets(docs, docs, docs, block_size=16, **bad)
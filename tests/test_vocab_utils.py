@@ -0,0 +1,174 @@
+import numpy as np
+from bachgen.vocab_utils import (
+    PackedCorpus, PackedCorpusWriter, Vocab, build_vocab, file_stem, decode_ids, decode_ids_file, encode_dir_to_ids, encode_dir_to_packed,
+    encode_tokens, pack_ids_dir, save_vocab, scan_token_files,
+)
+from bachgen.training.splits import load_all_ids, load_split, read_ids_file, save_split_packed
+
+def write_token_dir(root):
+    token_dir = root / "tokens"
+    token_dir.mkdir()
+    (token_dir / "a.txt").write_text("R bar note_C4 len_4 L bar note_C3 len_4", encoding="utf-8")
+    (token_dir / "b.txt").write_text("R bar rest len_4 L bar", encoding="utf-8")
+    (token_dir / "c.txt").write_text("", encoding="utf-8")
+    return token_dir
+
+def test_packed_corpus_matches_ids_txt(tmp_path):
+    token_dir = write_token_dir(tmp_path)
+    token2id, _ = build_vocab(sorted(token_dir.glob("*.txt")))
+    encode_dir_to_ids(token_dir, tmp_path / "ids", token2id)
+    expected = {f.name.split(".")[0]: read_ids_file(f) for f in sorted((tmp_path / "ids").glob("*.ids.txt"))}
+
+    corpus = encode_dir_to_packed(token_dir, tmp_path / "packed", token2id)
+    assert corpus.tokens.dtype == np.uint16
+    assert isinstance(corpus.tokens, np.memmap)
+    assert corpus.stems == ["a", "b", "c"]
+    assert corpus.meta["vocab_fingerprint"] == Vocab(token2id).fingerprint
+    assert corpus.lengths.tolist() == [len(expected[s]) for s in corpus.stems]
+    assert corpus.doc("a").tolist() == expected["a"]
+    assert corpus[-1].tolist() == expected["c"] == []
+
+    repacked = pack_ids_dir(tmp_path / "ids", tmp_path / "repacked", vocab_size=len(token2id))
+    assert repacked.to_lists() == corpus.to_lists()
+    assert load_all_ids(tmp_path / "packed") == [ids for ids in corpus.to_lists() if ids]
+
+def test_dotted_stems_stay_distinct(tmp_path):
+    assert [file_stem(n) for n in ("a.b.musicxml", "a.c.ids.txt", "x.txt", "noext")] == ["a.b", "a.c", "x", "noext"]
+    token_dir = tmp_path / "tokens"
+    token_dir.mkdir()
+    for name in ("op.10.txt", "op.11.txt"):
+        (token_dir / name).write_text("R bar rest len_4", encoding="utf-8")
+    token2id, _ = build_vocab(sorted(token_dir.glob("*.txt")))
+    assert encode_dir_to_packed(token_dir, tmp_path / "packed", token2id).stems == ["op.10", "op.11"]
+
+def test_packed_writer_opens_lazily(tmp_path):
+    w = PackedCorpusWriter(tmp_path / "lazy", vocab_size=8)
+    assert not (tmp_path / "lazy" / "tokens.bin").exists()
+    w.add([2, 3])
+    del w  # jamais fermé : le fichier est fermé au ramasse-miettes, sans meta.json
+    assert not (tmp_path / "lazy" / "meta.json").exists()
+    with PackedCorpusWriter(tmp_path / "empty", vocab_size=8):
+        pass
+    assert PackedCorpus(tmp_path / "empty").n_tokens == 0
+
+def test_save_split_packed(tmp_path):
+    seqs = [[2, 5, 6, 3], [2, 3], [2, 7, 7, 7, 3]]
+    save_split_packed(seqs, tmp_path / "train", vocab_size=8)
+    assert load_split(tmp_path / "train") == seqs
+    assert PackedCorpus(tmp_path / "train").n_tokens == 11
+
+def test_vocab_matches_dict_helpers(tmp_path):
+    import torch
+
+    token_dir = write_token_dir(tmp_path)
+    token2id, id2token = build_vocab(sorted(token_dir.glob("*.txt")))
+    vocab = Vocab(token2id)
+    tokens = "R bar note_C4 note_Z9 len_4 L bar".split()
+
+    ids = vocab.encode(tokens, add_bos=True, add_eos=True)
+    assert ids.dtype == np.uint16
+    assert ids.tolist() == encode_tokens(tokens, token2id, add_bos=True, add_eos=True)
+    assert vocab.decode(ids) == decode_ids(ids.tolist(), id2token)
+    assert vocab.decode(torch.tensor(ids.astype(np.int64)), drop_specials=True) == [t for t in tokens if t != "note_Z9"]
+    assert vocab.decode([0, 999, -1]) == ["[PAD]", "[UNK]", "[UNK]"]
+    assert vocab.is_special(ids).tolist() == [True, False, False, False, True, False, False, False, True]
+
+    flat, offsets = vocab.encode_batch(["R bar L bar", tokens], add_bos=True)
+    assert offsets.tolist() == [0, 5, 13]
+    assert vocab.decode_batch(flat, offsets, drop_specials={"<BOS>"}) == [["R", "bar", "L", "bar"], tokens[:3] + ["[UNK]"] + tokens[4:]]
+
+def test_vocab_load_is_cached(tmp_path):
+    save_vocab(tmp_path / "vocab.json", {"[PAD]": 0, "[UNK]": 1, "R": 2, "bar": 3})
+    (tmp_path / "x.ids.txt").write_text("2 3 0", encoding="utf-8")
+    assert Vocab.load(tmp_path / "vocab.json") is Vocab.load(tmp_path / "vocab.json")
+    assert decode_ids_file(tmp_path / "x.ids.txt", tmp_path / "vocab.json") == "R bar [PAD]"
+
+def test_parallel_scan_matches_sequential(tmp_path):
+    from bachgen.vocab_pipeline import build_and_encode
+
+    token_dir = write_token_dir(tmp_path)
+    (token_dir / "d.txt").write_text("R bar note_D4 len_2 note_D4 len_2\nL bar rest len_4\n", encoding="utf-8")
+    files = sorted(token_dir.glob("*.txt"))
+    assert build_vocab(files, workers=2) == build_vocab(files)
+
+    token2id, size = build_and_encode(token_dir, tmp_path / "vocab.json", tmp_path / "ids", workers=2,
+                                      file_counts_csv=tmp_path / "counts.csv")
+    encode_dir_to_ids(token_dir, tmp_path / "ref", token2id)
+    for f in sorted((tmp_path / "ref").glob("*.ids.txt")):
+        assert (tmp_path / "ids" / f.name).read_text() == f.read_text()
+    assert (tmp_path / "counts.csv").read_text().splitlines()[1:] == ["a.txt,8,0", "b.txt,6,0", "c.txt,0,0", "d.txt,10,0"]
+
+    # vocab figé : comptage + encodage en une seule lecture, les inconnus sont comptés
+    frozen = {t: i for i, t in enumerate(["[PAD]", "[UNK]", "<BOS>", "<EOS>", "R", "L", "bar", "rest", "len_4", "len_2"])}
+    _, per_file = scan_token_files(files, workers=2, token2id=frozen, ids_dir=tmp_path / "frozen")
+    assert per_file["d.txt"] == {"tokens": 10, "unk": 2}
+    assert read_ids_file(tmp_path / "frozen" / "d.ids.txt")[:5] == [2, 4, 6, 1, 9]
+
+def test_incremental_encoding_and_append_only_vocab(tmp_path):
+    from bachgen.vocab_pipeline import build_and_encode
+    from bachgen.vocab_utils import encode_dir_incremental, load_manifest, vocab_fingerprint
+
+    token_dir = write_token_dir(tmp_path)
+    vocab_path, ids_dir = tmp_path / "vocab.json", tmp_path / "ids"
+    v1, _ = build_and_encode(token_dir, vocab_path, ids_dir, workers=1, incremental=True)
+    manifest = load_manifest(ids_dir)
+    assert manifest["vocab_fingerprint"] == vocab_fingerprint(v1)
+    assert manifest["files"]["a.txt"]["vocab_fingerprint"] == vocab_fingerprint(v1)
+    assert vocab_fingerprint(dict(reversed(list(v1.items())))) == vocab_fingerprint(v1)
+
+    # rien n'a changé : aucun fichier ré-encodé
+    assert encode_dir_incremental(token_dir, ids_dir, v1, verbose=False)["encoded"] == []
+
+    # nouvelle partition avec de nouveaux tokens : ids existants stables, seul le nouveau fichier est encodé
+    a_ids = (ids_dir / "a.ids.txt").read_text()
+    (token_dir / "e.txt").write_text("R bar note_G5 len_1/2 L bar", encoding="utf-8")
+    v2, size = build_and_encode(token_dir, vocab_path, ids_dir, workers=1, incremental=True)
+    assert all(v2[t] == i for t, i in v1.items())
+    assert sorted(set(v2) - set(v1)) == ["len_1/2", "note_G5"] and size == len(v1) + 2
+    assert load_manifest(ids_dir)["files"]["a.txt"]["vocab_fingerprint"] == vocab_fingerprint(v1)
+    assert load_manifest(ids_dir)["files"]["e.txt"]["vocab_fingerprint"] == vocab_fingerprint(v2)
+    assert (ids_dir / "a.ids.txt").read_text() == a_ids
+
+    # une source modifiée est ré-encodée ; un vocab non compatible force tout
+    (token_dir / "b.txt").write_text("R bar rest len_2 L bar", encoding="utf-8")
+    assert encode_dir_incremental(token_dir, ids_dir, v2, verbose=False)["encoded"] == ["b.txt"]
+    shuffled = {t: len(v2) - 1 - i for t, i in v2.items()}
+    assert len(encode_dir_incremental(token_dir, ids_dir, shuffled, verbose=False)["encoded"]) == 4
+
+def test_hash_splits_are_stable_and_streamed(tmp_path):
+    import random
+    from bachgen.training.splits import (
+        build_split_index, iter_split, load_split_index, save_split_index, split_of, split_sequences,
+    )
+
+    seqs = [[2, i, 3] for i in range(4, 40)]
+    save_split_packed(seqs, tmp_path / "packed", vocab_size=64)
+    index = build_split_index(tmp_path / "packed", train_ratio=0.6, valid_ratio=0.2)
+    assert set(index.values()) == {"train", "valid", "test"}
+    assert index == {s: split_of(s, 0.6, 0.2) for s in index}
+
+    # ajouter des fichiers ne déplace pas les anciens
+    save_split_packed(seqs + [[2, 50, 3], [2, 51, 3]], tmp_path / "packed2", vocab_size=64)
+    bigger = build_split_index(tmp_path / "packed2", train_ratio=0.6, valid_ratio=0.2)
+    assert all(bigger[s] == split for s, split in index.items())
+
+    save_split_index(index, tmp_path)
+    assert load_split_index(tmp_path) == index
+    train = [a.tolist() for a in iter_split(tmp_path / "packed", index, "train")]
+    assert train == [seqs[int(s)] for s in sorted(index, key=int) if index[s] == "train"]
+
+    # même affectation depuis un dossier de .ids.txt
+    ids_dir = tmp_path / "ids"
+    ids_dir.mkdir()
+    for i, s in enumerate(seqs):
+        (ids_dir / f"{i}.ids.txt").write_text(" ".join(map(str, s)), encoding="utf-8")
+    assert build_split_index(ids_dir, 0.6, 0.2) == index
+    assert sorted(a.tolist() for a in iter_split(ids_dir, index, "train")) == sorted(train)
+
+    # split_sequences ne touche plus à l'état global ni à la liste de l'appelant
+    random.seed(0)
+    expected = random.random()
+    random.seed(0)
+    original = list(seqs)
+    assert split_sequences(seqs, seed=1) == split_sequences(seqs, seed=1)
+    assert seqs == original and random.random() == expected